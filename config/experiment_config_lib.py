@@ -191,6 +191,13 @@ class ControllerConfig(object):
     """ information about the _real_ socket that the controller is listening on"""
     return self._server_info
 
+  def set_port(self, port):
+    ''' Move a TCP controller to another port, before it is booted. Only
+    affects start commands that use __port__. '''
+    assert self.port is not None, "Controller %s listens on a unix socket" % self.label
+    self.port = port
+    self._server_info = (self.address, port)
+
   def _expand_vars(self, s):
     return reduce(lambda s, (name, val): s.replace("__%s_port__" % name, str(val)), self.additional_ports.iteritems(), s) \
             .replace("__port__", str(self.port)) \
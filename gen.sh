@@ -22,16 +22,10 @@ generate_results(){
 #  done
 
   echo "==============================================="
-  echo "Running HB Graph WITHOUT alt-barr and delta=inf"
+  echo "Running HB Graph WITHOUT alt-barr and delta=inf,0..10"
   echo "==============================================="
-  ./sts/happensbefore/hb_graph.py ${result_dir}/hb.json  --no-dot-files --pkt --data-deps --ignore_ethertypes=0 2>&1 | tee -a "$teefile"
-  for x in {0..10};
-  do
-    echo "=============================================="
-    echo "Running HB Graph WITHOUT alt-barr and delta=$x"
-    echo "=============================================="
-    ./sts/happensbefore/hb_graph.py ${result_dir}/hb.json  --no-dot-files --pkt --rw_delta=$x --ww_delta=$x --hbt --data-deps --ignore_ethertypes=0 2>&1 | tee -a "$teefile"
-  done
+  # Load the trace only once and evaluate all deltas in the same process
+  ./sts/happensbefore/hb_graph.py ${result_dir}/hb.json  --no-dot-files --pkt --data-deps --ignore-ethertypes 0 --delta-sweep inf {0..10} 2>&1 | tee -a "$teefile"
 
 }
 
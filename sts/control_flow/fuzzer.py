@@ -264,6 +264,9 @@ class Fuzzer(ControlFlow):
             if halt:
               self.simulation.set_exit_code(5)
               break
+            if getattr(self.simulation.hb_logger, 'halt_requested', False):
+              log.info("Harmful race detected by the happens-before logger, halting")
+              break
             self.maybe_inject_trace_event()
           else:  # Initializing
             self.check_pending_messages(pass_through=True)
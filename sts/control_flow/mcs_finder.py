@@ -21,9 +21,9 @@ find the minimal causal sequence (MCS) of a failure.
 '''
 
 from sts.util.console import msg, color, Tee
-from sts.util.convenience import timestamp_string, ExitCode, create_clean_python_dir
+from sts.util.convenience import timestamp_string, ExitCode, create_clean_python_dir, find_port
 from sts.util.rpc_forker import LocalForker, test_serialize_response
-from sts.util.precompute_cache import PrecomputeCache
+from sts.util.precompute_cache import PrecomputeCache, ReplayResultCache
 from sts.replay_event import *
 from sts.event_dag import EventDag, split_list
 import sts.input_traces.log_parser as log_parser
@@ -34,7 +34,9 @@ from sts.control_flow.peeker import Peeker
 from config.invariant_checks import name_to_invariant_check
 
 from collections import Counter
+import bisect
 import copy
+import functools
 import sys
 import time
 import random
@@ -43,6 +45,41 @@ import json
 import os
 import re
 
+def controller_port_isolated(controller_config):
+  ''' Whether replays running at the same time can each boot the controller
+  on a port of their own (see ControllerConfig.set_port) '''
+  c = controller_config
+  return (hasattr(c, "set_port") and c.port is not None and "__port__" in c.start_cmd and
+          not c.sync and not c.config_file and not c.additional_ports and
+          not c.snapshot_address and not c.launch_in_network_namespace)
+
+def stable_repr(value):
+  ''' repr() of configuration values that does not depend on the process,
+  i.e. without object addresses. Functions and classes are named by their
+  module and name, other objects only by their class. '''
+  if value is None or isinstance(value, (bool, int, long, float, basestring)):
+    return repr(value)
+  if isinstance(value, (list, tuple)):
+    return "[%s]" % ", ".join(stable_repr(v) for v in value)
+  if isinstance(value, dict):
+    return "{%s}" % ", ".join(sorted("%s: %s" % (stable_repr(k), stable_repr(v))
+                                     for k, v in value.items()))
+  if isinstance(value, functools.partial):
+    return "partial(%s, %s, %s)" % (stable_repr(value.func), stable_repr(value.args),
+                                    stable_repr(value.keywords or {}))
+  if hasattr(value, "__name__") and hasattr(value, "__module__"):
+    return "%s.%s" % (value.__module__, value.__name__)
+  return "<%s.%s>" % (type(value).__module__, type(value).__name__)
+
+# Attributes of controller and simulation configs that affect replays
+controller_config_key_attributes = ["label", "start_cmd", "kill_cmd", "restart_cmd",
+                                    "address", "port", "sync", "cwd"]
+simulation_config_key_attributes = ["_topology_class", "_topology_params",
+                                    "_patch_panel_class", "_dataplane_trace_path",
+                                    "_violation_persistence_threshold",
+                                    "multiplex_sockets", "interpose_on_controllers",
+                                    "ignore_interposition"]
+
 class MCSFinder(ControlFlow):
   def __init__(self, simulation_cfg, superlog_path_or_dag,
                invariant_check_name="", bug_signature="", transform_dag=None,
@@ -50,10 +87,24 @@ class MCSFinder(ControlFlow):
                max_replays_per_subsequence=1,
                optimized_filtering=False, forker=LocalForker(),
                replay_final_trace=True, strict_assertion_checking=False,
-               no_violation_verification_runs=None,
-               **kwargs):
+               no_violation_verification_runs=None, parallel_replays=1,
+               replay_cache_path=None, **kwargs):
     ''' Note that you may pass in any keyword argument for Replayer to
-    MCSFinder, except 'bug_signature' and 'invariant_check_name' '''
+    MCSFinder, except 'bug_signature' and 'invariant_check_name'
+
+    If parallel_replays is greater than 1, the subsets and complements of
+    each delta debugging round are replayed in up to parallel_replays forked
+    children at once. Each child boots the controllers on free ports of its
+    own, so every controller must listen on the __port__ of its start_cmd,
+    without sync URIs, config files, additional ports, snapshot sockets or
+    network namespaces (see controller_port_isolated). Other resources are
+    still shared: the controllers of all children run in the same cwd, so
+    they must not write to fixed files there. Given that, the resulting MCS
+    is the same as with serial replays.
+
+    If replay_cache_path is set, the results of delta debugging replays are
+    appended to that file, and replays of the same trace and configuration
+    that an earlier run already did are skipped. '''
     super(MCSFinder, self).__init__(simulation_cfg)
     # number of subsequences delta debugging has examined so far, for
     # distingushing runtime stats from different intermediate runs.
@@ -122,6 +173,16 @@ class MCSFinder(ControlFlow):
     # Whether to try alternate trace splitting techiques besides splitting by time.
     self.optimized_filtering = optimized_filtering
     self.forker = forker
+    if parallel_replays > 1 and not hasattr(forker, "start"):
+      raise ValueError("parallel_replays requires a forker with start(), e.g. LocalForker")
+    if parallel_replays > 1:
+      for controller_config in self.simulation_cfg.controller_configs:
+        if not controller_port_isolated(controller_config):
+          raise ValueError("parallel_replays requires controllers that only listen on the "
+                           "__port__ of their start_cmd: %s" % controller_config.label)
+    self.parallel_replays = parallel_replays
+    self.replay_cache_path = replay_cache_path
+    self.replay_cache = None
     self.replay_final_trace = replay_final_trace
     self.strict_assertion_checking = strict_assertion_checking
 
@@ -177,6 +238,12 @@ class MCSFinder(ControlFlow):
     if len(self.dag) == 0:
       raise RuntimeError("No supported input types?")
 
+    if self.replay_cache_path is not None:
+      self.replay_cache = ReplayResultCache(self.replay_cache_path,
+                                            self._replay_cache_run_key())
+      self.log("Using %d cached replay results from %s" %
+               (len(self.replay_cache.results), self.replay_cache_path))
+
     if check_reproducibility:
       # First, run through without pruning to verify that the violation exists
       self._runtime_stats.record_replay_start()
@@ -201,6 +268,9 @@ class MCSFinder(ControlFlow):
 
     # Invoke delta debugging
     (dag, total_inputs_pruned) = self._ddmin(self.dag, 2, precompute_cache=precompute_cache)
+    if self.replay_cache is not None:
+      self.replay_cache.close()
+      self.replay_cache = None
     # Make sure to track the final iteration size
     self._track_iteration_size(total_inputs_pruned)
     self.dag = dag
@@ -261,6 +331,10 @@ class MCSFinder(ControlFlow):
 
     subsets = split_list(dag.input_events, split_ways)
     self.log("Subsets:\n"+"\n".join(print_subset(local_label(i), s) for i, s in enumerate(subsets)))
+    replayed = None
+    if self.parallel_replays > 1:
+      replayed = self._replay_round_in_parallel(dag, subsets, local_label,
+                                                precompute_cache)
     for i, subset in enumerate(subsets):
       label = local_label(i)
       new_dag = dag.input_subset(subset)
@@ -275,7 +349,7 @@ class MCSFinder(ControlFlow):
         continue
 
       self._track_iteration_size(total_inputs_pruned)
-      violation = self._check_violation(new_dag, i, label)
+      violation = self._check_violation(new_dag, i, label, replayed)
       if violation:
         self.log_violation("Subset %s reproduced violation. Subselecting." % subset_label(label))
         self.mcs_log_tracker.maybe_dump_intermediate_mcs(total_inputs_pruned, new_dag,
@@ -303,7 +377,7 @@ class MCSFinder(ControlFlow):
         continue
 
       self._track_iteration_size(total_inputs_pruned)
-      violation = self._check_violation(new_dag, i, label)
+      violation = self._check_violation(new_dag, i, label, replayed)
       if violation:
         self.log_violation("Subset %s reproduced violation. Subselecting." % subset_label(label))
         self.mcs_log_tracker.maybe_dump_intermediate_mcs(total_inputs_pruned, new_dag,
@@ -323,14 +397,158 @@ class MCSFinder(ControlFlow):
                          total_inputs_pruned=total_inputs_pruned)
     return (dag, total_inputs_pruned)
 
+  def _replay_cache_run_key(self):
+    ''' Digest of the trace and of the configuration that affects replays '''
+    superlog_path = getattr(self, "superlog_path", None)
+    if superlog_path is not None:
+      with open(superlog_path) as f:
+        trace_digest = ReplayResultCache.digest(f.read())
+    else:
+      trace_digest = ReplayResultCache.digest(*[ "%s %s" % (e.label, e.fingerprint)
+                                                 for e in self.dag.events ])
+    # N.B. str() of the configs contains object addresses, which differ
+    # between runs
+    controllers = [ [ getattr(c, attr, None) for attr in controller_config_key_attributes ]
+                    for c in self.simulation_cfg.controller_configs ]
+    simulation = [ getattr(self.simulation_cfg, attr, None)
+                   for attr in simulation_config_key_attributes ]
+    return ReplayResultCache.digest(trace_digest, stable_repr(controllers),
+                                    stable_repr(simulation),
+                                    self.invariant_check_name, self.bug_signature,
+                                    self.max_replays_per_subsequence,
+                                    stable_repr(self.kwargs))
+
   # N.B. always called by the parent process.
   def _track_iteration_size(self, total_inputs_pruned):
     self._runtime_stats.record_iteration_size(len(self.dag.input_events) - total_inputs_pruned)
 
+  def _cached_replay_result(self, input_sequence):
+    if self.replay_cache is None:
+      return None
+    return self.replay_cache.get([ e.label for e in input_sequence ])
+
   # N.B. always called by the parent process.
-  def _check_violation(self, new_dag, subset_index, label):
-    ''' Check if there were violations '''
-    (bug_found, i) = self.replay_max_iterations(new_dag, label)
+  def _replay_round_in_parallel(self, dag, subsets, local_label, precompute_cache):
+    '''
+    Replays the subsets and then the complements of one ddmin round, in the
+    order in which _ddmin checks them, in up to self.parallel_replays forked
+    children at once. Once a subset or complement reproduced the violation,
+    the ones after it are cancelled, since _ddmin does not get to them.
+
+    Returns { input sequence -> (bug found, 0-indexed iteration at which bug
+    was found, replayed dag, labels of timed out internal events) }.
+    '''
+    # [input sequence, label, dag, transformed], skipping the ones _ddmin skips
+    tests = []
+    seen = set()
+    cached_violation = False
+    for inverse, input_dag in [(False, dag.input_subset), (True, dag.input_complement)]:
+      for i, subset in enumerate(subsets):
+        new_dag = input_dag(subset)
+        input_sequence = tuple(new_dag.input_events)
+        if (input_sequence == () or input_sequence in seen or
+            precompute_cache.already_done(input_sequence)):
+          continue
+        seen.add(input_sequence)
+        cached = self._cached_replay_result(input_sequence)
+        if cached is not None:
+          # _ddmin does not get past a cached violation
+          cached_violation = cached[0]
+          if cached_violation:
+            break
+          continue
+        tests.append([input_sequence, local_label(i, inverse), new_dag, False])
+      if cached_violation:
+        break
+    self.log("Replaying %d subsets and complements in up to %d children" %
+             (len(tests), self.parallel_replays))
+
+    replayed = {}
+    iterations = [0] * len(tests)
+    pending = range(len(tests)) # sorted
+    running = {} # child -> index into tests
+    child_ports = {} # child -> controller ports
+    first_violation = len(tests)
+    try:
+      while True:
+        while pending and len(running) < self.parallel_replays:
+          index = pending.pop(0)
+          test = tests[index]
+          if self.transform_dag and not test[3]:
+            log.info("Transforming dag")
+            test[2] = self.transform_dag(test[2])
+            test[3] = True
+          (results_dir, subsequence_id) = self._prepare_replay(test[2], test[1])
+          controller_ports = self._free_controller_ports(child_ports.values())
+          child = self.forker.start("play_forward", results_dir, subsequence_id,
+                                    controller_ports)
+          running[child] = index
+          child_ports[child] = controller_ports
+        if not running:
+          break
+        (child, child_return) = self.forker.wait_any(running.keys())
+        index = running.pop(child)
+        del child_ports[child]
+        (violation_found, client_runtime_stats, timed_out_internal) = child_return
+        self._runtime_stats.merge_client_dict(client_runtime_stats)
+        if not violation_found and iterations[index] + 1 < self.max_replays_per_subsequence:
+          iterations[index] += 1
+          bisect.insort(pending, index)
+          continue
+        (input_sequence, _, new_dag, _) = tests[index]
+        replayed[input_sequence] = (violation_found, iterations[index], new_dag,
+                                    timed_out_internal)
+        if self.replay_cache is not None:
+          self.replay_cache.update([ e.label for e in input_sequence ],
+                                   violation_found, iterations[index],
+                                   timed_out_internal)
+        if violation_found and index < first_violation:
+          first_violation = index
+          pending = [ i for i in pending if i < first_violation ]
+          for other, other_index in running.items():
+            if other_index > first_violation:
+              self.forker.cancel(other)
+              del running[other]
+              del child_ports[other]
+    finally:
+      # Kill the remaining children even if one of them cannot be cancelled
+      for child in running:
+        try:
+          self.forker.cancel(child)
+        except Exception as e:
+          log.warn("Could not cancel child %d: %s" % (child.pid, e))
+    return replayed
+
+  # N.B. always called by the parent process.
+  def _free_controller_ports(self, taken):
+    ''' A free port for each controller, other than the ones in the lists of
+    taken ports of the running children '''
+    taken = set(port for ports in taken for port in ports)
+    ports = []
+    for _ in self.simulation_cfg.controller_configs:
+      port = find_port([ p for p in xrange(7000, 9000) if p not in taken ])
+      taken.add(port)
+      ports.append(port)
+    return ports
+
+  # N.B. always called by the parent process.
+  def _check_violation(self, new_dag, subset_index, label, replayed=None):
+    ''' Check if there were violations. replayed holds the results of
+    _replay_round_in_parallel, if any. '''
+    input_sequence = tuple(new_dag.input_events)
+    cached = self._cached_replay_result(input_sequence)
+    if replayed is not None and input_sequence in replayed:
+      (bug_found, i, replayed_dag, timed_out_internal) = replayed[input_sequence]
+      replayed_dag.set_events_as_timed_out(timed_out_internal)
+    elif cached is not None:
+      self.log("Replayed by an earlier run. Using its result")
+      (bug_found, i, timed_out_internal) = cached
+      new_dag.set_events_as_timed_out(timed_out_internal)
+    else:
+      (bug_found, i) = self.replay_max_iterations(new_dag, label)
+      if self.replay_cache is not None:
+        self.replay_cache.update([ e.label for e in input_sequence ], bug_found, i,
+                                 [ e.label for e in new_dag.events if e.timed_out ])
     # Violation in the subset
     if bug_found:
       self.log_violation("Violation! Considering %d'th" % subset_index)
@@ -362,15 +580,41 @@ class MCSFinder(ControlFlow):
 
   def replay(self, new_dag, label, ignore_runtime_stats=False):
     # Run the simulation forward
+    (results_dir, subsequence_id) = self._prepare_replay(new_dag, label)
+    (violation_found, client_runtime_stats,
+                 timed_out_internal) = self.forker.fork("play_forward",
+                                                        results_dir,
+                                                        subsequence_id)
+    new_dag.set_events_as_timed_out(timed_out_internal)
+
+    if not ignore_runtime_stats:
+      self._runtime_stats.merge_client_dict(client_runtime_stats)
+
+    return violation_found
+
+  def _prepare_replay(self, new_dag, label):
+    ''' Registers the "play_forward" task for new_dag. Returns its arguments. '''
     self._runtime_stats.record_replay_stats(len(new_dag.input_events))
+    # TODO(cs): once play_forward() is no longer a closure, register it only once
+    self.forker.register_task("play_forward", self._play_forward_task(new_dag))
+    results_dir = self.replay_log_tracker.get_replay_logger_dir(label)
+    self.subsequence_id += 1
+    return (results_dir, self.subsequence_id)
 
+  def _play_forward_task(self, new_dag):
     # N.B. this function is run as a child process.
-    def play_forward(results_dir, subsequence_id):
+    def play_forward(results_dir, subsequence_id, controller_ports=None):
       # TODO(cs): need to serialize the parameters to Replayer rather than
       # wrapping them in a closure... otherwise, can't use RemoteForker
       # TODO(aw): MCSFinder needs to configure Simulation to always let DataplaneEvents pass through
       create_clean_python_dir(results_dir)
 
+      # Replays that run at the same time use their own controller ports
+      if controller_ports is not None:
+        for (controller_config, port) in zip(self.simulation_cfg.controller_configs,
+                                             controller_ports):
+          controller_config.set_port(port)
+
       # Copy stdout and stderr to a file "replay.out"
       tee = Tee(open(os.path.join(results_dir, "replay.out"), "w"))
       tee.tee_stdout()
@@ -404,21 +648,7 @@ class MCSFinder(ControlFlow):
         test_serialize_response(violations, self._runtime_stats.client_dict())
       timed_out_internal = [ e.label for e in new_dag.events if e.timed_out ]
       return (simulation.violation_found, self._runtime_stats.client_dict(), timed_out_internal)
-
-    # TODO(cs): once play_forward() is no longer a closure, register it only once
-    self.forker.register_task("play_forward", play_forward)
-    results_dir = self.replay_log_tracker.get_replay_logger_dir(label)
-    self.subsequence_id += 1
-    (violation_found, client_runtime_stats,
-                 timed_out_internal) = self.forker.fork("play_forward",
-                                                        results_dir,
-                                                        self.subsequence_id)
-    new_dag.set_events_as_timed_out(timed_out_internal)
-
-    if not ignore_runtime_stats:
-      self._runtime_stats.merge_client_dict(client_runtime_stats)
-
-    return violation_found
+    return play_forward
 
   def _optimize_event_dag(self):
     ''' Employs domain knowledge of event classes to reduce the size of event
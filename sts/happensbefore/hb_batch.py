@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Runs the HB analysis (hb_graph.py) for many traces in parallel.
+
+A job is a trace directory and a list of hb_graph.py options. The jobs run
+in a pool of worker processes. A finished job leaves a stamp file in the
+trace directory, keyed on a hash of hb.json, the options and the analysis
+code. The job is skipped as long as none of them change. The summary csv
+files of a trace (format_results.py) are rebuilt when any of its jobs ran.
+
+Sample usage:
+./sts/happensbefore/hb_batch.py -j 8 traces/
+./sts/happensbefore/hb_batch.py traces/trace_floodlight_forwarding --options="--no-dot-files --pkt"
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../.."))
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import shlex
+import time
+import traceback
+
+import hb_graph
+
+
+# Options used by gen.sh
+DEFAULT_OPTIONS = ['--no-dot-files', '--pkt', '--data-deps',
+                   '--ignore-ethertypes', '0',
+                   '--delta-sweep', 'inf'] + [str(x) for x in range(11)]
+
+TRACE_FILE = 'hb.json'
+# size, mtime and hash of the last hashed hb.json of a trace directory
+TRACE_HASH_FILE = '.hb_batch_trace_hash.json'
+STAMP_PREFIX = '.hb_batch_done_'
+OUTPUT_FILE = 'hb_batch_%s.out'
+FORMAT_OUTPUT_FILE = 'hb_batch_format_results.out'
+
+
+def file_sha1(filename):
+  sha1 = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), ''):
+      sha1.update(chunk)
+  return sha1.hexdigest()
+
+
+def code_sha1():
+  """Hash of the analysis code, so that results are redone after changes."""
+  sha1 = hashlib.sha1()
+  for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hb_*.py'))):
+    with open(filename, 'rb') as f:
+      sha1.update(f.read())
+  return sha1.hexdigest()
+
+
+def write_json_atomic(filename, obj):
+  tmp = '%s.%d.tmp' % (filename, os.getpid())
+  with open(tmp, 'w') as f:
+    json.dump(obj, f)
+  os.rename(tmp, filename)
+
+
+def trace_sha1(trace_dir):
+  """
+  Content hash of the hb.json of trace_dir. Only rehashed if the size or
+  modification time of hb.json changed since it was last hashed.
+  """
+  trace_file = os.path.join(trace_dir, TRACE_FILE)
+  stat = os.stat(trace_file)
+  hash_file = os.path.join(trace_dir, TRACE_HASH_FILE)
+  try:
+    with open(hash_file) as f:
+      cached = json.load(f)
+    if cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+      return cached['sha1']
+  except (IOError, ValueError, KeyError):
+    pass
+  sha1 = file_sha1(trace_file)
+  write_json_atomic(hash_file, {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1})
+  return sha1
+
+
+def job_key(trace_hash, options, code_hash):
+  return hashlib.sha1(json.dumps([trace_hash, options, code_hash])).hexdigest()
+
+
+def stamps(trace_dir):
+  """Yields (filename, content) of the stamp files of finished jobs."""
+  for filename in glob.glob(os.path.join(trace_dir, STAMP_PREFIX + '*.json')):
+    try:
+      with open(filename) as f:
+        yield filename, json.load(f)
+    except (IOError, ValueError):
+      pass
+
+
+def run_job(job):
+  """
+  Runs hb_graph.py with the options of job on its trace, unless the results
+  are cached. Returns (job, status, elapsed time), status is one of 'cached',
+  'done' and 'failed'. Runs in a worker process.
+  """
+  trace_dir, options, code_hash, force = job
+  t0 = time.time()
+  key = job_key(trace_sha1(trace_dir), options, code_hash)
+  stamp = os.path.join(trace_dir, STAMP_PREFIX + key + '.json')
+  if not force and os.path.exists(stamp):
+    return job, 'cached', time.time() - t0
+
+  # Stamps of earlier runs with the same options are no longer valid
+  for filename, content in stamps(trace_dir):
+    if content.get('options') == options:
+      os.remove(filename)
+      output = os.path.join(trace_dir, content.get('output', OUTPUT_FILE % 'none'))
+      if os.path.exists(output):
+        os.remove(output)
+
+  status = 'done'
+  output = OUTPUT_FILE % key[:8]
+  stdout, stderr = sys.stdout, sys.stderr
+  with open(os.path.join(trace_dir, output), 'w') as out:
+    out.write("hb_graph.py %s\n" % ' '.join(options))
+    sys.stdout = sys.stderr = out
+    try:
+      args = hb_graph.parse_args([os.path.join(trace_dir, TRACE_FILE)] + options)
+      hb_graph.create_main(args).run()
+    except (Exception, SystemExit):
+      traceback.print_exc()
+      status = 'failed'
+    finally:
+      sys.stdout, sys.stderr = stdout, stderr
+  if status == 'done':
+    write_json_atomic(stamp, {'options': options, 'output': output,
+                              'finished': time.time()})
+  return job, status, time.time() - t0
+
+
+def format_results(trace_dir):
+  """Runs format_results.py on trace_dir, like gen.sh. Runs in a worker process."""
+  import format_results
+  stdout = sys.stdout
+  with open(os.path.join(trace_dir, FORMAT_OUTPUT_FILE), 'w') as out:
+    sys.stdout = out
+    try:
+      format_results.main(trace_dir)
+    except Exception:
+      traceback.print_exc()
+      return trace_dir, 'failed'
+    finally:
+      sys.stdout = stdout
+  return trace_dir, 'done'
+
+
+def find_trace_dirs(paths, pattern):
+  """
+  Each path is either a trace directory (with a hb.json) or a directory with
+  trace directories matching pattern, like all_traces_generate_results.sh.
+  """
+  trace_dirs = []
+  for path in paths:
+    if os.path.isfile(os.path.join(path, TRACE_FILE)):
+      trace_dirs.append(path)
+    else:
+      for trace_dir in sorted(glob.glob(os.path.join(path, pattern))):
+        if os.path.isfile(os.path.join(trace_dir, TRACE_FILE)):
+          trace_dirs.append(trace_dir)
+  return [os.path.realpath(trace_dir) for trace_dir in trace_dirs]
+
+
+def run_batch(trace_dirs, option_sets, processes=None, force=False, format=True):
+  """
+  Runs all (trace directory, options) jobs in a pool of processes.
+  Returns a dict job status -> number of jobs.
+  """
+  code_hash = code_sha1()
+  jobs = [(trace_dir, options, code_hash, force)
+          for trace_dir in trace_dirs for options in option_sets]
+  counts = dict.fromkeys(['cached', 'done', 'failed'], 0)
+  changed_dirs = set()
+  # A fresh process for every job, forked from this one with hb_graph
+  # already imported
+  pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+  try:
+    for i, (job, status, elapsed) in enumerate(pool.imap_unordered(run_job, jobs)):
+      trace_dir, options = job[:2]
+      counts[status] += 1
+      if status != 'cached':
+        changed_dirs.add(trace_dir)
+      print "[%d/%d] %s %s (%.1f s) %s" % (i + 1, len(jobs), status, trace_dir,
+                                          elapsed, ' '.join(options))
+    if format:
+      format_dirs = [trace_dir for trace_dir in trace_dirs if trace_dir in changed_dirs or
+                     not os.path.exists(os.path.join(trace_dir, 'summary.csv'))]
+      for trace_dir, status in pool.imap_unordered(format_results, format_dirs):
+        print "Formatting results %s %s" % (status, trace_dir)
+    pool.close()
+  except KeyboardInterrupt:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  return counts
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Run hb_graph.py for many traces in parallel, skipping the "
+                "traces whose results are up to date.")
+  parser.add_argument('paths', nargs='+',
+                      help="Trace directories (with a hb.json) or directories containing them")
+  parser.add_argument('--pattern', dest='pattern', default='trace_*',
+                      help="Pattern for matching trace directories, default is \"trace_*\"")
+  parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                      help="Number of parallel jobs, default is the number of CPUs")
+  parser.add_argument('--options', dest='options', action='append', default=None,
+                      help="hb_graph.py options of a job, may be given several times. "
+                           "Default: %s" % ' '.join(DEFAULT_OPTIONS))
+  parser.add_argument('--force', dest='force', action='store_true', default=False,
+                      help="Rerun jobs even if their results are up to date")
+  parser.add_argument('--no-format', dest='format', action='store_false', default=True,
+                      help="Do not run format_results.py on the traces")
+  args = parser.parse_args()
+
+  option_sets = [shlex.split(x) for x in args.options] if args.options else [DEFAULT_OPTIONS]
+  trace_dirs = find_trace_dirs(args.paths, args.pattern)
+  print "%d trace directories, %d jobs" % (len(trace_dirs), len(trace_dirs) * len(option_sets))
+  t0 = time.time()
+  counts = run_batch(trace_dirs, option_sets, processes=args.jobs,
+                     force=args.force, format=args.format)
+  print "Done in %.1f s: %d cached, %d done, %d failed" % (
+    time.time() - t0, counts['cached'], counts['done'], counts['failed'])
+  if counts['failed']:
+    sys.exit(1)
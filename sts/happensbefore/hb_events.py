@@ -45,9 +45,10 @@ class HbEvent(JsonEvent):
     'msg_type': lambda x: ofp_type_rev_map[x],
     # ????
     'operations': lambda v: [JsonEvent.from_json(json.loads(x)) for x in v],
-    'dpid': lambda x: x,  # The unique per switch datapath ID
-    'controller_id': lambda x: x, # socket.getpeername(), NOT the STS cid (#NOTE (AH):  why not?)
-    'hid': lambda x: x,  # Host ID
+    # Values that repeat across events are shared, see intern_value
+    'dpid': intern_value,  # The unique per switch datapath ID
+    'controller_id': intern_value, # socket.getpeername(), NOT the STS cid (#NOTE (AH):  why not?)
+    'hid': intern_value,  # Host ID
     'packet': lambda x: decode_packet(x) if x else None,  # The content of the packet
     'in_port': lambda x: x,  # The ingress port number
     'out_port': lambda x: x,  # The egress port number
@@ -55,6 +56,17 @@ class HbEvent(JsonEvent):
     'msg_flowmod': base64_decode,  #NOTE (AH):  how is it different from the above?
   }
 
+  # Binary traces keep operations as nested dicts and packed messages and
+  # packets as bytes, see hb_trace_format
+  _binary_attrs = {
+    'msg_type': (lambda x: x, lambda x: x),
+    'operations': (lambda xs: [x.to_dict(binary=True) for x in xs],
+                   lambda v: [JsonEvent.from_dict(x, binary=True) for x in v]),
+    'packet': (packed_bytes, lambda x: unpack_packet(x) if x else None),
+    'msg': (packed_bytes, unpack_openflow),
+    'msg_flowmod': (packed_bytes, lambda x: x),
+  }
+
 
   def __init__(self, eid=None):
     super(HbEvent, self).__init__(eid=eid)
@@ -0,0 +1,139 @@
+"""
+Delta encoding of the flow table snapshots stored with each switch operation.
+
+Every flow table read/write/expiry/drop operation in the trace carries a full
+copy of the switch flow table. In the delta encoding the flow table of an
+operation is written as a dict instead of a list of base64 flow mods:
+
+  {'keyframe': [row, ...]}               the full table
+  {'removed': [i, ...],                  indices of the rows of the previous
+                                         table (of the same dpid) to drop
+   'added': [[i, row], ...]}             rows to insert, i is the index in
+                                         the new table
+
+Diffs are relative to the table of the previous operation of the same dpid
+in file order. A keyframe is written every keyframe_interval operations per
+dpid, so a damaged or truncated trace only loses a bounded number of tables.
+Traces with full tables (lists) are still read as before.
+"""
+
+from contextlib import contextmanager
+
+from hb_utils import base64_encode_flow_table
+
+
+def flow_table_diff(old_rows, new_rows):
+  """
+  Return the diff turning old_rows into new_rows, or None if new_rows can not
+  be expressed as removals and insertions that keep the order of the rows.
+  """
+  old_set = set(old_rows)
+  new_set = set(new_rows)
+  kept_old = [row for row in old_rows if row in new_set]
+  kept_new = [row for row in new_rows if row in old_set]
+  if kept_old != kept_new:
+    return None
+  return {'removed': [i for i, row in enumerate(old_rows) if row not in new_set],
+          'added': [[i, row] for i, row in enumerate(new_rows) if row not in old_set]}
+
+
+def apply_flow_table_diff(old_rows, diff):
+  removed = set(diff['removed'])
+  rows = [row for i, row in enumerate(old_rows) if i not in removed]
+  # insertions are sorted by their index in the new table
+  for i, row in diff['added']:
+    rows.insert(i, row)
+  return rows
+
+
+def map_flow_table_rows(encoded, fun):
+  """
+  Applies fun to the rows of an encoded flow table: a list of rows, a
+  keyframe or a diff.
+  """
+  if encoded is None:
+    return None
+  if isinstance(encoded, dict):
+    if 'keyframe' in encoded:
+      return {'keyframe': [fun(row) for row in encoded['keyframe']]}
+    return {'removed': encoded['removed'],
+            'added': [[i, fun(row)] for i, row in encoded['added']]}
+  return [fun(row) for row in encoded]
+
+
+class FlowTableDeltaEncoder(object):
+  """
+  Delta encodes the flow tables of operations, in the order they are written.
+  """
+
+  def __init__(self, keyframe_interval=100):
+    assert keyframe_interval > 0
+    self.keyframe_interval = keyframe_interval
+    self._rows = dict() # dpid -> rows of the last written table
+    self._since_keyframe = dict() # dpid -> diffs written since the last keyframe
+
+  def encode(self, dpid, flow_table):
+    # Zero XIDs so that identical entries have identical rows
+    rows = base64_encode_flow_table(flow_table, set_zero_XID=True)
+    old_rows = self._rows.get(dpid)
+    self._rows[dpid] = rows
+    if old_rows is not None and self._since_keyframe[dpid] < self.keyframe_interval:
+      diff = flow_table_diff(old_rows, rows)
+      if diff is not None:
+        self._since_keyframe[dpid] += 1
+        return diff
+    self._since_keyframe[dpid] = 0
+    return {'keyframe': rows}
+
+  @contextmanager
+  def encoded(self, event):
+    """
+    Replace the flow tables of the operations of event with their encoding
+    while the event is serialized.
+    """
+    saved = []
+    for op in getattr(event, 'operations', []):
+      flow_table = getattr(op, 'raw_flow_table', None)
+      if flow_table is not None:
+        saved.append((op, flow_table))
+        op.flow_table = self.encode(op.dpid, op.flow_table)
+    try:
+      yield event
+    finally:
+      for op, flow_table in saved:
+        op.flow_table = flow_table
+
+
+class FlowTableDeltaDecoder(object):
+  """
+  Rebuilds the full flow tables of delta encoded operations. Events have to
+  be passed to decode() in file order.
+
+  All tables are kept as tuples of rows (see TraceSwitchEvent.flow_table),
+  and identical rows are shared between the tables of a trace.
+  """
+
+  def __init__(self):
+    self._rows = dict() # dpid -> rows of the last decoded table
+    self._interned_rows = dict() # row -> the shared instance of the row
+
+  def _intern(self, rows):
+    return tuple(self._interned_rows.setdefault(row, row) for row in rows)
+
+  def decode(self, event):
+    for op in getattr(event, 'operations', []):
+      encoded = getattr(op, 'raw_flow_table', None)
+      if isinstance(encoded, dict):
+        if 'keyframe' in encoded:
+          rows = encoded['keyframe']
+        else:
+          assert op.dpid in self._rows, "Flow table diff without keyframe for dpid %s" % op.dpid
+          rows = apply_flow_table_diff(self._rows[op.dpid], encoded)
+        rows = self._intern(rows)
+        self._rows[op.dpid] = rows
+      elif isinstance(encoded, tuple):
+        rows = self._intern(encoded)
+      else:
+        continue
+      op.flow_table = rows
+    return event
@@ -6,7 +6,12 @@ import time
 sys.path.append(os.path.join(os.path.dirname(__file__), "../../pox"))
 
 import argparse
+import bisect
 from collections import defaultdict
+import copy
+import itertools
+import Queue
+import threading
 import networkx as nx
 
 from pox.lib.packet.ethernet import ethernet
@@ -26,6 +31,17 @@ from hb_utils import pkt_info
 
 from hb_shadow_table import ShadowFlowTable
 
+from hb_reachability import ReachabilityIndex
+
+from hb_flow_table_delta import FlowTableDeltaDecoder
+
+from hb_graph_export import GRAPH_FORMATS
+from hb_graph_export import write_graph
+
+from hb_trace_format import decode_binary_record
+from hb_trace_format import is_binary_trace
+from hb_trace_format import read_binary_records
+
 from hb_race_detector import RaceDetector
 from hb_race_detector import predecessor_types
 
@@ -36,6 +52,8 @@ from hb_sts_events import *
 from hb_utils import dfs_edge_filter
 from hb_utils import just_mid_iter
 from hb_utils import pretty_match
+from hb_utils import peak_rss_mb
+from hb_utils import rss_mb
 
 #
 # Do not import any STS types! We would like to be able to run this offline
@@ -45,25 +63,91 @@ from hb_utils import pretty_match
 
 OFP_COMMANDS = {v: k for k, v in ofp_flow_mod_command_rev_map.iteritems()}
 
+# Margin (in seconds) for the time index lookups, so that floating point
+# rounding can not exclude an operation that is exactly delta away.
+TIME_INDEX_MARGIN = 1e-6
+
 # OF Message types to skip from the trace
 SKIP_MSGS = [OFPT_HELLO, OFPT_VENDOR, OFPT_FEATURES_REQUEST, OFPT_FEATURES_REPLY,
              OFPT_SET_CONFIG, OFPT_GET_CONFIG_REQUEST, OFPT_GET_CONFIG_REPLY,
              OFPT_STATS_REQUEST, OFPT_STATS_REPLY]
 
 
+class PacketTrace(object):
+  """
+  The packet trace of a HbHostSend as a view on the HB graph: only the ids of
+  the events in the trace are stored, instead of a copy of the subgraph.
+  Returned by extract_traces() if the graph was created with trace_views=True.
+  """
+
+  # Edges that are not part of a packet trace. Data dependency edges are only
+  # added by find_covered_races, after the traces have been extracted.
+  EXCLUDED_RELS = ('time', 'race', 'dep_raw')
+
+  def __init__(self, g, host_send, eids):
+    self.g = g
+    # same attributes as the networkx graphs of the traces
+    self.graph = {'host_send': host_send}
+    self.eids = eids
+
+  def nodes(self):
+    return list(self.eids)
+
+  def __len__(self):
+    return len(self.eids)
+
+  def __contains__(self, eid):
+    return eid in self.eids
+
+  def successors(self, eid):
+    return [succ for succ, data in self.g.succ[eid].iteritems()
+            if succ in self.eids and data['rel'] not in self.EXCLUDED_RELS]
+
+  def dfs_preorder_nodes(self):
+    """Event ids of the trace in DFS preorder, starting at the host send."""
+    start = self.graph['host_send'].eid
+    visited = set([start])
+    preorder = [start]
+    stack = [iter(self.successors(start))]
+    while stack:
+      for eid in stack[-1]:
+        if eid not in visited:
+          visited.add(eid)
+          preorder.append(eid)
+          stack.append(iter(self.successors(eid)))
+          break
+      else:
+        stack.pop()
+    return preorder
+
+  def to_graph(self):
+    """Copy of the trace as a networkx graph, e.g. for drawing it."""
+    trace = nx.DiGraph(host_send=self.graph['host_send'])
+    for eid in self.eids:
+      trace.add_node(eid, self.g.node[eid])
+    for eid in self.eids:
+      for succ in self.successors(eid):
+        trace.add_edge(eid, succ, self.g.edge[eid][succ])
+    return trace
+
+
 class HappensBeforeGraph(object):
  
   def __init__(self, results_dir=None, add_hb_time=False, rw_delta=5,
                ww_delta=1, filter_rw=False, ignore_ethertypes=None,
                no_race=False, alt_barr=False, disable_path_cache=True, data_deps=False,
-               verify_and_minimize_only=False, is_minimized=False):
+               verify_and_minimize_only=False, is_minimized=False,
+               defer_time_edges=False, trace_views=False, digest_verification=False,
+               full_check_interval=100, race_path_limit=10, race_path_timeout=10.0,
+               graph_format='dot', graph_race_radius=None):
     self.results_dir = results_dir
     
     self.g = nx.DiGraph()
     
     self.disable_path_cache = disable_path_cache
-    self._cached_paths = None
-    self._cached_reverse_paths = None
+    self._reachability = ReachabilityIndex()
+    # edges added with update_path_cache=False, not yet in the index
+    self._pending_reachability_edges = []
 
     self.events_by_id = dict()
     self.events_with_reads_writes = list()
@@ -72,14 +156,20 @@ class HappensBeforeGraph(object):
     self.events_by_mid_out = defaultdict(list)
     
     # events that have a mid_in/mid_in and are still looking for a pid_out/mid_out to match 
-    self.events_pending_pid_in = defaultdict(list)
-    self.events_pending_mid_in = defaultdict(list)
+    # pid_in/mid_in -> {eid: (sequence number, event)}, see _pending_events
+    self.events_pending_pid_in = defaultdict(dict)
+    self.events_pending_mid_in = defaultdict(dict)
+    self._pending_seq = itertools.count()
     
     # for barrier pre rule
     self.events_before_next_barrier = defaultdict(list)
     
     # for barrier post rule
     self.most_recent_barrier = dict()
+
+    # for time rules: write operations of HbMessageHandle events sorted by time
+    self._write_times = [] # sorted op.t
+    self._writes_by_time = [] # (event, index of the op in event.operations)
     
     # for races
     self.race_detector = RaceDetector(
@@ -93,10 +183,21 @@ class HappensBeforeGraph(object):
     # Just to keep track of how many HB edges where added based on time
     self._time_hb_rw_edges_counter = 0
     self._time_hb_ww_edges_counter = 0
+    # Record the time based edges instead of adding them, so that they can be
+    # added for any delta later on (see copy_with_deltas).
+    self.defer_time_edges = defer_time_edges
+    self._deferred_flow_removed_edges = [] # (event, expiry event, max ww delta, max rw delta)
+    self._deferred_time_edges = [] # (event, later event, 'rw' or 'ww', delta), see _add_time_edge
+    # Rebuilds delta encoded flow tables while the trace is read
+    self._flow_table_decoder = FlowTableDeltaDecoder()
 
     self.ignore_ethertypes = check_list(ignore_ethertypes)
     self.no_race = no_race
     self.packet_traces = None
+    # Return PacketTrace views from extract_traces instead of subgraphs
+    self.trace_views = trace_views
+    self._packet_trace_labels = None # eid -> eids of the host sends of the traces with the event
+    self._races_by_trace = None # see _index_races_by_trace
     self.host_sends = {}
     # Handled messages from the controller to the switch
     self.msg_handles = {}
@@ -109,12 +210,74 @@ class HappensBeforeGraph(object):
     # add read-after-write dependency edges
     self.data_deps = data_deps
     self.shadow_tables = dict()
+    # Compare shadow tables to the trace by digests, see ShadowFlowTable
+    self.digest_verification = digest_verification
+    self.full_check_interval = full_check_interval
     
     self.covered_races = dict()
+    # Budget for the paths between racing events that are drawn for covered
+    # races, see race_paths. None for no limit.
+    self.race_path_limit = race_path_limit
+    self.race_path_timeout = race_path_timeout
+
+    # Format of the written graphs, see hb_graph_export
+    self.graph_format = graph_format
+    # If not None, store_graph only writes the events within this many edges
+    # of a harmful race, see races_subgraph
+    self.graph_race_radius = graph_race_radius
     
     self.verify_and_minimize_only = verify_and_minimize_only
     self.is_minimized = is_minimized
 
+  def copy_with_deltas(self, add_hb_time, rw_delta, ww_delta):
+    """
+    Returns a graph that shares the loaded events with this graph but has its
+    own edges and race analysis state, as if the trace had been loaded with
+    the given time deltas. The trace must have been loaded with
+    defer_time_edges=True. With add_hb_time, it must also have been loaded
+    with add_hb_time and deltas that are no larger than the given ones, as
+    only the time edges for those deltas were recorded.
+    """
+    assert self.defer_time_edges
+    if add_hb_time:
+      assert self.add_hb_time
+      assert rw_delta >= self.rw_delta and ww_delta >= self.ww_delta
+    other = copy.copy(self)
+    other.g = nx.DiGraph(self.g)
+    other.add_hb_time = add_hb_time
+    other.rw_delta = rw_delta
+    other.ww_delta = ww_delta
+    other.race_detector = RaceDetector(
+      other, filter_rw=self.race_detector.filter_rw, add_hb_time=add_hb_time,
+      ww_delta=ww_delta, rw_delta=rw_delta)
+    other._time_hb_rw_edges_counter = 0
+    other._time_hb_ww_edges_counter = 0
+    other.defer_time_edges = False
+    other._deferred_flow_removed_edges = []
+    other._deferred_time_edges = []
+    other.packet_traces = None
+    other._packet_trace_labels = None
+    other._races_by_trace = None
+    other.versions = {}
+    other.covered_races = dict()
+    other._write_times = list(self._write_times)
+    other._writes_by_time = list(self._writes_by_time)
+
+    other._reachability = ReachabilityIndex()
+    other._pending_reachability_edges = []
+    if not other.disable_path_cache:
+      for eid in sorted(other.g.nodes_iter()):
+        other._reachability.add_node(eid)
+        for pred in other.g.predecessors_iter(eid):
+          other._reachability.add_edge(pred, eid)
+
+    for e, event, max_ww_delta, max_rw_delta in self._deferred_flow_removed_edges:
+      other._add_flow_removed_time_edges(e, event, max_ww_delta, max_rw_delta)
+    if add_hb_time:
+      for e, event, kind, delta in self._deferred_time_edges:
+        other._add_time_edge(e, event, kind, delta)
+    return other
+
   @property
   def events(self):
     for _, data in self.g.nodes_iter(True):
@@ -136,45 +299,50 @@ class HappensBeforeGraph(object):
     if hasattr(event, 'mid_out'):
       for x in event.mid_out:
         self.events_by_mid_out[x].append(event)
+    if hasattr(event, 'pid_in'):
+      self.events_pending_pid_in[event.pid_in][event.eid] = (self._pending_seq.next(), event)
+    if hasattr(event, 'mid_in'):
+      self.events_pending_mid_in[event.mid_in][event.eid] = (self._pending_seq.next(), event)
+
+  def _pending_events(self, table, key):
+    """The pending events of table for key, in the order they were added."""
+    return [event for _, event in sorted(table[key].itervalues())]
+
+  def _remove_pending(self, table, key, event):
+    pending = table.get(key)
+    if pending is not None:
+      pending.pop(event.eid, None)
+      if not pending:
+        del table[key]
 
-    self.lookup_tables = [ #( field name,
-                           #  condition to be included,
-                           #  search key
-                           #),
-                           (self.events_pending_pid_in, 
-                            lambda x: hasattr(x, 'pid_in'), 
-                            lambda x: x.pid_in ),
-                           (self.events_pending_mid_in, 
-                            lambda x: hasattr(x, 'mid_in'), 
-                            lambda x: x.mid_in ),
-                           ]
-    for entry in self.lookup_tables:
-      table, condition, key = entry
-      if condition(event):
-        table[key(event)].append(event)
-    
   def _update_event_is_linked_pid_in(self, event):
-    if event in self.events_pending_pid_in[event.pid_in]:
-      self.events_pending_pid_in[event.pid_in].remove(event)
+    self._remove_pending(self.events_pending_pid_in, event.pid_in, event)
   def _update_event_is_linked_mid_in(self, event):
-    if event in self.events_pending_mid_in[event.mid_in]:
-      self.events_pending_mid_in[event.mid_in].remove(event)
+    self._remove_pending(self.events_pending_mid_in, event.mid_in, event)
       
   def update_path_cache(self):
+    """
+    Add the edges that were added with update_path_cache=False to the
+    reachability index. The index itself is maintained incrementally.
+    """
     print "Updating has_path path cache..."
-    self._cached_paths = nx.all_pairs_shortest_path_length(self.g)
-      
+    self._flush_pending_reachability_edges()
+
+  def _flush_pending_reachability_edges(self):
+    if self.disable_path_cache:
+      return
+    for src, dst in self._pending_reachability_edges:
+      self._reachability.add_edge(src, dst)
+    self._pending_reachability_edges = []
+
   def has_path(self, src_eid, dst_eid, bidirectional=True, use_path_cache=True):  
     if self.disable_path_cache or not use_path_cache:
       return nx.has_path(self.g, src_eid, dst_eid) or (bidirectional and nx.has_path(self.g, dst_eid, src_eid))
     else:
-      if self._cached_paths is None:
-        self.update_path_cache()
-
-      if dst_eid in self._cached_paths[src_eid]:
+      if self._reachability.has_path(src_eid, dst_eid):
         return True
       if bidirectional:
-        if src_eid in self._cached_paths[dst_eid]:
+        if self._reachability.has_path(dst_eid, src_eid):
           return True
       return False
      
@@ -191,9 +359,12 @@ class HappensBeforeGraph(object):
         raise ValueError(
           "Edge already added %d->%d and relation: %s" % (src, dst, rel))
     self.g.add_edge(before.eid, after.eid, attrs)
-    if update_path_cache:
-      # TODO(jm): do incremental update later. But for now, this is sufficient.
-      self._cached_paths = None
+    if not self.disable_path_cache:
+      if update_path_cache:
+        self._flush_pending_reachability_edges()
+        self._reachability.add_edge(src, dst)
+      else:
+        self._pending_reachability_edges.append((src, dst))
 
   def _rule_01_pid(self, event):
     # pid_out -> pid_in
@@ -207,7 +378,7 @@ class HappensBeforeGraph(object):
     if hasattr(event, 'pid_out'):
       for pid_out in event.pid_out:
         if pid_out in self.events_pending_pid_in:
-          for other in self.events_pending_pid_in[pid_out][:]: # copy list [:], so we can remove from it
+          for other in self._pending_events(self.events_pending_pid_in, pid_out):
             self._add_edge(event, other, rel='pid')
             self._update_event_is_linked_pid_in(other)
             
@@ -223,7 +394,7 @@ class HappensBeforeGraph(object):
     if hasattr(event, 'mid_out'):
       for mid_out in event.mid_out:
         if mid_out in self.events_pending_mid_in:
-          for other in self.events_pending_mid_in[mid_out][:]: # copy list [:], so we can remove from it
+          for other in self._pending_events(self.events_pending_mid_in, mid_out):
             self._add_edge(event, other, rel='mid')
             self._update_event_is_linked_mid_in(other)
   
@@ -309,7 +480,6 @@ class HappensBeforeGraph(object):
     if isinstance(event, HbAsyncFlowExpiry):
       assert len(event.operations) == 1
       expiry = event.operations[0]
-      flow_table = expiry.flow_table # the flow table before the removal
       flow_mod = expiry.flow_mod # the removed entry
       reason = expiry.reason # Either idle or hard timeout. Deletes are not handled
       duration = expiry.duration_sec*10^9 + expiry.duration_nsec
@@ -355,28 +525,57 @@ class HappensBeforeGraph(object):
             kr_ops.append(op)
         if (not kw_ops) and (not kr_ops):
           continue
-        # Make the edge
-        for kw_op in kw_ops:
-          # Skip if events commute anyway
-          if self.race_detector.commutativity_checker.check_commutativity_ww(
-                  e, kw_op, dummy_event, dummy_op):
-            continue
-          delta = abs(expiry.t - kw_op.t)
-          if delta > self.ww_delta:
-            self._time_hb_ww_edges_counter += 1
-            self._add_edge(e, event, sanity_check=False, rel='time')
-            break
-        for kr_op in kr_ops:
-          # Skip if events commute anyway
-          if self.race_detector.commutativity_checker.check_commutativity_rw(
-                  e, kr_op, dummy_event, dummy_op):
-            continue
-          delta = abs(expiry.t - kr_op.t)
-          if delta > self.rw_delta:
-            self._time_hb_rw_edges_counter += 1
-            self._add_edge(e, event, sanity_check=False, rel='time')
-            break
+        # Skip if events commute anyway
+        ww_deltas = [abs(expiry.t - kw_op.t) for kw_op in kw_ops
+                     if not self.race_detector.commutativity_checker.check_commutativity_ww(
+                       e, kw_op, dummy_event, dummy_op)]
+        rw_deltas = [abs(expiry.t - kr_op.t) for kr_op in kr_ops
+                     if not self.race_detector.commutativity_checker.check_commutativity_rw(
+                       e, kr_op, dummy_event, dummy_op)]
+        max_ww_delta = max(ww_deltas) if ww_deltas else None
+        max_rw_delta = max(rw_deltas) if rw_deltas else None
+        if self.defer_time_edges:
+          if ww_deltas or rw_deltas:
+            self._deferred_flow_removed_edges.append(
+              (e, event, max_ww_delta, max_rw_delta))
+        else:
+          self._add_flow_removed_time_edges(e, event, max_ww_delta, max_rw_delta)
+
+  def _add_flow_removed_time_edges(self, e, event, max_ww_delta, max_rw_delta):
+    """
+    Order the flow expiry event after e if any of its non-commuting writes
+    or reads happened more than the time delta earlier.
+    """
+    if max_ww_delta is not None and max_ww_delta > self.ww_delta:
+      self._time_hb_ww_edges_counter += 1
+      self._add_edge(e, event, sanity_check=False, rel='time')
+    if max_rw_delta is not None and max_rw_delta > self.rw_delta:
+      self._time_hb_rw_edges_counter += 1
+      self._add_edge(e, event, sanity_check=False, rel='time')
     
+  def _index_writes(self, event):
+    """Add the write operations of a HbMessageHandle to the time index."""
+    for i, op in enumerate(event.operations):
+      if type(op) == TraceSwitchFlowTableWrite:
+        pos = bisect.bisect_right(self._write_times, op.t)
+        self._write_times.insert(pos, op.t)
+        self._writes_by_time.insert(pos, (event, i))
+
+  def _writes_outside_window(self, t, delta):
+    """
+    Yields (event, op index) for the indexed writes that may be more than
+    delta away from t. All other writes are certainly within delta of t.
+
+    Only the writes within delta are skipped. On a long trace most earlier
+    writes are further away than delta, so the time rules still look at
+    O(n) writes per event and building the graph stays quadratic.
+    """
+    lo = bisect.bisect_left(self._write_times, t - delta + TIME_INDEX_MARGIN)
+    hi = bisect.bisect_right(self._write_times, t + delta - TIME_INDEX_MARGIN)
+    hi = max(hi, lo)
+    writes = self._writes_by_time
+    return (writes[i] for i in itertools.chain(xrange(lo), xrange(hi, len(writes))))
+
   def _rule_06_time_rw(self, event):
     if type(event) not in [HbPacketHandle]:
       return
@@ -387,19 +586,17 @@ class HappensBeforeGraph(object):
     for op in event.operations:
       if type(op) ==  TraceSwitchFlowTableRead:
         operations.append(op)
-    for e in self.events:
-      if type(e) != HbMessageHandle:
+    if not operations:
+      return
+    def matches(op):
+      return (type(op) == TraceSwitchFlowTableWrite and
+              op.flow_mod.match.matches_with_wildcards(packet_match, consider_other_wildcards=False))
+    for e, i in self._writes_outside_window(operations[0].t, self.rw_delta):
+      op = e.operations[i]
+      # Only the first write of e that matches the packet counts
+      if not matches(op) or any(matches(x) for x in e.operations[:i]):
         continue
-      for op in e.operations:
-        if type(op) != TraceSwitchFlowTableWrite:
-          continue
-        if not op.flow_mod.match.matches_with_wildcards(packet_match, consider_other_wildcards=False):
-          continue
-        delta = abs(op.t - operations[0].t)
-        if (delta > self.rw_delta):
-          self._time_hb_rw_edges_counter += 1
-          self._add_edge(e, event, sanity_check=False, rel='time')
-        break
+      self._add_time_edge(e, event, 'rw', abs(op.t - operations[0].t))
 
   def _rule_07_time_ww(self, event):
     if type(event) not in [HbMessageHandle]:
@@ -415,32 +612,41 @@ class HappensBeforeGraph(object):
     if not i_ops:
       return
 
-    # Find other write events in the graph.
-    for e in self.events:
-      if e == event:
-        continue
-      # Skip none switch event
-      if type(e) != HbMessageHandle:
-        continue
-      k_ops = []
-      # Find the write ops
-      for op in e.operations:
-        if type(op) == TraceSwitchFlowTableWrite:
-          k_ops.append(op)
-      if not k_ops:
-        continue
-      # Make the edge
-      for i_op in i_ops:
-        for k_op in k_ops:
-          # Skip if events commute anyway
-          if self.race_detector.commutativity_checker.check_commutativity_ww(
-                  event, i_op, e, k_op):
-            continue
-          delta = abs(i_op.t - k_op.t)
-          if delta > self.ww_delta:
-            self._time_hb_ww_edges_counter += 1
-            self._add_edge(e, event, sanity_check=False, rel='time')
-          break
+    checker = self.race_detector.commutativity_checker
+    def conflicts(i_op, e, k_op):
+      return (type(k_op) == TraceSwitchFlowTableWrite and
+              not checker.check_commutativity_ww(event, i_op, e, k_op))
+    for i_op in i_ops:
+      # Find other write events in the graph.
+      for e, k in self._writes_outside_window(i_op.t, self.ww_delta):
+        if e == event:
+          continue
+        k_op = e.operations[k]
+        # Only the first write of e that does not commute counts
+        if (not conflicts(i_op, e, k_op) or
+            any(conflicts(i_op, e, x) for x in e.operations[:k])):
+          continue
+        self._add_time_edge(e, event, 'ww', abs(i_op.t - k_op.t))
+
+  def _add_time_edge(self, e, event, kind, delta):
+    """
+    Order event after e if their read/write ('rw') or write/write ('ww')
+    operations are more than the delta of that kind apart. With
+    defer_time_edges, the edge is recorded for copy_with_deltas instead.
+    """
+    if kind == 'rw':
+      if delta <= self.rw_delta:
+        return
+    elif delta <= self.ww_delta:
+      return
+    if self.defer_time_edges:
+      self._deferred_time_edges.append((e, event, kind, delta))
+      return
+    if kind == 'rw':
+      self._time_hb_rw_edges_counter += 1
+    else:
+      self._time_hb_ww_edges_counter += 1
+    self._add_edge(e, event, sanity_check=False, rel='time')
 
   def _update_edges(self, event):
     self._rule_01_pid(event)
@@ -458,7 +664,9 @@ class HappensBeforeGraph(object):
 
   def _update_shadow_tables(self, event):
     if event.dpid not in self.shadow_tables:
-      self.shadow_tables[event.dpid] = ShadowFlowTable(event.dpid, self.is_minimized)
+      self.shadow_tables[event.dpid] = ShadowFlowTable(
+        event.dpid, self.is_minimized, digest_verification=self.digest_verification,
+        full_check_interval=self.full_check_interval)
     self.shadow_tables[event.dpid].apply_event(event)
 
   def unpack_line(self, line):
@@ -466,12 +674,23 @@ class HappensBeforeGraph(object):
     if not line or line.startswith('#'):
       return
 
-    # TODO(jm): I did some tests to see why loading events is so slow.
-    #           JsonEvent.from_json is the slow part, everything else
-    #           (including json.loads()) is blazing fast.
-    #           We might want to speed that up a bit.
     event = JsonEvent.from_json(json.loads(line))
-    return event
+    return self._flow_table_decoder.decode(event)
+
+  def unpack_record(self, record):
+    """Decodes a record of a binary trace, see hb_trace_format."""
+    return self._flow_table_decoder.decode(decode_binary_record(record))
+
+  def _unpack_trace(self, f):
+    """Yields the events of trace file f, a JSON or a binary trace."""
+    if is_binary_trace(f):
+      for record in read_binary_records(f):
+        yield self.unpack_record(record)
+    else:
+      for line in f:
+        event = self.unpack_line(line)
+        if event:
+          yield event
 
   def add_line(self, line):
     event = self.unpack_line(line)
@@ -494,8 +713,12 @@ class HappensBeforeGraph(object):
     if msg_type in SKIP_MSGS:
       return
     self.g.add_node(event.eid, event=event)
+    if not self.disable_path_cache:
+      self._reachability.add_node(event.eid)
     self.events_by_id[event.eid] = event
     self._add_to_lookup_tables(event)
+    if type(event) == HbMessageHandle:
+      self._index_writes(event)
     
     if hasattr(event, 'operations'):
       for op in event.operations:
@@ -508,70 +731,169 @@ class HappensBeforeGraph(object):
           self.events_with_reads_writes.append(event.eid)
           break
 
-    def _handle_HbAsyncFlowExpiry(event):
-      if self.data_deps:
-        self._update_shadow_tables(event)
-      self._update_edges(event)
-    def _handle_HbPacketHandle(event):
-      if self.data_deps:
-        self._update_shadow_tables(event)
-      self._update_edges(event)
-    def _handle_HbPacketSend(event):
-      self._update_edges(event)
-    def _handle_HbMessageHandle(event):
-      if self.data_deps:
-        self._update_shadow_tables(event)
-      self._update_edges(event)
-      self.msg_handles[event.eid] = event
-    def _handle_HbMessageSend(event):
-      self._update_edges(event)
-      self.msgs[event.eid] = event
-    def _handle_HbHostHandle(event):
-      self._update_edges(event)
-    def _handle_HbHostSend(event):
-      self._update_edges(event)
-      self.host_sends[event.eid] = event
-    def _handle_HbControllerHandle(event):
-      self._update_edges(event)
-    def _handle_HbControllerSend(event):
-      self._update_edges(event)
-    def _handle_default(event):
-      assert False
-      pass
-    
-    handlers = {'HbAsyncFlowExpiry':   _handle_HbAsyncFlowExpiry,
-                'HbPacketHandle':      _handle_HbPacketHandle,
-                'HbPacketSend':        _handle_HbPacketSend,
-                'HbMessageHandle':     _handle_HbMessageHandle,
-                'HbMessageSend':       _handle_HbMessageSend,
-                'HbHostHandle':        _handle_HbHostHandle,
-                'HbHostSend':          _handle_HbHostSend,
-                'HbControllerHandle':  _handle_HbControllerHandle,
-                'HbControllerSend':    _handle_HbControllerSend,
-                 }
-    handlers.get(event.type, _handle_default)(event)
-
-  def load_trace(self, filename):
+    handler = self._event_handlers.get(event.type)
+    assert handler is not None, "Unknown event type %s" % event.type
+    handler(self, event)
+
+  def _handle_switch_event(self, event):
+    if self.data_deps:
+      self._update_shadow_tables(event)
+    self._update_edges(event)
+
+  def _handle_HbMessageHandle(self, event):
+    self._handle_switch_event(event)
+    self.msg_handles[event.eid] = event
+
+  def _handle_HbMessageSend(self, event):
+    self._update_edges(event)
+    self.msgs[event.eid] = event
+
+  def _handle_HbHostSend(self, event):
+    self._update_edges(event)
+    self.host_sends[event.eid] = event
+
+  # event type -> handler, called by add_event
+  _event_handlers = {'HbAsyncFlowExpiry':   _handle_switch_event,
+                     'HbPacketHandle':      _handle_switch_event,
+                     'HbPacketSend':        _update_edges,
+                     'HbMessageHandle':     _handle_HbMessageHandle,
+                     'HbMessageSend':       _handle_HbMessageSend,
+                     'HbHostHandle':        _update_edges,
+                     'HbHostSend':          _handle_HbHostSend,
+                     'HbControllerHandle':  _update_edges,
+                     'HbControllerSend':    _update_edges,
+                    }
+
+  def remove_events(self, eids):
+    """
+    Forget events and all lookup state that refers to them, to bound the
+    memory of a graph that is built incrementally.
+
+    Edges through removed events are lost, so only events that can no longer
+    lie on a path between two remaining events should be removed. The
+    reachability index can not shrink, so the path cache must be disabled.
+    """
+    assert self.disable_path_cache
+    eids = set(eid for eid in eids if eid in self.events_by_id)
+    if not eids:
+      return
+    self.g.remove_nodes_from(eids)
+    for eid in eids:
+      del self.events_by_id[eid]
+      self.msg_handles.pop(eid, None)
+      self.msgs.pop(eid, None)
+      self.host_sends.pop(eid, None)
+      for shadow_table in self.shadow_tables.itervalues():
+        shadow_table.data_deps.pop(eid, None)
+    self.events_with_reads_writes = [eid for eid in self.events_with_reads_writes
+                                     if eid not in eids]
+    for table in [self.events_by_pid_out, self.events_by_mid_out,
+                  self.events_before_next_barrier]:
+      for key in table.keys():
+        events = [e for e in table[key] if e.eid not in eids]
+        if events:
+          table[key] = events
+        else:
+          del table[key]
+    for table in [self.events_pending_pid_in, self.events_pending_mid_in]:
+      for key in table.keys():
+        for eid in [eid for eid in table[key] if eid in eids]:
+          del table[key][eid]
+        if not table[key]:
+          del table[key]
+    for key, event in self.most_recent_barrier.items():
+      if event.eid in eids:
+        del self.most_recent_barrier[key]
+    writes = [(t, x) for t, x in zip(self._write_times, self._writes_by_time)
+              if x[0].eid not in eids]
+    self._write_times = [t for t, _ in writes]
+    self._writes_by_time = [x for _, x in writes]
+
+  def _read_trace_chunks(self, f, chunk_size):
+    """Yields the events of trace file f in lists of up to chunk_size events."""
+    chunk = []
+    for event in self._unpack_trace(f):
+      chunk.append(event)
+      if len(chunk) == chunk_size:
+        yield chunk
+        chunk = []
+    if chunk:
+      yield chunk
+
+  def _read_trace_chunks_threaded(self, f, chunk_size, max_chunks=4):
+    """
+    Same as _read_trace_chunks, but the events are decoded by a reader thread,
+    at most max_chunks chunks ahead of the caller.
+    """
+    chunks = Queue.Queue(max_chunks)
+    errors = []
+    def read():
+      try:
+        for chunk in self._read_trace_chunks(f, chunk_size):
+          chunks.put(chunk)
+      except Exception:
+        errors.append(sys.exc_info())
+      finally:
+        chunks.put(None)
+    reader = threading.Thread(target=read, name="hb_trace_reader")
+    reader.daemon = True
+    reader.start()
+    chunk = chunks.get()
+    while chunk is not None:
+      yield chunk
+      chunk = chunks.get()
+    reader.join()
+    if errors:
+      raise errors[0][0], errors[0][1], errors[0][2]
+
+  def load_trace(self, filename, chunk_size=1000, reader_thread=False,
+                 progress_interval=None):
+    """
+    Reads the trace and adds its events to the graph, chunk_size events at a
+    time, so that only the current chunk of decoded events is buffered.
+    With reader_thread, lines are decoded in a separate thread while the
+    events of the previous chunk are added. Progress is printed every
+    progress_interval seconds, if given.
+    """
     self.g = nx.DiGraph()
+    self._reachability.clear()
+    self._pending_reachability_edges = []
+    self._deferred_flow_removed_edges = []
+    self._deferred_time_edges = []
+    self._flow_table_decoder = FlowTableDeltaDecoder()
+    self._write_times = []
+    self._writes_by_time = []
     self.events_by_id = dict()
-    unpacked_events = list()
-    with open(filename) as f:
-      for line in f:
-        event = self.unpack_line(line)
-        if event:
-          unpacked_events.append(event)
-    print "Read " + str(len(unpacked_events)) + " events."
-    for event in unpacked_events:
-      self.add_event(event)
+    unpacked_events = 0
+    t0 = last_progress = time.time()
+    with open(filename, 'rb') as f:
+      if reader_thread:
+        chunks = self._read_trace_chunks_threaded(f, chunk_size)
+      else:
+        chunks = self._read_trace_chunks(f, chunk_size)
+      for chunk in chunks:
+        unpacked_events += len(chunk)
+        for event in chunk:
+          self.add_event(event)
+        now = time.time()
+        if progress_interval is not None and now - last_progress >= progress_interval:
+          last_progress = now
+          print "Loaded %d events (%.0f events/s, RSS %.1f MB)" % (
+            unpacked_events, unpacked_events / (now - t0), rss_mb())
+    print "Read " + str(unpacked_events) + " events."
     print "Added " + str(len(list(self.events))) + " events."
+    if self.digest_verification:
+      print "Shadow table full comparisons: %d, digest mismatches: %d" % (
+        sum(t.full_checks for t in self.shadow_tables.values()),
+        sum(t.digest_mismatches for t in self.shadow_tables.values()))
   
   def verify_and_minimize_trace(self, filename):
     unpacked_events = 0
+    self._flow_table_decoder = FlowTableDeltaDecoder()
     outfilename = filename + ".min"
     with open(filename + ".min", 'w') as fout:
-      with open(filename) as f:
-        for line in f:
-          event = self.unpack_line(line)
+      with open(filename, 'rb') as f:
+        for event in self._unpack_trace(f):
           if event:
             unpacked_events += 1
             has_reads_writes = False
@@ -586,7 +908,7 @@ class HappensBeforeGraph(object):
             # cleanup operations
             if hasattr(event, 'operations'):
               for op in event.operations:
-                if hasattr(op, "flow_table"):
+                if hasattr(op, "raw_flow_table"):
                   delattr(op, "flow_table")
             # cleanup attributes
             fout.write(str(event.to_json()) + '\n')
@@ -594,12 +916,45 @@ class HappensBeforeGraph(object):
     print "Verified, minimized, and wrote " + str(unpacked_events) + " events to "+str(outfilename)
 
     
+  def write_graph(self, g, filename):
+    """Writes g in self.graph_format, returns the name of the written file."""
+    return write_graph(g, filename, self.graph_format)
+
+  def races_subgraph(self, radius):
+    """
+    Returns a copy of the subgraph with the events that are at most radius
+    edges (in either direction) away from an event of a harmful race, with
+    the harmful races as edges.
+    """
+    races = self.race_detector.races_harmful
+    nodes = set()
+    for race in races:
+      nodes.add(race.i_event.eid)
+      nodes.add(race.k_event.eid)
+    frontier = nodes
+    for _ in range(radius):
+      next_frontier = set()
+      for eid in frontier:
+        next_frontier.update(self.g.succ[eid])
+        next_frontier.update(self.g.pred[eid])
+      frontier = next_frontier - nodes
+      nodes.update(frontier)
+    g = nx.DiGraph(self.g.subgraph(nodes))
+    if not self.no_race:
+      for race in races:
+        g.add_edge(race.i_event.eid, race.k_event.eid, rel='race', harmful=True)
+    return g
+
   def store_graph(self, filename="hb.dot",  print_packets=False):
     if self.results_dir is not None:
       filename = os.path.join(self.results_dir,filename)
 
-    self.prep_draw(self.g, print_packets)
-    nx.write_dot(self.g, os.path.join(self.results_dir, filename))
+    if self.graph_race_radius is not None:
+      g = self.races_subgraph(self.graph_race_radius)
+    else:
+      g = self.g
+    self.prep_draw(g, print_packets)
+    return self.write_graph(g, filename)
 
   @staticmethod
   def prep_draw(g, print_packets, allow_none_event=False):
@@ -683,7 +1038,13 @@ class HappensBeforeGraph(object):
 
     This method will exclude all the nodes connected because of time and the
     nodes connected after HostHandle.
+
+    With trace_views, the traces are returned as PacketTrace views, which are
+    all extracted in a single pass over g.
     """
+    self._races_by_trace = None
+    if self.trace_views:
+      return self._extract_trace_views(g)
     traces = []
     # Sort host sends by eid, this will make the output follow the trace order
     eids = self.host_sends.keys()
@@ -707,21 +1068,105 @@ class HappensBeforeGraph(object):
     self.packet_traces = traces
     return traces
 
+  def _label_packet_traces(self, g):
+    """
+    Returns a dict mapping the id of each event to the ids of the HbHostSend
+    events whose packet traces contain the event. The events are visited once,
+    in topological order of the trace edges, and inherit the labels of their
+    predecessors. A HostSend only has its own label, so the trace of another
+    HostSend ends there. Identical label sets are shared between events.
+    """
+    in_degree = dict.fromkeys(g.nodes_iter(), 0)
+    for _, dst, data in g.edges_iter(data=True):
+      if data['rel'] not in PacketTrace.EXCLUDED_RELS:
+        in_degree[dst] += 1
+    ready = [eid for eid, degree in in_degree.iteritems() if degree == 0]
+    labels = dict()
+    visited = 0
+    while ready:
+      eid = ready.pop()
+      visited += 1
+      if isinstance(g.node[eid]['event'], HbHostSend):
+        labels[eid] = frozenset([eid])
+      else:
+        pred_labels = dict()
+        for pred, data in g.pred[eid].iteritems():
+          if data['rel'] not in PacketTrace.EXCLUDED_RELS and pred in labels:
+            pred_labels[id(labels[pred])] = labels[pred]
+        if len(pred_labels) == 1:
+          labels[eid] = pred_labels.values()[0]
+        elif pred_labels:
+          labels[eid] = frozenset().union(*pred_labels.values())
+      for succ, data in g.succ[eid].iteritems():
+        if data['rel'] not in PacketTrace.EXCLUDED_RELS:
+          in_degree[succ] -= 1
+          if in_degree[succ] == 0:
+            ready.append(succ)
+    assert visited == len(in_degree), "HB graph without time edges has a cycle"
+    return labels
+
+  def _extract_trace_views(self, g):
+    labels = self._label_packet_traces(g)
+    eids_by_host_send = defaultdict(list)
+    for eid, host_sends in labels.iteritems():
+      for host_send in host_sends:
+        eids_by_host_send[host_send].append(eid)
+    traces = []
+    for eid in sorted(self.host_sends.keys()):
+      traces.append(PacketTrace(g, g.node[eid]['event'],
+                                frozenset(eids_by_host_send[eid])))
+    self._packet_trace_labels = labels
+    self.packet_traces = traces
+    return traces
+
+  def _index_races_by_trace(self):
+    """
+    Index the harmful r/w races (including covered ones) by the packet traces
+    of their events, once for all traces. Returns two dicts mapping the eid of
+    a host send to the races whose read (first) or write (second) is in the
+    trace of the host send and part of a harmful race.
+    """
+    if self._races_by_trace is None:
+      all_harmful = set([event.eid for event in
+                         self.race_detector.racing_events_harmful])
+      read_races = defaultdict(list)
+      write_races = defaultdict(list)
+      for race in self.race_detector.races_harmful_with_covered:
+        if race.rtype != 'r/w':
+          continue
+        if race.i_event.eid in all_harmful:
+          for host_send in self._packet_trace_labels.get(race.i_event.eid, ()):
+            read_races[host_send].append(race)
+        if race.k_event.eid in all_harmful:
+          for host_send in self._packet_trace_labels.get(race.k_event.eid, ()):
+            write_races[host_send].append(race)
+      self._races_by_trace = (read_races, write_races)
+    return self._races_by_trace
+
   def store_traces(self, results_dir, print_packets=True, subgraphs=None):
     if not subgraphs:
       subgraphs = self.extract_traces(self.g)
     for i in range(len(subgraphs)):
       subg = subgraphs[i]
+      if isinstance(subg, PacketTrace):
+        subg = subg.to_graph()
       send = subg.graph['host_send']
       HappensBeforeGraph.prep_draw(subg, print_packets)
-      nx.write_dot(subg, "%s/trace_%s_%s_%04d.dot" % (results_dir,
-                                                      str(send.packet.src),
-                                                      str(send.packet.dst), send.eid))
+      self.write_graph(subg, "%s/trace_%s_%s_%04d.dot" % (results_dir,
+                                                          str(send.packet.src),
+                                                          str(send.packet.dst), send.eid))
 
   def get_racing_events(self, trace, ignore_other_traces=True):
     """
     For a given packet trace, return all the races that races with its events
     """
+    if isinstance(trace, PacketTrace):
+      read_races, write_races = self._index_races_by_trace()
+      host_send = trace.graph['host_send'].eid
+      races = set(read_races.get(host_send, ()))
+      if not ignore_other_traces:
+        races.update(write_races.get(host_send, ()))
+      return sorted(races)
     # Set of all events that are part of a harmful race
     all_harmful = set([event.eid for event in
                    self.race_detector.racing_events_harmful])
@@ -781,25 +1226,48 @@ class HappensBeforeGraph(object):
         result[key] = (trace, races, versions)
     return result.values()
 
+  def race_paths(self, i_eid, k_eid):
+    """
+    Yields the simple paths between two racing events (in either direction),
+    shortest first. Stops after race_path_limit paths per direction or
+    race_path_timeout seconds, so that dense graphs can not stall the
+    analysis. Without a limit all paths are yielded, like all_simple_paths.
+    """
+    deadline = None
+    if self.race_path_timeout is not None:
+      deadline = time.time() + self.race_path_timeout
+    for src, dst in [(i_eid, k_eid), (k_eid, i_eid)]:
+      if not nx.has_path(self.g, src, dst):
+        continue
+      if self.race_path_limit is None:
+        paths = nx.all_simple_paths(self.g, src, dst)
+      else:
+        paths = itertools.islice(nx.shortest_simple_paths(self.g, src, dst),
+                                 self.race_path_limit)
+      for path in paths:
+        yield path
+        if deadline is not None and time.time() > deadline:
+          print "Path budget of %s s exhausted for race %s <-> %s" % (
+            self.race_path_timeout, i_eid, k_eid)
+          return
+
   def print_racing_packet_trace(self, trace, races, label, show_covered=True):
     """
     first is the trace
     second is the list of races
     """
     host_send = trace.graph['host_send']
-    g = nx.DiGraph(trace, host_send= host_send)
+    if isinstance(trace, PacketTrace):
+      g = trace.to_graph()
+    else:
+      g = nx.DiGraph(trace, host_send= host_send)
     for race in races:
       if not g.has_node(race.i_event.eid):
         g.add_node(race.i_event.eid, event=race.i_event)
       if not g.has_node(race.k_event.eid):
         g.add_node(race.k_event.eid, event=race.k_event)
       if show_covered and race in self.covered_races:
-        for path in nx.all_simple_paths(self.g, race.i_event.eid, race.k_event.eid):
-          for src, dst in zip(path, path[1:]):
-            g.node[src] = self.g.node[src]
-            g.node[dst] = self.g.node[dst]
-            g.add_edge(src, dst, self.g.edge[src][dst])
-        for path in nx.all_simple_paths(self.g, race.k_event.eid, race.i_event.eid):
+        for path in self.race_paths(race.i_event.eid, race.k_event.eid):
           for src, dst in zip(path, path[1:]):
             g.node[src] = self.g.node[src]
             g.node[dst] = self.g.node[dst]
@@ -815,8 +1283,8 @@ class HappensBeforeGraph(object):
     dst = str(host_send.packet.dst)
     name = "%s_%s_%s_%s.dot" %(label, src, dst, host_send.eid)
     name = os.path.join(self.results_dir, name)
-    print "Storing packet %s for %s->%s in %s " % (label, src, dst, name)
-    nx.write_dot(g, name)
+    name = self.write_graph(g, name)
+    print "Stored packet %s for %s->%s in %s " % (label, src, dst, name)
 
   def races_graph(self):
     races = self.race_detector.races_harmful
@@ -832,8 +1300,8 @@ class HappensBeforeGraph(object):
       name = "just_races.dot"
     graph = self.races_graph()
     self.prep_draw(graph, print_pkts)
-    print "Saving all races graph in", name
-    nx.write_dot(graph, os.path.join(self.results_dir, name))
+    name = self.write_graph(graph, os.path.join(self.results_dir, name))
+    print "Saved all races graph in", name
 
   def find_covered_races(self):
     """
@@ -843,6 +1311,13 @@ class HappensBeforeGraph(object):
      - the set of successors of R
     
     These are now ordered so we can add them to the list.
+
+    A race can only become ordered through the RaW edge that was just added,
+    in which case one of its events is a successor of W. So a race is covered
+    by the first RaW edge after which its events are ordered (unless it is the
+    race between W and R itself). The ordering of all races is tracked with
+    one incremental reachability index: adding an edge returns the events
+    that now reach more events, and only races of these events are checked.
     """
     
     if self.covered_races:
@@ -861,7 +1336,38 @@ class HappensBeforeGraph(object):
       else:
         # race is still a race and can become covered when adding data deps
         remaining_harmful_races.add(r)
-      
+
+    reachability = ReachabilityIndex()
+    for eid in sorted(self.g.nodes_iter()):
+      reachability.add_node(eid)
+      for pred in self.g.predecessors_iter(eid):
+        reachability.add_edge(pred, eid)
+    def is_ordered(r):
+      return (reachability.has_path(r.i_event.eid, r.k_event.eid) or
+              reachability.has_path(r.k_event.eid, r.i_event.eid))
+
+    # eid -> races of that event that are not ordered yet
+    unordered_races_by_eid = defaultdict(list)
+    # races that are ordered although the path cache said otherwise. These are
+    # covered as soon as one of their events is a successor of a W.
+    ordered_races = []
+    for r in remaining_harmful_races:
+      if is_ordered(r):
+        ordered_races.append(r)
+      else:
+        unordered_races_by_eid[r.i_event.eid].append(r)
+        unordered_races_by_eid[r.k_event.eid].append(r)
+    done = set() # covered or data dependency races
+
+    def cover(r, event, write_event):
+      done.add(r)
+      # ignore races that we just removed using the data dep edge.
+      if (r.i_event == event and r.k_event == write_event) or (r.i_event == write_event and r.k_event == event):
+        data_dep_races.add(r)
+      else:
+        # race is not a race anymore
+        self.race_detector.mark_covered(r)
+        covered_races[r] = (event.eid, write_event.eid)
     
     # check for monotonically increasing eids, i.e. the list must be sorted
     assert all(x <= y for x, y in zip(self.events_with_reads_writes,
@@ -887,24 +1393,19 @@ class HappensBeforeGraph(object):
               self._add_edge(write_event, event, sanity_check=False, rel='dep_raw')
             
             # Should we check this after adding *all* dependencies or after each. E.g. for events with a read and a write.
-            
-            # includes write_eid itself
-            write_succs = set(nx.dfs_preorder_nodes(self.g, write_eid))
-            
-            for r in remaining_harmful_races: # TODO(jm): get rid of this loop here, lots of unnecessary looping
+
+            for node in reachability.add_edge(write_eid, eid, extend_chains=False):
+              for r in unordered_races_by_eid.pop(node, []):
+                if r not in done and is_ordered(r):
+                  cover(r, event, write_event)
+                elif r not in done:
+                  unordered_races_by_eid[node].append(r)
+
+            for r in ordered_races:
               # is there a path from our write to the the race
-              if r.i_event.eid in write_succs or r.k_event.eid in write_succs:
-                # ignore races that we just removed using the data dep edge.
-                if (r.i_event == event and r.k_event == write_event) or (r.i_event == write_event and r.k_event == event):
-                  data_dep_races.add(r)
-                else:
-                  # only add a covered race the first time
-                  if r not in covered_races and r not in data_dep_races:
-                    if self.has_path(r.i_event.eid, r.k_event.eid, bidirectional=True, use_path_cache=False):
-                      # race is not a race anymore
-                      self.race_detector._races_harmful.remove(r)
-                      self.race_detector.covered_races.append(r)
-                      covered_races[r] = (eid, write_eid)
+              if r not in done and (reachability.has_path(write_eid, r.i_event.eid) or
+                                    reachability.has_path(write_eid, r.k_event.eid)):
+                cover(r, event, write_event)
     self.covered_races = covered_races
     return self.covered_races
 
@@ -912,15 +1413,19 @@ class HappensBeforeGraph(object):
     # assume races is ordered!
     assert all(races[i] < races[i+1] for i in xrange(len(races)-1))
     versions_for_race = defaultdict(set)
+    version_of = self._versions_by_eid(self.versions)
     for race in races:
       # get versions for each race
-      for version, cmds in self.versions.iteritems():
-        if race.i_event.eid in cmds or race.k_event.eid in cmds:
-          versions_for_race[race].add(version)
+      for eid in [race.i_event.eid, race.k_event.eid]:
+        if eid in version_of:
+          versions_for_race[race].add(version_of[eid])
     return versions_for_race
 
   def _is_inconsistent_packet_entry_version(self, trace, race, dpids_affected):
-      trace_nodes = nx.dfs_preorder_nodes(trace, trace.graph['host_send'].eid)
+      if isinstance(trace, PacketTrace):
+        trace_nodes = trace.dfs_preorder_nodes()
+      else:
+        trace_nodes = nx.dfs_preorder_nodes(trace, trace.graph['host_send'].eid)
       trace_dpids = [getattr(self.g.node[node]['event'], 'dpid', None) for node in trace_nodes]
       racing_dpid = race.i_event.dpid
       # which switches/nodes does the packet traverse before hitting this 1 uncovered race?
@@ -1016,7 +1521,7 @@ class HappensBeforeGraph(object):
     return barrier_replies
 
   def find_reactive_versions2(self):
-    considered = []
+    considered = set()
     cmds = []
     ordered_msgs = OrderedDict()
     #sorted_msgs = sorted(self.msgs.values(), key=lambda m: m.operations[0].t if getattr(m, 'operations', None) else 0)
@@ -1029,7 +1534,7 @@ class HappensBeforeGraph(object):
       if eid in considered:
         continue
       else:
-        considered.append(eid)
+        considered.add(eid)
       nodes = []
       # TODO(jm): Are we sure just_mid_iter is correct? What about packets sent 
       # out by a PACKET_OUT that then trigger a PACKET_IN -> ... -> BARRIER_REPLY?find_barrier_replies
@@ -1039,7 +1544,7 @@ class HappensBeforeGraph(object):
         src_event = self.g.node[src]['event']
         dst_event = self.g.node[dst]['event']
         if isinstance(dst_event, HbMessageSend):
-          considered.append(dst_event.eid)
+          considered.add(dst_event.eid)
         if isinstance(src_event, HbMessageHandle) and src_event.eid not in considered:
           nodes.append(src_event)
           self.g.node[src]['cmd_type'] = "Reactive to %d" % eid
@@ -1050,7 +1555,7 @@ class HappensBeforeGraph(object):
       nodes = sorted(list(set(nodes)),
                      key=lambda n: n.operations[0].t if n.operations else 0)
       for n in nodes:
-        considered.append(n.eid)
+        considered.add(n.eid)
       cmds.append((self.msgs[eid], nodes))
 
     for l, (x, i) in enumerate(cmds):
@@ -1062,8 +1567,7 @@ class HappensBeforeGraph(object):
 
   def find_reactive_versions(self):
     cmds = []
-    considered = []
-    cv = dict()
+    cv = dict() # eid of a cmd -> eid of the msg it reacts to
     for eid in self.msgs:
       if self.msgs[eid].msg_type_str == 'OFPT_BARRIER_REPLY':
         continue
@@ -1083,20 +1587,13 @@ class HappensBeforeGraph(object):
       # Get unique and sort by time
       nodes = sorted(list(set(nodes)),
                      key=lambda n: n.operations[0].t if n.operations else 0)
+      # As every cmd is only considered once, the versions are disjoint
       for n in nodes:
-        assert n.eid not in considered, "For event %d at eid %d it was considered at %d" % (n.eid, eid, cv[n.eid])
-        considered.append(n.eid)
+        assert n.eid not in cv, "For event %d at eid %d it was considered at %d" % (n.eid, eid, cv[n.eid])
         cv[n.eid] = eid
-        considered.append(n.eid)
 
       cmds.append((self.msgs[eid], nodes))
 
-    for l, (x, i) in enumerate(cmds):
-      for k, (y, j) in enumerate(cmds):
-        if l == k:
-          continue
-        assert not set(i).intersection(j), "l %s and k%s" % (l, k)
-
     return cmds
 
   def find_proactive_cmds(self, reactive_versions=None):
@@ -1117,15 +1614,23 @@ class HappensBeforeGraph(object):
     proactive.sort(key=lambda n: n.operations[0].t)
     return proactive
 
-  def cluster_cmds(self, cmds):
+  def cluster_cmds(self, cmds, threshold=0.8):
     """
     Cluster the update commands by time.
+
+    Same clusters as single linkage clustering with a distance threshold
+    (scipy's fclusterdata(features, threshold, criterion="distance")): in one
+    dimension, a new cluster starts wherever the gap between two consecutive
+    times is larger than the threshold. Needs O(n log n) time and O(n) memory.
     """
-    # Cluster by time
-    from scipy.cluster.hierarchy import fclusterdata
     # TODO(jm): Should we add a setting for the threshold, or use STS rounds instead of time?
-    features = [[e.operations[0].t] for e in cmds]
-    result = fclusterdata(features, 0.8, criterion="distance")
+    result = [None] * len(cmds)
+    by_time = sorted(range(len(cmds)), key=lambda i: cmds[i].operations[0].t)
+    cluster = 0
+    for n, i in enumerate(by_time):
+      if n > 0 and cmds[i].operations[0].t - cmds[by_time[n - 1]].operations[0].t > threshold:
+        cluster += 1
+      result[i] = cluster
     clustered = defaultdict(list)
     for i in range(len(cmds)):
       clustered[result[i]].append(cmds[i])
@@ -1163,14 +1668,14 @@ class HappensBeforeGraph(object):
     requests_by_xid = {} # (dpid, xid) -> version
 
     # Sort replies by dpid and xid
+    version_of = self._versions_by_eid(versions)
+    version_order = dict((v, i) for i, v in enumerate(versions))
     for rep, cmds in barrier_replies:
       key = (rep.dpid, rep.msg.xid)
       replies_by_xid[key] = [event.eid for event in cmds]
-      replies_by_xid_versions[key] = []
-      reactive_cmds = set(replies_by_xid[key])
-      for v, v_cmds in versions.iteritems():
-        if reactive_cmds.intersection(v_cmds):
-          replies_by_xid_versions[key].append(v)
+      reply_versions = set(version_of[eid] for eid in replies_by_xid[key] if eid in version_of)
+      # in the same order as the versions
+      replies_by_xid_versions[key] = sorted(reply_versions, key=version_order.get)
 
     # Sort requests by dpid and xid
     for v, v_cmds in versions.iteritems():
@@ -1200,13 +1705,28 @@ class HappensBeforeGraph(object):
     self.versions = versions
     return versions
 
+  def _versions_by_eid(self, versions):
+    """
+    Returns a dict mapping the eid of each cmd to its version. The versions
+    are disjoint, see find_reactive_versions.
+    """
+    version_of = dict()
+    for version, cmds in versions.iteritems():
+      for cmd in cmds:
+        version_of[cmd] = version
+    return version_of
+
   def find_inconsistent_updates(self):
     """Try to find if two versions race with each other"""
     versions = self.find_versions()
+    version_of = self._versions_by_eid(versions)
 
     # TODO(jm): Could we check the races directly instead of creating the ww_races variable?
     racing_versions_tuples = []
     racing_versions_dict = {}
+    # for membership tests on the lists above
+    racing_versions_pairs = set()
+    racing_versions_dict_eids = {}
 
     ww_races = defaultdict(list)
     for race in self.race_detector.races_harmful_with_covered:
@@ -1219,21 +1739,15 @@ class HappensBeforeGraph(object):
       for cmd in cmds:
         if cmd in ww_races:
           for other in ww_races[cmd]:
-            if other not in cmds:
+            if version_of.get(other) != version:
               racing_events.append((cmd, other))
     racing_versions = []
     for eid1, eid2 in racing_events:
-      v1 = None
-      v2 = None
-      for version, cmds in versions.iteritems():
-        if eid1 in cmds:
-          v1 = version
-        if eid2 in cmds:
-          v2 = version
-        if v1 and v2 and v1 != v2:
-          break
+      v1 = version_of.get(eid1)
+      v2 = version_of.get(eid2)
       racing_versions.append((v1, v2, (eid1, eid2), (versions[v1], versions[v2])))
-      if set([v1, v2]) not in racing_versions_tuples:
+      if frozenset([v1, v2]) not in racing_versions_pairs:
+        racing_versions_pairs.add(frozenset([v1, v2]))
         racing_versions_tuples.append(set([v1, v2]))
       ordered_versions = (v1, v2)
       er1 = eid1
@@ -1244,10 +1758,13 @@ class HappensBeforeGraph(object):
         er2 = eid1
       if ordered_versions not in racing_versions_dict:
         racing_versions_dict[ordered_versions] = [[], []]
-      if er1 not in racing_versions_dict[ordered_versions][0] and\
-        er2 not in racing_versions_dict[ordered_versions][1]:
+        racing_versions_dict_eids[ordered_versions] = (set(), set())
+      eids1, eids2 = racing_versions_dict_eids[ordered_versions]
+      if er1 not in eids1 and er2 not in eids2:
         racing_versions_dict[ordered_versions][0].append(er1)
         racing_versions_dict[ordered_versions][1].append(er2)
+        eids1.add(er1)
+        eids2.add(er2)
     return racing_versions, racing_versions_tuples, racing_versions_dict
 
   def print_versions(self, versions, selected_versions=[]):
@@ -1285,17 +1802,16 @@ class HappensBeforeGraph(object):
       race_edges.append((r.i_event.eid, r.k_event.eid))
       eids.append(v[0])
       eids.append(v[1])
-      for path in nx.all_simple_paths(self.g, r.i_event.eid, r.k_event.eid):
-        nodes_on_path.extend(path)
-      for path in nx.all_simple_paths(self.g, r.k_event.eid, r.i_event.eid):
+      for path in self.race_paths(r.i_event.eid, r.k_event.eid):
         nodes_on_path.extend(path)
+      sys.stdout.flush()
     nodes_on_path = list(set(nodes_on_path))
     sub_nodes = nodes_on_path + eids
     subg = self.g.subgraph(list(set(sub_nodes)))
     for i, k in race_edges:
       subg.add_edge(k, i, rel='covered')
     self.prep_draw(subg, True)
-    nx.write_dot(subg, os.path.join(self.results_dir, 'covered_races.dot'))
+    self.write_graph(subg, os.path.join(self.results_dir, 'covered_races.dot'))
 
   def racing_versions_graph(self, v1, cmd1, v2, cmd2):
     nodes = []
@@ -1348,7 +1864,11 @@ class Main(object):
                ignore_ethertypes=None, no_race=False, alt_barr=False,
                verbose=True, ignore_first=False, disable_path_cache=False, data_deps=False,
                no_dot_files=False, verify_and_minimize_only=False,
-               is_minimized=False):
+               is_minimized=False, delta_sweep=None, trace_views=False,
+               digest_verification=False, full_check_interval=100,
+               reader_thread=False, progress_interval=None,
+               race_path_limit=10, race_path_timeout=10.0,
+               graph_format='dot', graph_race_radius=None):
     self.filename = os.path.realpath(filename)
     self.results_dir = os.path.dirname(self.filename)
     self.output_filename = self.results_dir + "/" + "hb.dot"
@@ -1367,20 +1887,80 @@ class Main(object):
     self.no_dot_files = no_dot_files
     self.verify_and_minimize_only = verify_and_minimize_only
     self.is_minimized = is_minimized
+    # List of time deltas to evaluate after loading the trace only once.
+    # None stands for an infinite delta, i.e. no HB edges based on time.
+    self.delta_sweep = delta_sweep
+    self.trace_views = trace_views
+    self.digest_verification = digest_verification
+    self.full_check_interval = full_check_interval
+    # Options for loading the trace, see HappensBeforeGraph.load_trace
+    self.reader_thread = reader_thread
+    self.progress_interval = progress_interval
+    self.race_path_limit = race_path_limit
+    self.race_path_timeout = race_path_timeout
+    self.graph_format = graph_format
+    self.graph_race_radius = graph_race_radius
+
+  def _create_graph(self, add_hb_time, rw_delta, ww_delta, defer_time_edges=False):
+    return HappensBeforeGraph(results_dir=self.results_dir,
+                              add_hb_time=add_hb_time,
+                              rw_delta=rw_delta,
+                              ww_delta=ww_delta,
+                              filter_rw=self.filter_rw,
+                              ignore_ethertypes=self.ignore_ethertypes,
+                              no_race=self.no_race,
+                              alt_barr=self.alt_barr,
+                              disable_path_cache=self.disable_path_cache,
+                              data_deps=self.data_deps,
+                              verify_and_minimize_only=self.verify_and_minimize_only,
+                              is_minimized=self.is_minimized,
+                              defer_time_edges=defer_time_edges,
+                              trace_views=self.trace_views,
+                              digest_verification=self.digest_verification,
+                              full_check_interval=self.full_check_interval,
+                              race_path_limit=self.race_path_limit,
+                              race_path_timeout=self.race_path_timeout,
+                              graph_format=self.graph_format,
+                              graph_race_radius=self.graph_race_radius)
+
+  def run_delta_sweep(self):
+    """
+    Load and build the graph once, then run the analysis for every delta in
+    self.delta_sweep on a copy of it. Writes the same results_*.dat and
+    timings_*.dat files as separate runs with each of the deltas.
+    """
+    t0 = time.time()
+    # The time edges are recorded for the smallest delta, larger deltas only
+    # add a subset of them
+    finite_deltas = [delta for delta in self.delta_sweep if delta is not None]
+    if finite_deltas:
+      base_graph = self._create_graph(True, min(finite_deltas), min(finite_deltas),
+                                      defer_time_edges=True)
+    else:
+      base_graph = self._create_graph(False, self.rw_delta, self.ww_delta,
+                                      defer_time_edges=True)
+    base_graph.load_trace(self.filename, reader_thread=self.reader_thread,
+                          progress_interval=self.progress_interval)
+    shared_load_time = time.time() - t0
+
+    for delta in self.delta_sweep:
+      if delta is None:
+        add_hb_time, rw_delta, ww_delta = False, self.rw_delta, self.ww_delta
+      else:
+        add_hb_time, rw_delta, ww_delta = True, delta, delta
+      print "\n######## Analysis for delta %s ########" % ('inf' if delta is None else delta)
+      # Account for the shared loading time in every run
+      t_start = time.time() - shared_load_time
+      self.graph = base_graph.copy_with_deltas(add_hb_time, rw_delta, ww_delta)
+      self.analyze(add_hb_time, rw_delta, ww_delta, t_start, time.time())
 
   def run(self):
-    self.graph = HappensBeforeGraph(results_dir=self.results_dir,
-                                    add_hb_time=self.add_hb_time,
-                                    rw_delta=self.rw_delta,
-                                    ww_delta=self.ww_delta,
-                                    filter_rw=self.filter_rw,
-                                    ignore_ethertypes=self.ignore_ethertypes,
-                                    no_race=self.no_race,
-                                    alt_barr=self.alt_barr,
-                                    disable_path_cache=self.disable_path_cache,
-                                    data_deps=self.data_deps,
-                                    verify_and_minimize_only=self.verify_and_minimize_only,
-                                    is_minimized=self.is_minimized)
+    if self.delta_sweep and not self.verify_and_minimize_only:
+      self.run_delta_sweep()
+      print "Peak RSS: %.1f MB" % peak_rss_mb()
+      return
+    self.graph = self._create_graph(self.add_hb_time, self.rw_delta,
+                                    self.ww_delta)
     import resource
 #     from guppy import hpy
 #     import objgraph
@@ -1395,239 +1975,246 @@ class Main(object):
       #gc.collect()
       #print 'Memory usage: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
     else:
-      self.graph.load_trace(self.filename)
+      self.graph.load_trace(self.filename, reader_thread=self.reader_thread,
+                            progress_interval=self.progress_interval)
       #gc.collect()
       #print 'Memory usage: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
       t1 = time.time()
-      
-      self.graph.race_detector.detect_races(verbose=True)
-      #gc.collect()
-      #print 'Memory usage: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
-      self.graph.update_path_cache() # the race detector doesn't do it, so we do it ourself.
-      #gc.collect()
-      #print 'Memory usage: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
-      self.graph.race_detector.print_races(self.verbose)
-      #gc.collect()
-      #print 'Memory usage: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
-      t2 = time.time()
-            
-      packet_traces = self.graph.extract_traces(self.graph.g)
-      t3 = time.time()
-  
-      reactive_cmds = self.graph.find_reactive_versions()
-      t4 = time.time()
-  
-      proactive_cmds = self.graph.find_proactive_cmds(reactive_cmds)
-      versions = self.graph.find_versions()
-      t5 = time.time()
-  
-      if self.data_deps:
-        covered_races = self.graph.find_covered_races()
-      else:
-        covered_races = dict()
-      t6 = time.time()
-  
-      packet_races, inconsistent_packet_traces, \
-             inconsistent_packet_traces_covered, \
-             inconsistent_packet_entry_version, summarized = \
-        self.graph.find_per_packet_inconsistent(covered_races, True)
-      t7 = time.time()
-  
-      racing_versions, racing_versions_tuples, racing_versions_tuples_dict = self.graph.find_inconsistent_updates()
-      t8 = time.time()
-      
+      self.analyze(self.add_hb_time, self.rw_delta, self.ww_delta, t0, t1)
+    print "Peak RSS: %.1f MB" % peak_rss_mb()
+
+  def analyze(self, add_hb_time, rw_delta, ww_delta, t0, t1):
+    """
+    Run the analysis on the loaded self.graph and write the results.
+    t0 is the start time of the run, t1 the time loading finished.
+    """
+    self.graph.race_detector.detect_races(verbose=True)
+    #gc.collect()
+    #print 'Memory usage: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    self.graph.update_path_cache() # the race detector doesn't do it, so we do it ourself.
+    #gc.collect()
+    #print 'Memory usage: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    self.graph.race_detector.print_races(self.verbose)
+    #gc.collect()
+    #print 'Memory usage: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t2 = time.time()
+          
+    packet_traces = self.graph.extract_traces(self.graph.g)
+    t3 = time.time()
+
+    reactive_cmds = self.graph.find_reactive_versions()
+    t4 = time.time()
+
+    proactive_cmds = self.graph.find_proactive_cmds(reactive_cmds)
+    versions = self.graph.find_versions()
+    t5 = time.time()
+
+    if self.data_deps:
+      covered_races = self.graph.find_covered_races()
+    else:
+      covered_races = dict()
+    t6 = time.time()
+
+    packet_races, inconsistent_packet_traces, \
+           inconsistent_packet_traces_covered, \
+           inconsistent_packet_entry_version, summarized = \
+      self.graph.find_per_packet_inconsistent(covered_races, True)
+    t7 = time.time()
+
+    racing_versions, racing_versions_tuples, racing_versions_tuples_dict = self.graph.find_inconsistent_updates()
+    t8 = time.time()
+    
+    if not self.no_dot_files:
+      self.graph.store_traces(self.results_dir, print_packets=True, subgraphs=packet_traces)
+      print "Saved HB graph to:", self.graph.store_graph(self.output_filename, self.print_pkt)
+   
+      # Print traces
+      for trace, races in packet_races:
+        self.graph.print_racing_packet_trace(trace, races, label='incoherent', show_covered=False)
+      for trace, races, _ in inconsistent_packet_traces:
+        self.graph.print_racing_packet_trace(trace, races, label='incoherent_remaining')
+      for trace, races, _ in inconsistent_packet_traces_covered:
+        self.graph.print_racing_packet_trace(trace, races, label='covered')
+      for trace, races, _ in inconsistent_packet_entry_version:
+        self.graph.print_racing_packet_trace(trace, races, label='entry')
+      for trace, races, _ in summarized:
+        #self.graph.print_racing_packet_trace(trace, races, label='summarized')
+        pass
+      self.graph.save_races_graph(self.print_pkt)
+
+#     self.graph.print_versions(versions)
+#     self.graph.print_covered_races()
+
+    num_writes = len(self.graph.race_detector.write_operations)
+    num_read = len(self.graph.race_detector.read_operations)
+    num_ops = num_writes + num_read
+
+    num_harmful = self.graph.race_detector.total_harmful
+    num_commute = self.graph.race_detector.total_commute
+    num_races = self.graph.race_detector.total_races
+    num_time_filtered_races = self.graph.race_detector.total_time_filtered_races
+    num_covered = self.graph.race_detector.total_covered
+
+    num_time_edges = self.graph.race_detector.time_edges_counter
+
+    num_per_pkt_races = len(packet_races)
+    num_per_pkt_inconsistent = len(inconsistent_packet_traces)
+    num_per_pkt_inconsistent_covered = len(inconsistent_packet_traces_covered)
+    num_per_pkt_entry_version_race = len(inconsistent_packet_entry_version)
+    num_per_pkt_inconsistent_no_repeat = len(summarized)
+
+
+    load_time = t1 - t0
+    detect_races_time = t2 - t1
+    extract_traces_time = t3 - t2
+    find_reactive_cmds_time = t4 - t3
+    find_proactive_cmds_time = t5 - t4
+    find_covered_races_time = t6 - t5
+    per_packet_inconsistent_time = t7 - t6
+    find_inconsistent_update_time = t8 - t7
+
+
+    ##### Final time, everything else is just print statements
+    t_final = time.time()
+    total_time = t_final - t0
+
+    print "\n######## Update isolation violations ########"
+    for counter, (v1, v2) in enumerate(racing_versions_tuples_dict):
       if not self.no_dot_files:
-        self.graph.store_traces(self.results_dir, print_packets=True, subgraphs=packet_traces)
-        print "Saving HB graph to:", self.output_filename
-        self.graph.store_graph(self.output_filename, self.print_pkt)
-     
-        # Print traces
-        for trace, races in packet_races:
-          self.graph.print_racing_packet_trace(trace, races, label='incoherent', show_covered=False)
-        for trace, races, _ in inconsistent_packet_traces:
-          self.graph.print_racing_packet_trace(trace, races, label='incoherent_remaining')
-        for trace, races, _ in inconsistent_packet_traces_covered:
-          self.graph.print_racing_packet_trace(trace, races, label='covered')
-        for trace, races, _ in inconsistent_packet_entry_version:
-          self.graph.print_racing_packet_trace(trace, races, label='entry')
-        for trace, races, _ in summarized:
-          #self.graph.print_racing_packet_trace(trace, races, label='summarized')
-          pass
-        self.graph.save_races_graph(self.print_pkt)
-  
-  #     self.graph.print_versions(versions)
-  #     self.graph.print_covered_races()
-
-      num_writes = len(self.graph.race_detector.write_operations)
-      num_read = len(self.graph.race_detector.read_operations)
-      num_ops = num_writes + num_read
-
-      num_harmful = self.graph.race_detector.total_harmful
-      num_commute = self.graph.race_detector.total_commute
-      num_races = self.graph.race_detector.total_races
-      num_time_filtered_races = self.graph.race_detector.total_time_filtered_races
-      num_covered = self.graph.race_detector.total_covered
-
-      num_time_edges = self.graph.race_detector.time_edges_counter
-
-      num_per_pkt_races = len(packet_races)
-      num_per_pkt_inconsistent = len(inconsistent_packet_traces)
-      num_per_pkt_inconsistent_covered = len(inconsistent_packet_traces_covered)
-      num_per_pkt_entry_version_race = len(inconsistent_packet_entry_version)
-      num_per_pkt_inconsistent_no_repeat = len(summarized)
-
-
-      load_time = t1 - t0
-      detect_races_time = t2 - t1
-      extract_traces_time = t3 - t2
-      find_reactive_cmds_time = t4 - t3
-      find_proactive_cmds_time = t5 - t4
-      find_covered_races_time = t6 - t5
-      per_packet_inconsistent_time = t7 - t6
-      find_inconsistent_update_time = t8 - t7
-
-
-      ##### Final time, everything else is just print statements
-      t_final = time.time()
-      total_time = t_final - t0
-
-      print "\n######## Update isolation violations ########"
-      for counter, (v1, v2) in enumerate(racing_versions_tuples_dict):
-        if not self.no_dot_files:
-          rvg = self.graph.racing_versions_graph(v1, racing_versions_tuples_dict[(v1, v2)][0], v2, racing_versions_tuples_dict[(v1, v2)][1])
-          rvg_path = os.path.join(self.results_dir, 'isolation_violation_%d.dot' % counter)
-          print "Saving update isolation violation graph to %s" % rvg_path
-          nx.write_dot(rvg, rvg_path)
-        if hasattr(v1, 'eid'):
-          pv1 = "React to event %s, %s" %  (v1.eid , getattr(v1, 'msg_type_str', ''))
-        else:
-          pv1 = "Practive version %d" % v1
-        if hasattr(v2, 'eid'):
-          pv2 = "React to event %d" % v2.eid
-        else:
-          pv2 = "Practive version %d" % v2
-        print "V1:{}".format(pv1)
-        print "\tEventing racing: {}".format(racing_versions_tuples_dict[(v1, v2)][0])
-        print "V2:{}".format(pv2)
-        print "\tEventing racing: {}".format(racing_versions_tuples_dict[(v1, v2)][1])
-        print ""
-
-
-      print "\n########## Summary ###########"
-      print "* Race analysis *"
-      print "\tTotal number of events in the trace:", self.graph.g.number_of_nodes()
-      print "\tTotal number of events with read operations:", num_read
-      print "\tTotal number of events with write operations:", num_writes
-      print "\tTotal number of events with read or write operations:", num_ops
-      print "\tTotal number of observed races without any filters:", num_races
-      print "\tTotal number of commuting races:", num_commute
-      print "\tTotal number of races filtered by Time HB edges:", num_time_filtered_races
-      print "\tTotal number of races covered by data dependency:", num_covered
-      print "\tRemaining number of races after applying all enabled filters: %d (%.02f%%)" % (num_harmful, (num_harmful / float(num_races) * 100))
-
-      print "\n\n"
-      print "* Properties analysis *"
-      print "\tNumber of observed network updates:", len(versions)
-      print "\tNumber of update isolation violations:", len(racing_versions_tuples)
+        rvg = self.graph.racing_versions_graph(v1, racing_versions_tuples_dict[(v1, v2)][0], v2, racing_versions_tuples_dict[(v1, v2)][1])
+        rvg_path = os.path.join(self.results_dir, 'isolation_violation_%d.dot' % counter)
+        rvg_path = self.graph.write_graph(rvg, rvg_path)
+        print "Saved update isolation violation graph to %s" % rvg_path
+      if hasattr(v1, 'eid'):
+        pv1 = "React to event %s, %s" %  (v1.eid , getattr(v1, 'msg_type_str', ''))
+      else:
+        pv1 = "Practive version %d" % v1
+      if hasattr(v2, 'eid'):
+        pv2 = "React to event %d" % v2.eid
+      else:
+        pv2 = "Practive version %d" % v2
+      print "V1:{}".format(pv1)
+      print "\tEventing racing: {}".format(racing_versions_tuples_dict[(v1, v2)][0])
+      print "V2:{}".format(pv2)
+      print "\tEventing racing: {}".format(racing_versions_tuples_dict[(v1, v2)][1])
       print ""
-      print "\tTotal number of packets in the traces:", len(self.graph.host_sends)
-      print "\tNumber of packet coherence violations:", len(packet_races)
-      print "\tNumber of packet coherence violations filtered due covered races: ", len(inconsistent_packet_traces_covered)
-      print "\tNumber of packet coherence but only on the first switch in the update: ", len(inconsistent_packet_entry_version)
-      print "\tNumber of packet coherence violations after filtering covered races: ", len(inconsistent_packet_traces)
-      #print "\tNumber of packet inconsistencies after trimming repeated races: ", len(summarized)
-      #print "\tNumber of packet inconsistent updates: ", len(racing_versions)
-      #print "\tNumber of races: ", self.graph.race_detector.total_races
-      #print "\tNumber of races filtered by time: ", self.graph.race_detector.total_time_filtered_races
-      #print "\tNumber of commuting races: ", len(self.graph.race_detector.races_commute)
-      #print "\tNumber of harmful races: ", len(self.graph.race_detector.races_harmful)
-      #print "\tNumber of covered races: ", self.graph.race_detector.total_covered
-      #print "Number of versions:", len(versions)
 
-  
 
-      print "* Timing information *"
-      print "\tDone. Time elapsed:",total_time,"s"
-      print "\tload_trace:", load_time, "s"
-      print "\tdetect_races:", detect_races_time, "s"
-      print "\textract_traces_time:", extract_traces_time, "s"
-      print "\tfind_reactive_cmds_time:", find_reactive_cmds_time, "s"
-      print "\tfind_proactive_cmds_time:", find_proactive_cmds_time, "s"
-      print "\tfind_covered_races_time:", find_covered_races_time, "s"
-      print "\tper_packet_inconsistent_time:", per_packet_inconsistent_time, "s"
-      print "\tfind_inconsistent_update_time:", find_inconsistent_update_time, "s"
-      #print "print_races:"+(str(t3-t2))+"s"
-      #print "store_graph:"+(str(t4-t3))+"s"
-      #print "Extracting Packet traces time: "+ (str(t5 - t4)) + "s"
-      #print "Finding inconsistent traces time: "+ (str(t6 - t5)) + "s"
-  
-  
-      # Printing dat file
-      hbt = self.add_hb_time
-      rw_delta = self.rw_delta if self.add_hb_time else 'inf'
-      ww_delta = self.ww_delta if self.add_hb_time else 'inf'
-      file_name = "results_hbt_%s_altbarr_%s_dep_%s_rw_%s_ww_%s.dat" % (hbt, self.alt_barr, self.data_deps, rw_delta, ww_delta)
-      file_name = os.path.join(self.results_dir, file_name)
-      timings_file_name = "timings_hbt_%s_altbarr_%s_dep_%s_rw_%s_ww_%s.dat" % (hbt, self.alt_barr, self.data_deps, rw_delta, ww_delta)
-      timings_file_name = os.path.join(self.results_dir, timings_file_name)
-  
-  
-
-      def write_general_info_to_file(f):
-        # General info
-        f.write('key,value\n')
-        f.write('rw_delta,%s\n' % rw_delta)
-        f.write('ww_delta,%s\n' % ww_delta)
-        f.write('alt_barr,%s\n' % self.alt_barr)
-        f.write('data_deps,%s\n' % self.data_deps)
-  
-      with open(file_name, 'w') as f:
-        write_general_info_to_file(f)
-  
-        # Operations
-        f.write('num_events,%d\n' % self.graph.g.number_of_nodes())
-        f.write('num_edges,%d\n' % self.graph.g.number_of_edges())
-        f.write('num_read,%d\n' % num_read)
-        f.write('num_writes,%d\n' % num_writes)
-        f.write('num_ops,%d\n' % num_ops)
-  
-        # HB time edges
-        f.write('num_time_edges,%d\n' % num_time_edges)
-  
-        # Races info
-        # One last check
-        assert num_races == num_commute + num_covered + num_harmful + num_time_filtered_races
-        f.write('num_races,%d\n' % num_races)
-        f.write('num_harmful,%d\n' % num_harmful)
-        f.write('num_commute,%d\n' % num_commute)
-        f.write('num_time_filtered_races,%d\n' % num_time_filtered_races)
-        f.write('num_covered,%d\n' % num_covered)
-  
-        # Inconsistency
-        f.write('num_pkts,%d\n' % len(self.graph.host_sends))
-        assert len(self.graph.host_sends) >= num_per_pkt_races
-        assert num_per_pkt_races == num_per_pkt_inconsistent + num_per_pkt_inconsistent_covered + num_per_pkt_entry_version_race
-        f.write('num_per_pkt_races,%d\n' % num_per_pkt_races)
-        f.write('num_per_pkt_inconsistent,%d\n' % num_per_pkt_inconsistent)
-        f.write('num_per_pkt_inconsistent_covered,%d\n' % num_per_pkt_inconsistent_covered)
-        f.write('num_per_pkt_entry_version_race,%d\n' % num_per_pkt_entry_version_race)
-        f.write('num_per_pkt_inconsistent_no_repeat,%d\n' % num_per_pkt_inconsistent_no_repeat)
-        f.write('num_versions,%d\n' % len(versions))
-        f.write('num_racing_versions,%d\n' % len(racing_versions_tuples))
-  
-      with open(timings_file_name, 'w') as f:
-        write_general_info_to_file(f)
-        
-        # Times
-        f.write('total_time_sec,%f\n'% total_time)
-        f.write('load_time_sec,%f\n' % load_time )
-        f.write('detect_races_time_sec,%f\n' % detect_races_time )
-        f.write('extract_traces_time_sec,%f\n' % extract_traces_time )
-        f.write('find_reactive_cmds_time_sec,%f\n' % find_reactive_cmds_time )
-        f.write('find_proactive_cmds_time_sec,%f\n' % find_proactive_cmds_time )
-        f.write('find_covered_races_time,%f\n' % find_covered_races_time )
-        f.write('per_packet_inconsistent_time_sec,%f\n' % per_packet_inconsistent_time )
-        f.write('find_inconsistent_update_time_sec,%f\n' % find_inconsistent_update_time )
+    print "\n########## Summary ###########"
+    print "* Race analysis *"
+    print "\tTotal number of events in the trace:", self.graph.g.number_of_nodes()
+    print "\tTotal number of events with read operations:", num_read
+    print "\tTotal number of events with write operations:", num_writes
+    print "\tTotal number of events with read or write operations:", num_ops
+    print "\tTotal number of observed races without any filters:", num_races
+    print "\tTotal number of commuting races:", num_commute
+    print "\tTotal number of races filtered by Time HB edges:", num_time_filtered_races
+    print "\tTotal number of races covered by data dependency:", num_covered
+    print "\tRemaining number of races after applying all enabled filters: %d (%.02f%%)" % (num_harmful, (num_harmful / float(num_races) * 100))
+
+    print "\n\n"
+    print "* Properties analysis *"
+    print "\tNumber of observed network updates:", len(versions)
+    print "\tNumber of update isolation violations:", len(racing_versions_tuples)
+    print ""
+    print "\tTotal number of packets in the traces:", len(self.graph.host_sends)
+    print "\tNumber of packet coherence violations:", len(packet_races)
+    print "\tNumber of packet coherence violations filtered due covered races: ", len(inconsistent_packet_traces_covered)
+    print "\tNumber of packet coherence but only on the first switch in the update: ", len(inconsistent_packet_entry_version)
+    print "\tNumber of packet coherence violations after filtering covered races: ", len(inconsistent_packet_traces)
+    #print "\tNumber of packet inconsistencies after trimming repeated races: ", len(summarized)
+    #print "\tNumber of packet inconsistent updates: ", len(racing_versions)
+    #print "\tNumber of races: ", self.graph.race_detector.total_races
+    #print "\tNumber of races filtered by time: ", self.graph.race_detector.total_time_filtered_races
+    #print "\tNumber of commuting races: ", len(self.graph.race_detector.races_commute)
+    #print "\tNumber of harmful races: ", len(self.graph.race_detector.races_harmful)
+    #print "\tNumber of covered races: ", self.graph.race_detector.total_covered
+    #print "Number of versions:", len(versions)
+
+
+
+    print "* Timing information *"
+    print "\tDone. Time elapsed:",total_time,"s"
+    print "\tload_trace:", load_time, "s"
+    print "\tdetect_races:", detect_races_time, "s"
+    print "\textract_traces_time:", extract_traces_time, "s"
+    print "\tfind_reactive_cmds_time:", find_reactive_cmds_time, "s"
+    print "\tfind_proactive_cmds_time:", find_proactive_cmds_time, "s"
+    print "\tfind_covered_races_time:", find_covered_races_time, "s"
+    print "\tper_packet_inconsistent_time:", per_packet_inconsistent_time, "s"
+    print "\tfind_inconsistent_update_time:", find_inconsistent_update_time, "s"
+    #print "print_races:"+(str(t3-t2))+"s"
+    #print "store_graph:"+(str(t4-t3))+"s"
+    #print "Extracting Packet traces time: "+ (str(t5 - t4)) + "s"
+    #print "Finding inconsistent traces time: "+ (str(t6 - t5)) + "s"
+
+
+    # Printing dat file
+    hbt = add_hb_time
+    rw_delta = rw_delta if add_hb_time else 'inf'
+    ww_delta = ww_delta if add_hb_time else 'inf'
+    file_name = "results_hbt_%s_altbarr_%s_dep_%s_rw_%s_ww_%s.dat" % (hbt, self.alt_barr, self.data_deps, rw_delta, ww_delta)
+    file_name = os.path.join(self.results_dir, file_name)
+    timings_file_name = "timings_hbt_%s_altbarr_%s_dep_%s_rw_%s_ww_%s.dat" % (hbt, self.alt_barr, self.data_deps, rw_delta, ww_delta)
+    timings_file_name = os.path.join(self.results_dir, timings_file_name)
+
+
+
+    def write_general_info_to_file(f):
+      # General info
+      f.write('key,value\n')
+      f.write('rw_delta,%s\n' % rw_delta)
+      f.write('ww_delta,%s\n' % ww_delta)
+      f.write('alt_barr,%s\n' % self.alt_barr)
+      f.write('data_deps,%s\n' % self.data_deps)
+
+    with open(file_name, 'w') as f:
+      write_general_info_to_file(f)
+
+      # Operations
+      f.write('num_events,%d\n' % self.graph.g.number_of_nodes())
+      f.write('num_edges,%d\n' % self.graph.g.number_of_edges())
+      f.write('num_read,%d\n' % num_read)
+      f.write('num_writes,%d\n' % num_writes)
+      f.write('num_ops,%d\n' % num_ops)
+
+      # HB time edges
+      f.write('num_time_edges,%d\n' % num_time_edges)
+
+      # Races info
+      # One last check
+      assert num_races == num_commute + num_covered + num_harmful + num_time_filtered_races
+      f.write('num_races,%d\n' % num_races)
+      f.write('num_harmful,%d\n' % num_harmful)
+      f.write('num_commute,%d\n' % num_commute)
+      f.write('num_time_filtered_races,%d\n' % num_time_filtered_races)
+      f.write('num_covered,%d\n' % num_covered)
+
+      # Inconsistency
+      f.write('num_pkts,%d\n' % len(self.graph.host_sends))
+      assert len(self.graph.host_sends) >= num_per_pkt_races
+      assert num_per_pkt_races == num_per_pkt_inconsistent + num_per_pkt_inconsistent_covered + num_per_pkt_entry_version_race
+      f.write('num_per_pkt_races,%d\n' % num_per_pkt_races)
+      f.write('num_per_pkt_inconsistent,%d\n' % num_per_pkt_inconsistent)
+      f.write('num_per_pkt_inconsistent_covered,%d\n' % num_per_pkt_inconsistent_covered)
+      f.write('num_per_pkt_entry_version_race,%d\n' % num_per_pkt_entry_version_race)
+      f.write('num_per_pkt_inconsistent_no_repeat,%d\n' % num_per_pkt_inconsistent_no_repeat)
+      f.write('num_versions,%d\n' % len(versions))
+      f.write('num_racing_versions,%d\n' % len(racing_versions_tuples))
+
+    with open(timings_file_name, 'w') as f:
+      write_general_info_to_file(f)
+      
+      # Times
+      f.write('total_time_sec,%f\n'% total_time)
+      f.write('load_time_sec,%f\n' % load_time )
+      f.write('detect_races_time_sec,%f\n' % detect_races_time )
+      f.write('extract_traces_time_sec,%f\n' % extract_traces_time )
+      f.write('find_reactive_cmds_time_sec,%f\n' % find_reactive_cmds_time )
+      f.write('find_proactive_cmds_time_sec,%f\n' % find_proactive_cmds_time )
+      f.write('find_covered_races_time,%f\n' % find_covered_races_time )
+      f.write('per_packet_inconsistent_time_sec,%f\n' % per_packet_inconsistent_time )
+      f.write('find_inconsistent_update_time_sec,%f\n' % find_inconsistent_update_time )
 
 
 
@@ -1635,7 +2222,12 @@ def auto_int(x):
   return int(x, 0)
 
 
-if __name__ == '__main__':
+def delta_or_inf(x):
+  return None if x == 'inf' else int(x)
+
+
+def parse_args(argv=None):
+  """Parse the command line options of hb_graph.py (sys.argv if argv is None)."""
   empty_delta = 1000000
   parser = argparse.ArgumentParser()
   parser.add_argument('trace_file',
@@ -1674,21 +2266,61 @@ if __name__ == '__main__':
                       default=False, help="Verify the input trace, then write out a minimized version.")
   parser.add_argument('--is-minimized', dest='is_minimized', action='store_true',
                       default=False, help="Process a minimized trace.")
+  parser.add_argument('--delta-sweep', dest='delta_sweep', nargs='+',
+                      type=delta_or_inf, default=None,
+                      help="Load the trace once and run the analysis for each of the given "
+                           "rw/ww deltas (in secs, 'inf' for no HB edges based on time).")
+  parser.add_argument('--trace-views', dest='trace_views', action='store_true',
+                      default=False, help="Extract all packet traces in one pass as views on the HB graph instead of copied subgraphs.")
+  parser.add_argument('--digest-verification', dest='digest_verification', action='store_true',
+                      default=False, help="Verify the shadow tables against the trace with digests of the flow tables.")
+  parser.add_argument('--full-check-interval', dest='full_check_interval', default=100, type=int,
+                      help="With --digest-verification, fully compare the flow tables for every n-th operation of a switch.")
+  parser.add_argument('--reader-thread', dest='reader_thread', action='store_true',
+                      default=False, help="Decode the trace in a separate thread while the graph is built.")
+  parser.add_argument('--progress', dest='progress_interval', default=None, type=float,
+                      help="Print loading progress (events/s, RSS) every n seconds.")
+  parser.add_argument('--race-paths', dest='race_path_limit', default=10, type=int,
+                      help="Draw at most n (shortest) paths between the events of a covered race, 0 for all paths.")
+  parser.add_argument('--race-path-timeout', dest='race_path_timeout', default=10.0, type=float,
+                      help="Stop searching paths between the events of a covered race after n seconds, 0 for no timeout.")
+  parser.add_argument('--graph-format', dest='graph_format', choices=GRAPH_FORMATS, default='dot',
+                      help="Format of the written graphs. 'edgelist' and 'graphml' are streamed to disk "
+                           "and much faster than 'dot' for large traces.")
+  parser.add_argument('--graph-races-only', dest='graph_race_radius', nargs='?', const=1, default=None, type=int,
+                      help="Only write the events within n edges (default 1) of a harmful race to the HB graph file.")
 
   # TODO(jm): Make option naming consistent (use _ everywhere, not a mixture of - and _).
 
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
   if not args.no_hbt:
     if args.delta == empty_delta:
       assert args.rw_delta == args.ww_delta
     else:
       args.rw_delta = args.ww_delta = args.delta
-  main = Main(args.trace_file, print_pkt=args.print_pkt,
+  return args
+
+
+def create_main(args):
+  return Main(args.trace_file, print_pkt=args.print_pkt,
               add_hb_time=not args.no_hbt, rw_delta=args.rw_delta, ww_delta=args.ww_delta,
               filter_rw=args.filter_rw, ignore_ethertypes=args.ignore_ethertypes,
               no_race=args.no_race, alt_barr=args.alt_barr, verbose=args.verbose,
               ignore_first=args.ignore_first, disable_path_cache=args.disable_path_cache, 
               data_deps=args.data_deps, no_dot_files=args.no_dot_files, 
               verify_and_minimize_only=args.verify_and_minimize_only, 
-              is_minimized=args.is_minimized)
+              is_minimized=args.is_minimized, delta_sweep=args.delta_sweep,
+              trace_views=args.trace_views,
+              digest_verification=args.digest_verification,
+              full_check_interval=args.full_check_interval,
+              reader_thread=args.reader_thread,
+              progress_interval=args.progress_interval,
+              race_path_limit=args.race_path_limit or None,
+              race_path_timeout=args.race_path_timeout or None,
+              graph_format=args.graph_format,
+              graph_race_radius=args.graph_race_radius)
+
+
+if __name__ == '__main__':
+  main = create_main(parse_args())
   main.run()
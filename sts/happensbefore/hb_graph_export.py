@@ -0,0 +1,124 @@
+"""
+Writers for HB graphs that stream the graph to disk.
+
+nx.write_dot converts the whole graph into a pygraphviz/pydot graph before
+writing it, which takes minutes and gigabytes for large traces. The writers
+here write the drawing attributes set by HappensBeforeGraph.prep_draw
+directly from the networkx graph, node by node and edge by edge:
+
+  edgelist  a tab separated file with one line per node and edge:
+              N <eid> <shape> <style> <label>
+              E <src> <dst> <rel> <harmful> <color> <style>
+            Missing attributes are empty, tabs and newlines in values are
+            escaped.
+  graphml   GraphML with the same attributes, all as strings.
+  dot       nx.write_dot, as before.
+"""
+
+import os
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+import networkx as nx
+
+
+GRAPH_FORMATS = ('dot', 'edgelist', 'graphml')
+GRAPH_FORMAT_EXTENSIONS = {'dot': '.dot', 'edgelist': '.tsv', 'graphml': '.graphml'}
+
+NODE_ATTRS = ('shape', 'style', 'label')
+EDGE_ATTRS = ('rel', 'harmful', 'color', 'style')
+
+
+def _escape_field(value):
+  if value is None:
+    return ''
+  return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def _unescape_field(field):
+  chars = []
+  it = iter(field)
+  for c in it:
+    if c == '\\':
+      c = next(it)
+      c = {'t': '\t', 'n': '\n'}.get(c, c)
+    chars.append(c)
+  return ''.join(chars)
+
+
+def write_edge_list(g, filename):
+  with open(filename, 'w') as f:
+    f.write("# N eid %s\n" % ' '.join(NODE_ATTRS))
+    f.write("# E src dst %s\n" % ' '.join(EDGE_ATTRS))
+    for eid, data in g.nodes_iter(data=True):
+      f.write('\t'.join(['N', _escape_field(eid)] +
+                        [_escape_field(data.get(x)) for x in NODE_ATTRS]) + '\n')
+    for src, dst, data in g.edges_iter(data=True):
+      f.write('\t'.join(['E', _escape_field(src), _escape_field(dst)] +
+                        [_escape_field(data.get(x)) for x in EDGE_ATTRS]) + '\n')
+
+
+def read_edge_list(filename):
+  """
+  Reads a file written by write_edge_list. Node ids that are numbers are
+  returned as ints, all attributes as strings.
+  """
+  def node_id(field):
+    field = _unescape_field(field)
+    return int(field) if field.isdigit() else field
+
+  g = nx.DiGraph()
+  with open(filename) as f:
+    for line in f:
+      if line.startswith('#'):
+        continue
+      fields = line.rstrip('\n').split('\t')
+      if fields[0] == 'N':
+        attrs = zip(NODE_ATTRS, fields[2:])
+        g.add_node(node_id(fields[1]), dict((k, _unescape_field(v)) for k, v in attrs if v))
+      elif fields[0] == 'E':
+        attrs = zip(EDGE_ATTRS, fields[3:])
+        g.add_edge(node_id(fields[1]), node_id(fields[2]),
+                   dict((k, _unescape_field(v)) for k, v in attrs if v))
+  return g
+
+
+def write_graphml(g, filename):
+  with open(filename, 'w') as f:
+    f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    for attr in NODE_ATTRS:
+      f.write('  <key id="n_%s" for="node" attr.name="%s" attr.type="string"/>\n' % (attr, attr))
+    for attr in EDGE_ATTRS:
+      f.write('  <key id="e_%s" for="edge" attr.name="%s" attr.type="string"/>\n' % (attr, attr))
+    f.write('  <graph edgedefault="directed">\n')
+    for eid, data in g.nodes_iter(data=True):
+      f.write('    <node id=%s>' % quoteattr(str(eid)))
+      for attr in NODE_ATTRS:
+        if data.get(attr) is not None:
+          f.write('<data key="n_%s">%s</data>' % (attr, escape(str(data[attr]))))
+      f.write('</node>\n')
+    for src, dst, data in g.edges_iter(data=True):
+      f.write('    <edge source=%s target=%s>' % (quoteattr(str(src)), quoteattr(str(dst))))
+      for attr in EDGE_ATTRS:
+        if data.get(attr) is not None:
+          f.write('<data key="e_%s">%s</data>' % (attr, escape(str(data[attr]))))
+      f.write('</edge>\n')
+    f.write('  </graph>\n')
+    f.write('</graphml>\n')
+
+
+def write_graph(g, filename, graph_format='dot'):
+  """
+  Writes g in graph_format. The extension of filename is replaced with the
+  one of the format. Returns the name of the written file.
+  """
+  assert graph_format in GRAPH_FORMATS, "Unknown graph format %s" % graph_format
+  filename = os.path.splitext(filename)[0] + GRAPH_FORMAT_EXTENSIONS[graph_format]
+  if graph_format == 'dot':
+    nx.write_dot(g, filename)
+  elif graph_format == 'edgelist':
+    write_edge_list(g, filename)
+  else:
+    write_graphml(g, filename)
+  return filename
@@ -48,47 +48,88 @@ class JsonEvent(Event):
   _to_json_attrs = ['eid', 'type']
   _from_json_attrs = {'eid': lambda x: x}
   _json_types = {}
+  # attr -> (encoder, decoder) used instead of the JSON ones in binary
+  # traces, see hb_trace_format
+  _binary_attrs = {}
+  _decode_plans = {} # type name -> compiled decode plan, see register_type
+  _binary_decode_plans = {} # same, for binary traces
+  _encode_plans = {} # (class, binary) -> [(attr, encoder or None)]
 
   def __init__(self, eid=None):
     Event.__init__(self)
     self.eid = eid if eid else self._ids.next()
     self.type = self.__class__.__name__
 
+  @classmethod
+  def _encode_plan(cls, binary):
+    plan = JsonEvent._encode_plans.get((cls, binary), None)
+    if plan is None:
+      plan = []
+      for i in cls._to_json_attrs:
+        attr, fun = i if isinstance(i, tuple) else (i, None)
+        if binary and attr in cls._binary_attrs:
+          fun = cls._binary_attrs[attr][0]
+        plan.append((attr, fun))
+      JsonEvent._encode_plans[(cls, binary)] = plan
+    return plan
+
+  def to_dict(self, binary=False):
+    """
+    The encoded attributes of the event. With binary, the encoders of
+    _binary_attrs are used where given.
+    """
+    json_dict = dict() if binary else OrderedDict()
+    for attr, fun in self._encode_plan(binary):
+      if hasattr(self, attr):
+        value = getattr(self, attr)
+        json_dict[attr] = value if fun is None else fun(value)
+    return json_dict
+
   def to_json(self):
-    json_dict = OrderedDict()
-    for i in self._to_json_attrs:
-      if isinstance(i, tuple):
-        attr = i[0]
-        fun = i[1]
-        if hasattr(self, attr):
-          json_dict[attr] = fun(getattr(self, attr))
-      elif hasattr(self, i):
-        json_dict[i] = getattr(self, i)
-        
-    return json.dumps(json_dict, sort_keys=False)
+    return json.dumps(self.to_dict(), sort_keys=False)
 
   @classmethod
   def register_type(cls, klass):
     """Register a class to be decoded in from_json"""
     cls._json_types[klass.__name__] = klass
+    cls._decode_plans[klass.__name__] = cls._compile_decode_plan(klass)
+    cls._binary_decode_plans[klass.__name__] = cls._compile_decode_plan(klass, binary=True)
 
+  @staticmethod
+  def _compile_decode_plan(klass, binary=False):
+    """
+    Returns (class, attribute decoders, accepts make_copy) for klass.
 
-  # TODO(jm): I did some tests to see why loading events is so slow.
-  #           JsonEvent.from_json is the slow part, everything else
-  #           (including json.loads()) is blazing fast.
-  #           We might want to speed that up a bit.
+    Computed once per registered class, so that decoding does not need
+    any reflection on the class or its __init__ per event.
+    """
+    accepts_make_copy = 'make_copy' in inspect.getargspec(klass.__init__).args
+    decoders = dict(klass._from_json_attrs)
+    if binary:
+      for attr, (_, decoder) in klass._binary_attrs.iteritems():
+        if attr in decoders:
+          decoders[attr] = decoder
+    return klass, decoders, accepts_make_copy
 
   @classmethod
   def from_json(cls, json_dict):
     """Decode json dict to JsonEvent"""
-    assert json_dict.get('type', None) in cls._json_types,\
+    return cls.from_dict(json_dict)
+
+  @classmethod
+  def from_dict(cls, json_dict, binary=False):
+    """Decode a dict returned by to_dict to JsonEvent"""
+    plans = cls._binary_decode_plans if binary else cls._decode_plans
+    plan = plans.get(json_dict.get('type', None), None)
+    assert plan is not None,\
       "Unrecognized event type %s" % json_dict.get('type', None)
-    cls_type = cls._json_types[json_dict['type']]
+    cls_type, decoders, accepts_make_copy = plan
     vals = {}
     for k, v in json_dict.iteritems():
-      if k in cls_type._from_json_attrs:
-        vals[k] = cls_type._from_json_attrs[k](v)
-    if 'make_copy' in inspect.getargspec(cls_type.__init__).args:
+      decoder = decoders.get(k, None)
+      if decoder is not None:
+        vals[k] = decoder(v)
+    if accepts_make_copy:
       vals['make_copy'] = False
     obj = cls_type(**vals)
     return obj
@@ -1,10 +1,10 @@
 from _collections import defaultdict
 from threading import RLock
-import itertools
 import logging
 import time
 import base64
 import copy
+import hashlib
 
 from pox.lib.revent.revent import EventMixin
 from sts.happensbefore.hb_sts_events import *
@@ -14,6 +14,15 @@ from pox.openflow.libopenflow_01 import *
 from sts.util.convenience import base64_encode_raw, base64_decode, base64_decode_openflow
 from sts.util.procutils import prefixThreadOutputMatcher, PrefixThreadLineMatch
 from sts.happensbefore.hb_graph import HappensBeforeGraph
+from sts.happensbefore.hb_flow_table_delta import FlowTableDeltaEncoder
+from sts.happensbefore.hb_online import OnlineRaceDetector
+from sts.happensbefore.hb_trace_format import TRACE_FORMATS
+from sts.happensbefore.hb_trace_format import encode_binary_event
+from sts.happensbefore.hb_trace_format import write_binary_header
+from sts.happensbefore.hb_trace_format import write_binary_record
+from sts.happensbefore.hb_trace_writer import AsyncTraceWriter
+from sts.happensbefore.hb_msg_index import BoundedDict
+from sts.happensbefore.hb_msg_index import MessageIndex
 
 class HappensBeforeLogger(EventMixin):
   '''
@@ -37,14 +46,77 @@ class HappensBeforeLogger(EventMixin):
   controller_hb_msg_in = "HappensBefore-MessageIn"
   controller_hb_msg_out = "HappensBefore-MessageOut"
   
-  def __init__(self, patch_panel):
+  def __init__(self, patch_panel, flow_table_keyframe_interval=None,
+               online_race_detection=None, trace_format='json',
+               async_trace_writer=False, trace_flush_interval=1.0,
+               controller_match_timeout=300, controller_match_cache_size=100000):
+    '''
+    If flow_table_keyframe_interval is set, the flow tables of operations are
+    delta encoded with a full table every flow_table_keyframe_interval
+    operations per switch (see hb_flow_table_delta).
+
+    trace_format is 'json' (one JSON event per line) or 'binary', which is
+    smaller and faster to write and read (see hb_trace_format). Both are read
+    by HappensBeforeGraph.load_trace.
+
+    If online_race_detection is set (a dict of OnlineRaceDetector arguments,
+    possibly empty), races are detected while the trace is written.
+
+    If async_trace_writer is set, events are encoded and written by a writer
+    thread, which flushes the trace every trace_flush_interval seconds (see
+    hb_trace_writer). Otherwise the trace is flushed after every event.
+
+    Switch messages and controller instrumentation lines that were not matched
+    after controller_match_timeout seconds are dropped (never if None). The
+    other state for matching them keeps at most controller_match_cache_size
+    messages.
+    '''
     self.log = logging.getLogger("hb_logger")
     # TODO(jm): a regular (non reentrant) lock would suffice here
     self.reentrantlock = RLock()
 
     self.output = None
     self.output_path = ""
+    assert trace_format in TRACE_FORMATS, "Unknown trace format %s" % trace_format
+    self.trace_format = trace_format
     self.patch_panel = patch_panel
+
+    self.flow_table_encoder = None
+    if flow_table_keyframe_interval is not None:
+      self.flow_table_encoder = FlowTableDeltaEncoder(flow_table_keyframe_interval)
+
+    self.online_race_detector = None
+    if online_race_detection is not None:
+      self.online_race_detector = OnlineRaceDetector(**online_race_detection)
+
+    self.async_trace_writer = async_trace_writer
+    self.trace_flush_interval = trace_flush_interval
+    self.trace_writer = None
+
+    self.event_handlers = {
+        TraceHostPacketHandleBegin: self.handle_host_ph_begin,
+        TraceHostPacketHandleEnd: self.handle_host_ph_end,
+        TraceHostPacketSend: self.handle_host_ps,
+        TraceAsyncSwitchFlowExpiryBegin: self.handle_async_switch_fexp_begin,
+        TraceAsyncSwitchFlowExpiryEnd: self.handle_async_switch_fexp_end,
+        TraceSwitchPacketHandleBegin: self.handle_switch_ph_begin,
+        TraceSwitchPacketHandleEnd: self.handle_switch_ph_end,
+        TraceSwitchMessageHandleBegin: self.handle_switch_mh_begin,
+        TraceSwitchMessageHandleEnd: self.handle_switch_mh_end,
+        TraceSwitchMessageSend: self.handle_switch_ms,
+        TraceSwitchPacketSend: self.handle_switch_ps,
+        TraceSwitchMessageRx: self.handle_switch_rx_wire,
+        TraceSwitchMessageTx: self.handle_switch_tx_wire,
+        TraceSwitchFlowTableRead: self.handle_switch_table_read,
+        TraceSwitchFlowTableWrite: self.handle_switch_table_write,
+        TraceSwitchFlowTableEntryExpiry: self.handle_switch_table_entry_expiry,
+        TraceSwitchPacketDrop: self.handle_switch_packet_drop,
+        TraceSwitchBufferPut: self.handle_switch_buf_put,
+        TraceSwitchBufferGet: self.handle_switch_buf_get,
+        TraceSwitchPacketUpdateBegin: self.handle_switch_pu_begin,
+        TraceSwitchPacketUpdateEnd: self.handle_switch_pu_end,
+        PrefixThreadLineMatch: self._handle_line_match
+    }
     
     # State for linking of events
     self.pids = ObjectRegistry() # packet obj -> pid
@@ -58,19 +130,15 @@ class HappensBeforeLogger(EventMixin):
     self.explicit_successors_host_event = defaultdict(list) # hid -> [event]
     self.pending_packet_update = dict() # dpid -> packet
     
-    self.msg_to_rxbase64 = dict()
+    self.msg_to_rx_digest = BoundedDict(controller_match_cache_size) # msg -> digest
     
     # State for linking of controller events
-    self.unmatched_HbMessageSend = defaultdict(list) # dpid -> []
-    self.unmatched_HbMessageHandle = defaultdict(list) # dpid -> []
+    self.unmatched_HbMessageSend = MessageIndex(controller_match_timeout) # (dpid, digest) -> mid_out
+    self.unmatched_HbMessageHandle = MessageIndex(controller_match_timeout) # (dpid, digest) -> mid_in
     
-    self.unmatched_controller_lines = [] # lines
-    self.controller_packetin_to_mid_out = dict() # (swid, b64msg) -> mid_out
-    self.controller_packetin_mid_out_to_HbControllerHandle = dict() # mid_out -> HbControllerHandle
-    self.controller_packetin_mid_out_to_temporary_tag = dict() # mid_out -> HbControllerHandle
-    
-    self.decoded_msg_to_rxbase64 = dict()
-    self.decoded_line_msg = dict()
+    self.unmatched_controller_lines = MessageIndex(controller_match_timeout) # what the line waits for -> line
+    # (dpid, digest of b64msg) -> (mid_out, HbControllerHandle eid, temporary tag)
+    self.controller_packetin_handles = BoundedDict(controller_match_cache_size)
     
     prefixThreadOutputMatcher.add_string_to_match(self.controller_hb_msg_in)
     prefixThreadOutputMatcher.add_string_to_match(self.controller_hb_msg_out)
@@ -86,16 +154,35 @@ class HappensBeforeLogger(EventMixin):
       self.output_path = results_dir + "/" + output_filename
     else:
       raise ValueError("Default results_dir currently not supported")
-    self.output = open(self.output_path, 'w')
+    if self.trace_format == 'binary':
+      self.output = open(self.output_path, 'wb')
+      write_binary_header(self.output)
+    else:
+      self.output = open(self.output_path, 'w')
+    if self.async_trace_writer:
+      self.trace_writer = AsyncTraceWriter(self._write_event_unflushed,
+                                           self.output.flush,
+                                           self.trace_flush_interval)
     
   def close(self):
     '''
     End a trace
     '''
-    # Flush the log
-    if self.output is not None and not self.output.closed:
-      self.output.close()
-    self.output = None
+    with self.reentrantlock:
+      # Write the queued events before the log is closed
+      if self.trace_writer is not None:
+        self.trace_writer.close()
+        self.trace_writer = None
+      # Flush the log
+      if self.output is not None and not self.output.closed:
+        self.output.close()
+      self.output = None
+    if self.online_race_detector is not None:
+      with self.reentrantlock:
+        self.online_race_detector.flush()
+        self.log.info("Online race detection: %d races, %d harmful" %
+                      (self.online_race_detector.total_races,
+                       len(self.online_race_detector.harmful_races)))
 
   
   def write(self,msg):
@@ -105,6 +192,13 @@ class HappensBeforeLogger(EventMixin):
       self.output.flush()
     else:
        raise Exception("Not opened -- call HappensBeforeLogger.open()")
+
+  def write_record(self, record):
+    if self.output is not None and not self.output.closed:
+      write_binary_record(self.output, record)
+      self.output.flush()
+    else:
+       raise Exception("Not opened -- call HappensBeforeLogger.open()")
   
   def handle_no_exceptions(self, event):
     """ Handle event, catch exceptions before they go back to STS/POX
@@ -112,33 +206,8 @@ class HappensBeforeLogger(EventMixin):
     with self.reentrantlock: # this is possibly multithreaded
       try:
         if self.output is not None:
-          event_handlers = {
-              TraceHostPacketHandleBegin: self.handle_host_ph_begin,
-              TraceHostPacketHandleEnd: self.handle_host_ph_end,
-              TraceHostPacketSend: self.handle_host_ps,
-              TraceAsyncSwitchFlowExpiryBegin: self.handle_async_switch_fexp_begin,
-              TraceAsyncSwitchFlowExpiryEnd: self.handle_async_switch_fexp_end,
-              TraceSwitchPacketHandleBegin: self.handle_switch_ph_begin,
-              TraceSwitchPacketHandleEnd: self.handle_switch_ph_end,
-              TraceSwitchMessageHandleBegin: self.handle_switch_mh_begin,
-              TraceSwitchMessageHandleEnd: self.handle_switch_mh_end,
-              TraceSwitchMessageSend: self.handle_switch_ms,
-              TraceSwitchPacketSend: self.handle_switch_ps,
-              TraceSwitchMessageRx: self.handle_switch_rx_wire,
-              TraceSwitchMessageTx: self.handle_switch_tx_wire,
-              TraceSwitchFlowTableRead: self.handle_switch_table_read,
-              TraceSwitchFlowTableWrite: self.handle_switch_table_write,
-              TraceSwitchFlowTableEntryExpiry: self.handle_switch_table_entry_expiry,
-              TraceSwitchPacketDrop: self.handle_switch_packet_drop,
-              TraceSwitchBufferPut: self.handle_switch_buf_put,
-              TraceSwitchBufferGet: self.handle_switch_buf_get,
-              TraceSwitchPacketUpdateBegin: self.handle_switch_pu_begin,
-              TraceSwitchPacketUpdateEnd: self.handle_switch_pu_end,
-              PrefixThreadLineMatch: self._handle_line_match
-          }
-          handler = None
-          if type(event) in event_handlers:
-            handler = event_handlers[type(event)]
+          handler = self.event_handlers.get(type(event))
+          if handler is not None:
             handler(event)
       except Exception as e:
         # NOTE JM: do not remove, otherwise exceptions get swallowed by STS
@@ -175,8 +244,51 @@ class HappensBeforeLogger(EventMixin):
       s.addListener(TraceSwitchPacketUpdateEnd, self.handle_no_exceptions)
   
   
+  def _encode_event(self, event):
+    if self.trace_format == 'binary':
+      return encode_binary_event(event)
+    return event.to_json()
+
+  def _encode_event_with_flow_tables(self, event):
+    if self.flow_table_encoder is not None:
+      with self.flow_table_encoder.encoded(event):
+        return self._encode_event(event)
+    return self._encode_event(event)
+
+  def _write_event_unflushed(self, event):
+    """ Writes event without flushing, called by the trace writer thread
+    """
+    data = self._encode_event_with_flow_tables(event)
+    if self.trace_format == 'binary':
+      write_binary_record(self.output, data)
+      if self.online_race_detector is not None:
+        self.online_race_detector.add_record(data)
+    else:
+      self.output.write(data + '\n')
+      if self.online_race_detector is not None:
+        self.online_race_detector.add_line(data)
+
   def write_event_to_trace(self, event):
-    self.write(event.to_json())
+    if self.trace_writer is not None:
+      self.trace_writer.write(event)
+      return
+    data = self._encode_event_with_flow_tables(event)
+    if self.trace_format == 'binary':
+      self.write_record(data)
+      if self.online_race_detector is not None:
+        self.online_race_detector.add_record(data)
+    else:
+      self.write(data)
+      if self.online_race_detector is not None:
+        self.online_race_detector.add_line(data)
+
+  @property
+  def halt_requested(self):
+    '''
+    True if online race detection found a harmful race and is configured to
+    stop the fuzzer.
+    '''
+    return self.online_race_detector is not None and self.online_race_detector.halt
   
   #
   # Switch helper functions
@@ -344,8 +456,9 @@ class HappensBeforeLogger(EventMixin):
         self.add_operation_to_switch_event(TraceSwitchNoOp(event.dpid))
         
       # match with controller instrumentation
-      self.unmatched_HbMessageHandle[event.dpid].append((time.time(), mid_in, event.msg))
-      self.rematch_unmatched_lines()
+      key = (event.dpid, self._get_rx_digest(event.msg))
+      self.unmatched_HbMessageHandle.add(key, mid_in)
+      self.rematch_unmatched_lines(('handle',) + key)
   
   def handle_switch_mh_end(self, event):
     self.finish_regular_switch_event(event.dpid)
@@ -368,8 +481,9 @@ class HappensBeforeLogger(EventMixin):
     # add base64 encoded message to list for controller instrumentation
     # this will always come before the switch has had a chance to write out something, 
     # so no need to check anything here
-    self.unmatched_HbMessageSend[event.dpid].append((time.time(), mid_out, event.msg))
-    self.rematch_unmatched_lines()
+    key = (event.dpid, self._msg_digest(event.msg))
+    self.unmatched_HbMessageSend.add(key, mid_out)
+    self.rematch_unmatched_lines(('send',) + key)
   
   def handle_switch_ps(self, event):
     pid_in = self.pids.new_tag(event.packet) # tag changes here
@@ -435,10 +549,7 @@ class HappensBeforeLogger(EventMixin):
     """
     Called when a OF message is received over the wire from the switch
     """
-    msg = event.msg
-    # TODO(jm): use deepcopy instead of base64 here
-    b64msg = event.b64msg
-    self.msg_to_rxbase64[msg] = b64msg
+    self.msg_to_rx_digest[event.msg] = self._msg_digest(base64_decode_openflow(event.b64msg))
     
   def handle_switch_tx_wire(self, event):
     """
@@ -490,20 +601,23 @@ class HappensBeforeLogger(EventMixin):
   # Controller instrumentation information
   #
   
-  def _get_rxbase64(self, msg):
+  def _get_rx_digest(self, msg):
     """
-    Get the message as it was when it was received on the wire, without changes.
+    Get the digest of the message as it was when it was received on the wire,
+    without changes, and forget it.
     This is actually necessary, as the raw message is often modified as a side
     effect of parsing the message.
     This is especially the case where different Openflow libraries are used
     (e.g. when using a Floodlight controller).
+    If the digest was evicted from the bounded cache, the digest of the message
+    as it is now is used instead, which may differ from the one on the wire.
     """
-    # TODO(jm): rename method to use deepcopy instead of base64 here
-    if msg in self.msg_to_rxbase64:
-      return self.msg_to_rxbase64[msg]
-    else:
-      assert False
-    return msg
+    digest = self.msg_to_rx_digest.pop(msg, None)
+    if digest is None:
+      digest = self._msg_digest(msg)
+      self.log.warn("Digest of received message was evicted, using its current digest %s" %
+                    base64.b64encode(digest))
+    return digest
   
   def _handle_line_match(self, event):
       line = event.line
@@ -527,15 +641,15 @@ class HappensBeforeLogger(EventMixin):
       if match == self.controller_hb_msg_in:
         swid = data[0]
         b64msg = data[1]
-        self.unmatched_controller_lines.append((time.time(), swid, b64msg))
+        self.match_controller_line((time.time(), swid, b64msg))
         
       if match == self.controller_hb_msg_out:
         in_swid = data[0]
         in_b64msg = data[1]
         out_swid = data[2]
         out_b64msg = data[3]
-        self.unmatched_controller_lines.append((time.time(), in_swid, in_b64msg, out_swid, out_b64msg))
-      self.rematch_unmatched_lines()
+        self.match_controller_line((time.time(), in_swid, in_b64msg, out_swid, out_b64msg))
+      self.expire_unmatched()
     
   # TODO(jm): rename this function to start with _
   def swid_to_dpid(self, swid):
@@ -544,150 +658,131 @@ class HappensBeforeLogger(EventMixin):
     except ValueError:
       return None
   
-  # TODO(jm): rename this function to start with _
-  def compare_msg(self, m1, m2):
-    def norm (m):
-      m = m.clone()
-      m.wildcards = m._unwire_wildcards(m.wildcards)
-      m.wildcards = m._normalize_wildcards(m.wildcards)
-      return m
-    if hasattr(m1, 'match') and hasattr(m2, 'match'):
-       m1.match = norm(m1.match)
-       m2.match = norm(m2.match)
-       
-    if m1.header_type == OFPT_FLOW_REMOVED and m2.header_type == OFPT_FLOW_REMOVED:
+  def _normalize_match(self, match):
+    match = match.clone()
+    match.wildcards = match._unwire_wildcards(match.wildcards)
+    match.wildcards = match._normalize_wildcards(match.wildcards)
+    return match
+
+  def _canonical_msg_key(self, msg):
+    """
+    A key that is equal for messages that are the same on the wire and as
+    reported by the controller instrumentation. For flow removed messages,
+    these are all fields except the match, otherwise the packed message with
+    a normalized match (see _normalize_match).
+    """
+    if msg.header_type == OFPT_FLOW_REMOVED:
       # TODO(jm): something is seriously wrong with the match fields returned from the controller
-      # instrumentation in Floodlight 0.91. For now just compare on all other fields, due to the 
+      # instrumentation in Floodlight 0.91. For now just compare on all other fields, due to the
       # duration_nsec field and the xid it is very unlikely that there are collisions.
-      return (m1.xid == m2.xid and 
-              m1.cookie == m2.cookie and 
-              m1.priority == m2.priority and
-              m1.reason == m2.reason and
-              m1.duration_sec == m2.duration_sec and
-              m1.duration_nsec == m2.duration_nsec and
-              m1.duration_nsec == m2.duration_nsec and
-              m1.idle_timeout == m2.idle_timeout and
-              m1.packet_count == m2.packet_count and
-              m1.byte_count == m2.byte_count)
-    return m1 == m2
+      return (msg.header_type, msg.xid, msg.cookie, msg.priority, msg.reason,
+              msg.duration_sec, msg.duration_nsec, msg.idle_timeout,
+              msg.packet_count, msg.byte_count)
+    if hasattr(msg, 'match'):
+      msg = copy.copy(msg)
+      msg.match = self._normalize_match(msg.match)
+    return msg.pack()
+
+  def _msg_digest(self, msg):
+    """
+    A fixed size digest of the canonical key of msg.
+    """
+    key = self._canonical_msg_key(msg)
+    if isinstance(key, tuple):
+      key = repr(key)
+    return hashlib.sha1(key).digest()
   
   # TODO(jm): rename this function to start with _
-  def match_controller_line_packet_in(self, dpid, line_msg, unmatched_entry):
-    '''
-    Returns True if the line was matched to a mid_out
-    '''
-    timestamp, mid_out, msg = unmatched_entry #tuple
-    # TODO(jm): performance: do not decode every time we do the comparison, only decode once
-    
-    # TODO(jm): hack: we add caching to to this, but it really should be done somewhere else
-    if line_msg in self.decoded_line_msg:
-      decoded_line_msg = self.decoded_line_msg[line_msg]
-    else:
-      decoded_line_msg = base64_decode_openflow(line_msg)
-      self.decoded_line_msg[line_msg] = decoded_line_msg
-    
-    if self.compare_msg(msg, decoded_line_msg):
-      self.controller_packetin_to_mid_out[(dpid,line_msg)] = mid_out
-      temporary_tag = self.mids.generate_unused_tag()
-      event = HbControllerHandle(mid_out, temporary_tag)
-      first = str(event.eid)
-      self.write_event_to_trace(event)
-      self.log.info("Adding controller handle ("+first+" -> *): mid_out:"+str(mid_out)+".")
-      self.controller_packetin_mid_out_to_HbControllerHandle[mid_out] = event
-      self.controller_packetin_mid_out_to_temporary_tag[mid_out] = temporary_tag
-      return True
-    return False
+  def match_controller_line_packet_in(self, dpid, line_digest, mid_out):
+    temporary_tag = self.mids.generate_unused_tag()
+    event = HbControllerHandle(mid_out, temporary_tag)
+    first = str(event.eid)
+    self.write_event_to_trace(event)
+    self.log.info("Adding controller handle ("+first+" -> *): mid_out:"+str(mid_out)+".")
+    self.controller_packetin_handles[(dpid, line_digest)] = (mid_out, event.eid, temporary_tag)
+    # lines of messages sent in response to this one
+    for line in self.unmatched_controller_lines.pop_all(('packet_in', dpid, line_digest)):
+      self.match_controller_line(line)
   
   # TODO(jm): rename this function to start with _
-  def match_controller_line_packet_out(self, mid_out, dpid, line_msg, unmatched_entry):
-    '''
-    Returns True if the line was matched to a mid_in
-    '''
-    timestamp, mid_in, msg = unmatched_entry #tuple
-    # TODO(jm): performance: do not decode every time we do the comparison, only decode once
-    # TODO(jm): performance: do not fetch rxbase64 every time, only do it once
-    
-    # TODO(jm): hack: we add caching to to this, but it really should be done somewhere else
-    if msg in self.decoded_msg_to_rxbase64:
-      decoded_msg = self.decoded_msg_to_rxbase64[msg]
-    else:
-      decoded_msg = base64_decode_openflow(self._get_rxbase64(msg))
-      self.decoded_msg_to_rxbase64[msg] = decoded_msg
-    if line_msg in self.decoded_line_msg:
-      decoded_line_msg = self.decoded_line_msg[line_msg]
-    else:
-      decoded_line_msg = base64_decode_openflow(line_msg)
-      self.decoded_line_msg[line_msg] = decoded_line_msg
-    
-    if self.compare_msg(decoded_msg, decoded_line_msg):
-      first_event = self.controller_packetin_mid_out_to_HbControllerHandle[mid_out]
-      temporary_tag = self.controller_packetin_mid_out_to_temporary_tag[mid_out]
-      second_event = HbControllerSend(temporary_tag, mid_in)
-      first = str(first_event.eid)
-      second = str(second_event.eid)
-      self.write_event_to_trace(second_event)
-      self.log.info("Adding controller send with edge ("+first+" -> "+second+"): mid_out:"+str(mid_out)+" -> mid_in:"+str(mid_in)+".")
-      return True
-    return False
+  def match_controller_line_packet_out(self, packetin_handle, mid_in):
+    mid_out, first_eid, temporary_tag = packetin_handle
+    second_event = HbControllerSend(temporary_tag, mid_in)
+    first = str(first_eid)
+    second = str(second_event.eid)
+    self.write_event_to_trace(second_event)
+    self.log.info("Adding controller send with edge ("+first+" -> "+second+"): mid_out:"+str(mid_out)+" -> mid_in:"+str(mid_in)+".")
   
   # TODO(jm): rename this function to start with _
   def match_controller_line(self, line):
     '''
-    Returns True if the line was matched
+    Returns True if the line was matched (or discarded). Otherwise the line is
+    added to unmatched_controller_lines, under the key of what it waits for.
     '''
-    # TODO(jm): Process all lines with length 3 first, then all longer lines.
     if len(line) == 3:
       timestamp, in_swid, in_msg = line
-      # PACKET_IN <==> find mid_out, add link to self.controller_packetin_to_mid_out
+      # PACKET_IN <==> find mid_out, add link to self.controller_packetin_handles
       in_dpid = self.swid_to_dpid(in_swid)
       if in_dpid is None:
         # the controller did not supply the dpid, no way for us to ever match it
         print 'Error: Discarding controller line: ' + str(line)
         return True
-      else:
-        # we know this switch
-        for unmatched_entry in self.unmatched_HbMessageSend[in_dpid]:
-          if self.match_controller_line_packet_in(in_dpid, in_msg, unmatched_entry):
-            # we know this message
-#             print "====> MATCHED: age: {} - {}: {}".format(str(time.time()-unmatched_entry[0]), in_dpid, str(unmatched_entry[2]))
-            self.unmatched_HbMessageSend[in_dpid].remove(unmatched_entry) # okay as we exit the loop now
-            return True
-      return False
+      key = (in_dpid, self._msg_digest(base64_decode_openflow(in_msg)))
+      mid_out = self.unmatched_HbMessageSend.pop(key)
+      if mid_out is None:
+        self.unmatched_controller_lines.add(('send',) + key, line, timestamp)
+        return False
+      self.match_controller_line_packet_in(in_dpid, hashlib.sha1(in_msg).digest(), mid_out)
+      return True
     elif len(line) == 5:
       timestamp, in_swid, in_msg, out_swid, out_msg = line
       # PACKET_IN
       in_dpid = self.swid_to_dpid(in_swid)
       if in_dpid is None:
         # the controller did not supply the dpid, no way for us to ever match it
-        print 'Error: Discarding controller line: ' + line
+        print 'Error: Discarding controller line: ' + str(line)
         assert False
         return True
-      else:
-        # we know the in switch
-        if (in_dpid,in_msg) in self.controller_packetin_to_mid_out:
-          mid_out = self.controller_packetin_to_mid_out[(in_dpid,in_msg)]
-          # we know the in event
-          # PACKET_OUT/FLOW_MOD <==> find mid_in, add HB edge
-          out_dpid = self.swid_to_dpid(out_swid)
-          if out_dpid is None:
-            # the controller did not supply the dpid, no way for us to ever match it
-            print 'Error: Discarding controller line: ' + line
-            assert False
-            return True
-          else:
-            # we know the out switch
-            for unmatched_entry in self.unmatched_HbMessageHandle[out_dpid]:
-              if self.match_controller_line_packet_out(mid_out, out_dpid, out_msg, unmatched_entry):
-                # we know this message, and an edge was added
-#                 print "====> MATCHED: age: {} - {}: {}".format(str(time.time()-unmatched_entry[0]), out_dpid, str(unmatched_entry[2]))
-                self.unmatched_HbMessageHandle[out_dpid].remove(unmatched_entry) # okay as we exit the loop now
-                return True
-      return False
+      # the controller logs the same packet in for both lines, so the digest
+      # of the line is enough here
+      in_digest = hashlib.sha1(in_msg).digest()
+      packetin_handle = self.controller_packetin_handles.get((in_dpid, in_digest))
+      if packetin_handle is None:
+        self.unmatched_controller_lines.add(('packet_in', in_dpid, in_digest), line, timestamp)
+        return False
+      # we know the in event
+      # PACKET_OUT/FLOW_MOD <==> find mid_in, add HB edge
+      out_dpid = self.swid_to_dpid(out_swid)
+      if out_dpid is None:
+        # the controller did not supply the dpid, no way for us to ever match it
+        print 'Error: Discarding controller line: ' + str(line)
+        assert False
+        return True
+      key = (out_dpid, self._msg_digest(base64_decode_openflow(out_msg)))
+      mid_in = self.unmatched_HbMessageHandle.pop(key)
+      if mid_in is None:
+        self.unmatched_controller_lines.add(('handle',) + key, line, timestamp)
+        return False
+      self.match_controller_line_packet_out(packetin_handle, mid_in)
+      return True
 
   # TODO(jm): rename this function to start with _
-  def rematch_unmatched_lines(self):
-    # self.unmatched_controller_lines[:] modifies the list slice instead of assigning a new list
-    self.unmatched_controller_lines = list(itertools.ifilterfalse(self.match_controller_line, self.unmatched_controller_lines))
+  def rematch_unmatched_lines(self, key):
+    '''
+    Matches the oldest line that waits for key, after an event with key was
+    added.
+    '''
+    line = self.unmatched_controller_lines.pop(key)
+    if line is not None:
+      self.match_controller_line(line)
+    self.expire_unmatched()
+
+  def expire_unmatched(self):
+    expired_lines = self.unmatched_controller_lines.expire()
+    expired_events = (self.unmatched_HbMessageSend.expire() +
+                      self.unmatched_HbMessageHandle.expire())
+    if expired_lines or expired_events:
+      self.log.info("Controller log: dropped {} log lines and {} STS events that were not matched in time.".format(len(expired_lines), len(expired_events)))
     print "Controller log: {} log lines, {} STS events not matched.".format(len(self.unmatched_controller_lines), len(self.unmatched_HbMessageHandle) + len(self.unmatched_HbMessageSend))
 
 
@@ -0,0 +1,99 @@
+"""
+Index of the switch events and controller instrumentation lines that
+HappensBeforeLogger has not matched yet.
+
+Messages are matched by a digest of their normalized wire bytes (see
+HappensBeforeLogger._msg_digest), so that matching a controller line is a
+dict lookup instead of a comparison with every unmatched message of the
+switch. Values that do not get matched, e.g. messages the controller does
+not log, are forgotten after max_age seconds.
+"""
+
+from collections import deque
+from collections import OrderedDict
+import time
+
+
+class MessageIndex(object):
+  '''
+  A multimap from keys to values. The values of a key are returned oldest
+  first.
+  '''
+  def __init__(self, max_age=None):
+    self.max_age = max_age
+    self.values = dict() # key -> deque([(timestamp, value)])
+    self.by_age = deque() # (timestamp, key), oldest first
+    self.size = 0
+
+  def __len__(self):
+    return self.size
+
+  def __contains__(self, key):
+    return key in self.values
+
+  def add(self, key, value, timestamp=None):
+    if timestamp is None:
+      timestamp = time.time()
+    self.values.setdefault(key, deque()).append((timestamp, value))
+    if self.max_age is not None:
+      self.by_age.append((timestamp, key))
+    self.size += 1
+
+  def pop(self, key):
+    '''
+    Removes and returns the oldest value of key, or None if there is none.
+    '''
+    entries = self.values.get(key)
+    if entries is None:
+      return None
+    _, value = entries.popleft()
+    if not entries:
+      del self.values[key]
+    self.size -= 1
+    return value
+
+  def pop_all(self, key):
+    '''
+    Removes and returns all values of key, oldest first.
+    '''
+    entries = self.values.pop(key, ())
+    self.size -= len(entries)
+    return [value for _, value in entries]
+
+  def expire(self, now=None):
+    '''
+    Removes the values older than max_age seconds and returns them as
+    (key, value) tuples.
+    '''
+    if self.max_age is None:
+      return []
+    if now is None:
+      now = time.time()
+    deadline = now - self.max_age
+    expired = []
+    while self.by_age and self.by_age[0][0] < deadline:
+      _, key = self.by_age.popleft()
+      # values that were popped before leave their entry in by_age behind
+      entries = self.values.get(key)
+      while entries and entries[0][0] < deadline:
+        expired.append((key, entries.popleft()[1]))
+      if entries is not None and not entries:
+        del self.values[key]
+    self.size -= len(expired)
+    return expired
+
+
+class BoundedDict(OrderedDict):
+  '''
+  A dict that forgets its oldest items when it has more than max_size items.
+  '''
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.evicted = 0
+    OrderedDict.__init__(self)
+
+  def __setitem__(self, key, value):
+    OrderedDict.__setitem__(self, key, value)
+    if len(self) > self.max_size:
+      self.popitem(last=False)
+      self.evicted += 1
@@ -0,0 +1,177 @@
+"""
+Online race detection while the happens-before trace is recorded
+"""
+
+from collections import defaultdict
+from collections import deque
+import logging
+
+from hb_graph import HappensBeforeGraph
+from hb_race_detector import Race
+from hb_sts_events import TraceSwitchFlowTableRead
+from hb_sts_events import TraceSwitchFlowTableWrite
+
+
+class OnlineRaceDetector(object):
+  """
+  Builds the HB graph from trace lines as they are written and reports
+  harmful races without waiting for the offline analysis.
+
+  The races of an event are only checked after `window` more events have been
+  added, as edges to an event may still show up when later events (e.g.
+  asynchronously logged controller events) are added. Operations whose time
+  is more than `delta` seconds before the most recent operation can no longer
+  race under the time filter and are dropped, together with the graph events
+  that were added before any remaining operation. Events are pruned in the
+  order they were added, not by eid: controller events get their eids when
+  they happen, but are only added once they are matched, possibly long after
+  later switch events. Events that still wait for a pid_in/mid_in edge are
+  kept until it is added. This keeps memory bounded by the number of events
+  within `delta` seconds, plus the events whose in-edge never shows up.
+
+  Unlike the offline analysis, filter_rw and the data dependency edges are
+  not supported, and races are time filtered with `delta` for both r/w and
+  w/w races.
+  """
+
+  def __init__(self, window=1000, delta=5, halt_on_race=False,
+               on_race=None, **graph_kwargs):
+    """
+    on_race is called with each harmful race when it is found.
+    graph_kwargs are passed on to the HappensBeforeGraph.
+    """
+    self.log = logging.getLogger("hb_online")
+    self.graph = HappensBeforeGraph(disable_path_cache=True, **graph_kwargs)
+    self.race_detector = self.graph.race_detector
+    self.window = window
+    self.delta = delta
+    self.halt_on_race = halt_on_race
+    self.on_race = on_race
+
+    self.harmful_races = []
+    self.total_races = 0
+    self.total_commute = 0
+    self.total_time_filtered = 0
+
+    self._added = 0 # number of events added to the graph
+    self._unchecked = deque() # (self._added when added, event), not yet checked for races
+    self._added_at = {} # eid -> self._added when added, for the events in the graph
+    self._ops_by_dpid = defaultdict(list) # dpid -> [(event, op, bucket key)] of checked events
+    self._latest_t = None # time of the most recent checked operation
+
+  @property
+  def halt(self):
+    """True if the fuzzer should stop because a harmful race was found."""
+    return self.halt_on_race and len(self.harmful_races) > 0
+
+  def add_line(self, line):
+    self.add_event(self.graph.unpack_line(line))
+
+  def add_record(self, record):
+    """Same as add_line, for a record of a binary trace."""
+    self.add_event(self.graph.unpack_record(record))
+
+  def add_event(self, event):
+    if event is None:
+      return
+    self.graph.add_event(event)
+    if event.eid not in self.graph.events_by_id:
+      # filtered by the graph, e.g. ignored ethertypes
+      return
+    self._added += 1
+    self._added_at[event.eid] = self._added
+    if self._read_write_ops(event):
+      self._unchecked.append((self._added, event))
+    while self._unchecked and self._added - self._unchecked[0][0] >= self.window:
+      self._check_event(self._unchecked.popleft()[1])
+    if self._added % self.window == 0:
+      self._prune()
+
+  def flush(self):
+    """Check all remaining events, e.g. at the end of the trace."""
+    while self._unchecked:
+      self._check_event(self._unchecked.popleft()[1])
+    self._prune()
+
+  def _read_write_ops(self, event):
+    return [op for op in getattr(event, 'operations', [])
+            if type(op) in [TraceSwitchFlowTableRead, TraceSwitchFlowTableWrite]]
+
+  def _bucket_key(self, event, op):
+    if type(op) == TraceSwitchFlowTableWrite:
+      return self.race_detector._write_bucket_key(event, op)
+    return self.race_detector._read_bucket_key(event, op)
+
+  def _check_event(self, event):
+    """Check the operations of event against all retained earlier operations."""
+    if event.eid not in self.graph.events_by_id:
+      return
+    for op in self._read_write_ops(event):
+      key = self._bucket_key(event, op)
+      for other_event, other_op, other_key in self._ops_by_dpid[event.dpid]:
+        self._check_pair(event, op, key, other_event, other_op, other_key)
+    for op in self._read_write_ops(event):
+      self._ops_by_dpid[event.dpid].append((event, op, self._bucket_key(event, op)))
+      if self._latest_t is None or op.t > self._latest_t:
+        self._latest_t = op.t
+
+  def _check_pair(self, event, op, key, other_event, other_op, other_key):
+    if event == other_event:
+      return
+    if type(op) == TraceSwitchFlowTableRead:
+      if type(other_op) == TraceSwitchFlowTableRead:
+        return
+      race = Race('r/w', event, op, other_event, other_op)
+    elif type(other_op) == TraceSwitchFlowTableRead:
+      race = Race('r/w', other_event, other_op, event, op)
+      key, other_key = other_key, key
+    else:
+      race = Race('w/w', other_event, other_op, event, op)
+    if self.graph.has_path(event.eid, other_event.eid, bidirectional=True):
+      return
+    self.total_races += 1
+    if abs(op.t - other_op.t) > self.delta:
+      self.total_time_filtered += 1
+      return
+    checker = self.race_detector.commutativity_checker
+    if race.rtype == 'r/w':
+      commutes = (not self.race_detector._buckets_overlap(key, other_key) or
+                  checker.check_commutativity_rw(*race[1:]))
+    else:
+      commutes = (not self.race_detector._buckets_overlap(key, other_key) or
+                  checker.check_commutativity_ww(*race[1:]))
+    if commutes:
+      self.total_commute += 1
+      return
+    self.harmful_races.append(race)
+    self.log.warn("Harmful %s race between events %d and %d on switch %s" %
+                  (race.rtype, race.i_event.eid, race.k_event.eid, event.dpid))
+    if self.on_race is not None:
+      self.on_race(race)
+
+  def _prune(self):
+    """Drop operations that can no longer race and the events added before them."""
+    if self._latest_t is not None:
+      cutoff = self._latest_t - self.delta
+      for dpid in self._ops_by_dpid.keys():
+        ops = [x for x in self._ops_by_dpid[dpid] if x[1].t >= cutoff]
+        if ops:
+          self._ops_by_dpid[dpid] = ops
+        else:
+          del self._ops_by_dpid[dpid]
+    # The `window` most recent events are kept as well, new events may still
+    # link to them
+    retained = [self._added - self.window + 1]
+    retained.extend(added for added, _ in self._unchecked)
+    for ops in self._ops_by_dpid.itervalues():
+      retained.extend(self._added_at[event.eid] for event, _, _ in ops)
+    horizon = min(retained)
+    pending = set()
+    for table in [self.graph.events_pending_pid_in, self.graph.events_pending_mid_in]:
+      for events in table.itervalues():
+        pending.update(events)
+    removed = [eid for eid, added in self._added_at.iteritems()
+               if added < horizon and eid not in pending]
+    self.graph.remove_events(removed)
+    for eid in removed:
+      del self._added_at[eid]
@@ -1,6 +1,8 @@
+from collections import defaultdict
 from collections import namedtuple
 import itertools
-import networkx as nx
+
+from pox.openflow.libopenflow_01 import ofp_match
 
 from hb_utils import op_to_str
 from hb_utils import nCr
@@ -50,6 +52,29 @@ predecessor_types = {
 # Define race type
 Race = namedtuple('Race', ['rtype', 'i_event', 'i_op', 'k_event', 'k_op'])
 
+# Classification of a race, see RaceDetector._race_status
+RACE_COMMUTE = 0
+RACE_HARMFUL = 1
+RACE_TIME_FILTERED = 2 # harmful, but the operations are too far apart in time
+RACE_COVERED = 3 # harmful, but ordered by a data dependency
+
+# Match fields that are either fully wildcarded or exact in OpenFlow 1.0.
+# Two matches that have different exact values for any of these fields can
+# never overlap, so the operations always commute.
+BUCKET_MATCH_FIELDS = ('in_port', 'dl_type', 'dl_src', 'dl_dst')
+
+
+def match_bucket_key(match):
+  """Bucket key of a match, None stands for a wildcarded field."""
+  return tuple(getattr(match, f) for f in BUCKET_MATCH_FIELDS)
+
+
+def bucket_keys_overlap(key1, key2):
+  for v1, v2 in itertools.izip(key1, key2):
+    if v1 is not None and v2 is not None and v1 != v2:
+      return False
+  return True
+
 
 class RaceDetector(object):
 
@@ -60,19 +85,17 @@ class RaceDetector(object):
 
     self.read_operations = []
     self.write_operations = []
-    self.all_races = []
-    self.found_races_harmful = []
-    self._races_harmful = []
-    self.filtered_by_time = set()
-    self.races_commute = []
+    self._clear_races()
     self.racing_events = set()
     self.racing_events_harmful = set()
     self.total_filtered = 0
-    self.covered_races = []
 
     self.commutativity_checker = CommutativityChecker()
+    # (bucket key, bucket key) -> can the matches overlap
+    self._bucket_overlap_cache = dict()
 
     self.filter_rw = filter_rw # Filter events with no common ancestor if True.
+    self._clear_ancestor_roots()
     self.ww_delta = ww_delta
     self.rw_delta = rw_delta
     self.add_hb_time = add_hb_time
@@ -80,21 +103,58 @@ class RaceDetector(object):
     self._time_edges_counter = 0
 
 
+  def _clear_races(self):
+    """
+    Every race is stored once in all_races, its index is the race id. The
+    classification of the races is kept in _race_status, one byte per race,
+    and the lists of races of some classification are built on demand.
+    """
+    self.all_races = []
+    self._race_status = bytearray()
+    self._status_counts = [0] * 4
+    # non-commuting race -> race id
+    self._harmful_race_ids = dict()
+    # ids of the covered races, in the order they were covered
+    self._covered_race_ids = []
+    # statuses -> list of races, cleared when a status changes
+    self._races_by_status = dict()
+
+  def _set_race_status(self, rid, status):
+    self._status_counts[self._race_status[rid]] -= 1
+    self._status_counts[status] += 1
+    self._race_status[rid] = status
+    self._races_by_status.clear()
+
+  def _races_with_status(self, *statuses):
+    """Races with one of the given statuses, in the order they were found."""
+    if statuses not in self._races_by_status:
+      races = [race for race, status in itertools.izip(self.all_races, self._race_status)
+               if status in statuses]
+      self._races_by_status[statuses] = races
+    return self._races_by_status[statuses]
+
+  def mark_covered(self, race):
+    """Classify a harmful race as covered, see HappensBeforeGraph.find_covered_races."""
+    rid = self._harmful_race_ids[race]
+    assert self._race_status[rid] == RACE_HARMFUL
+    self._set_race_status(rid, RACE_COVERED)
+    self._covered_race_ids.append(rid)
+
   @property
   def total_operations(self):
     return len(self.write_operations) + len(self.read_operations)
 
   @property
   def total_harmful(self):
-    return len(self.races_harmful)
+    return self._status_counts[RACE_HARMFUL]
 
   @property
   def total_commute(self):
-    return len(self.races_commute)
+    return self._status_counts[RACE_COMMUTE]
 
   @property
   def total_covered(self):
-    return len(self.covered_races)
+    return self._status_counts[RACE_COVERED]
 
   @property
   def total_races(self):
@@ -103,15 +163,32 @@ class RaceDetector(object):
 
   @property
   def total_time_filtered_races(self):
-    return len(self.filtered_by_time)
+    return self._status_counts[RACE_TIME_FILTERED]
+
+  @property
+  def races_commute(self):
+    return self._races_with_status(RACE_COMMUTE)
+
+  @property
+  def found_races_harmful(self):
+    """All races that do not commute, including time filtered and covered ones."""
+    return self._races_with_status(RACE_HARMFUL, RACE_TIME_FILTERED, RACE_COVERED)
+
+  @property
+  def filtered_by_time(self):
+    return self._races_with_status(RACE_TIME_FILTERED)
 
   @property
   def races_harmful(self):
-    return self._races_harmful
+    return self._races_with_status(RACE_HARMFUL)
+
+  @property
+  def covered_races(self):
+    return [self.all_races[rid] for rid in self._covered_race_ids]
 
   @property
   def races_harmful_with_covered(self):
-    return list(set(self.races_harmful).union(set(self.covered_races)))
+    return self._races_with_status(RACE_HARMFUL, RACE_COVERED)
   
   @property
   def time_edges_counter(self):
@@ -128,12 +205,48 @@ class RaceDetector(object):
     """
     Returns true the two events have a common ancestor or they're ancestors of
     each other.
+
+    Two events have a common ancestor iff some root of the graph (an event
+    without predecessors) is an ancestor of both, so this compares the
+    memoized root sets of the events. The memo is rebuilt by
+    detect_rw_races, call _clear_ancestor_roots after adding edges otherwise.
+    """
+    return (self._ancestor_roots(event.eid) & self._ancestor_roots(other.eid)) != 0
+
+  def _clear_ancestor_roots(self):
+    self._roots_by_eid = dict() # eid -> bitset of the roots that reach eid
+    self._root_count = 0 # number of roots with a bit
+
+  def _ancestor_roots(self, eid):
+    """
+    The roots that are ancestors of eid, or eid itself if it is a root, as a
+    bitset (an int with one bit per root). Computed once per event from the
+    root sets of its predecessors.
     """
-    event_ancs = nx.ancestors(self.graph.g, event.eid)
-    other_ancs = nx.ancestors(self.graph.g, other.eid)
-    event_ancs.add(event.eid)
-    other_ancs.add(other.eid)
-    return not event_ancs.isdisjoint(other_ancs)
+    roots = self._roots_by_eid
+    if eid in roots:
+      return roots[eid]
+    pred = self.graph.g.pred
+    stack = [eid]
+    while stack:
+      node = stack[-1]
+      if node in roots:
+        stack.pop()
+        continue
+      missing = [p for p in pred[node] if p not in roots]
+      if missing:
+        stack.extend(missing)
+        continue
+      stack.pop()
+      if pred[node]:
+        bits = 0
+        for p in pred[node]:
+          bits |= roots[p]
+      else:
+        bits = 1 << self._root_count
+        self._root_count += 1
+      roots[node] = bits
+    return roots[eid]
 
   def read_ops(self):
     """
@@ -149,11 +262,11 @@ class RaceDetector(object):
       if hasattr(i, 'operations'):
         for k in i.operations:
           if k.type == 'TraceSwitchFlowTableWrite':
-            assert hasattr(k, 'flow_table')
+            assert hasattr(k, 'raw_flow_table')
             assert hasattr(k, 'flow_mod')
             self.write_operations.append((i, k))
           elif k.type == 'TraceSwitchFlowTableRead':
-            assert hasattr(k, 'flow_table')
+            assert hasattr(k, 'raw_flow_table')
             assert hasattr(k, 'flow_mod')
             assert hasattr(i, 'packet')
             assert hasattr(i, 'in_port')
@@ -161,77 +274,130 @@ class RaceDetector(object):
           # TODO(jm): Do we need to consider TraceSwitchFlowTableEntryExpiry here as well??? Probably yes?
           #           However, for expiry, the flow_table is the table *after* the operation, so some changes are needed.
 
+  def _operations_by_dpid(self, operations, key_func):
+    """
+    Partition (event, op) tuples by dpid, keeping the trace order.
+    Returns dpid -> [(event, op, bucket key)].
+    """
+    by_dpid = defaultdict(list)
+    for event, op in operations:
+      by_dpid[event.dpid].append((event, op, key_func(event, op)))
+    return by_dpid
+
+  def _write_bucket_key(self, event, op):
+    return match_bucket_key(op.flow_mod.match)
+
+  def _read_bucket_key(self, event, op):
+    return match_bucket_key(ofp_match.from_packet(event.packet, event.in_port))
+
+  def _buckets_overlap(self, key1, key2):
+    if (key1, key2) not in self._bucket_overlap_cache:
+      self._bucket_overlap_cache[(key1, key2)] = bucket_keys_overlap(key1, key2)
+    return self._bucket_overlap_cache[(key1, key2)]
+
+  def _add_race(self, race, commutes):
+    rid = len(self.all_races)
+    self.all_races.append(race)
+    status = RACE_COMMUTE if commutes else RACE_HARMFUL
+    self._race_status.append(status)
+    self._status_counts[status] += 1
+    if not commutes:
+      self._harmful_race_ids[race] = rid
+    self._races_by_status.clear()
+    self.racing_events.add(race.i_event)
+    self.racing_events.add(race.k_event)
+
   def detect_ww_races(self, event=None, verbose=False):
+    """
+    Only pairs of writes on the same switch can race. Pairs whose matches
+    fall into non-overlapping buckets are still races, but they always commute
+    and are not passed to the commutativity checker. Every pair on a switch is
+    still checked with is_ordered, so this stays quadratic per switch.
+    """
     count = 0
     percentage_done = 0
 
-    ww_combination_count = nCr(len(self.write_operations),2)
+    writes_by_dpid = self._operations_by_dpid(self.write_operations,
+                                              self._write_bucket_key)
+    ww_combination_count = sum(nCr(len(writes), 2)
+                               for writes in writes_by_dpid.itervalues())
 
     if verbose:
       print "Processing {} w/w combinations".format(ww_combination_count)
     # write <-> write
-    for (i_event, i_op), (k_event, k_op) in itertools.combinations(self.write_operations, 2):
-      if verbose:
-        count += 1
-        percentage = int(((count / float(ww_combination_count)) * 100)) // 10 * 10
-        if percentage > percentage_done:
-          percentage_done = percentage
-          print "{}% ".format(percentage)
-      if (i_event != k_event and
-          (event is None or event == i_event or event == k_event) and
-          i_event.dpid == k_event.dpid and
-          not self.is_ordered(i_event, k_event)):
-        race = Race('w/w', i_event, i_op, k_event, k_op)
-        self.all_races.append(race)
-        if self.commutativity_checker.check_commutativity_ww(i_event, i_op,
-                                                             k_event, k_op):
-          self.races_commute.append(race)
-        else:
-          self.found_races_harmful.append(race)
-        self.racing_events.add(i_event)
-        self.racing_events.add(k_event)
-
-  def detect_rw_races(self, event=None, verbose=False):
-    percentage_done = 0
-    count = 0
-    rw_combination_count = len(self.read_operations)*len(self.write_operations)
-
-    if verbose:
-      print "Processing {} r/w combinations".format(rw_combination_count)
-    # read <-> write
-    for i_event, i_op in self.read_operations:
-      for k_event, k_op in self.write_operations:
+    for writes in writes_by_dpid.itervalues():
+      for (i_event, i_op, i_key), (k_event, k_op, k_key) in itertools.combinations(writes, 2):
         if verbose:
           count += 1
-          percentage = int(((count / float(rw_combination_count)) * 100)) // 10 * 10
+          percentage = int(((count / float(ww_combination_count)) * 100)) // 10 * 10
           if percentage > percentage_done:
             percentage_done = percentage
             print "{}% ".format(percentage)
         if (i_event != k_event and
             (event is None or event == i_event or event == k_event) and
-            i_event.dpid == k_event.dpid and
             not self.is_ordered(i_event, k_event)):
+          race = Race('w/w', i_event, i_op, k_event, k_op)
+          commutes = (not self._buckets_overlap(i_key, k_key) or
+                      self.commutativity_checker.check_commutativity_ww(
+                        i_event, i_op, k_event, k_op))
+          self._add_race(race, commutes)
+
+  def detect_rw_races(self, event=None, verbose=False):
+    """
+    Only pairs of a read and a write on the same switch can race. A write
+    can only affect a read if its match contains the packet that was read,
+    all other pairs commute and are not passed to the commutativity checker.
+    Every pair on a switch is still checked with is_ordered.
+    """
+    percentage_done = 0
+    count = 0
+
+    reads_by_dpid = self._operations_by_dpid(self.read_operations,
+                                             self._read_bucket_key)
+    writes_by_dpid = self._operations_by_dpid(self.write_operations,
+                                              self._write_bucket_key)
+    rw_combination_count = sum(len(reads) * len(writes_by_dpid.get(dpid, []))
+                               for dpid, reads in reads_by_dpid.iteritems())
 
-          if self.filter_rw and not self.has_common_ancestor(i_event, k_event):
-            self.total_filtered += 1
-          else:
-            race = Race('r/w',i_event, i_op, k_event, k_op)
-            self.all_races.append(race)
-            if self.commutativity_checker.check_commutativity_rw(i_event, i_op,
-                                                                 k_event, k_op):
-              self.races_commute.append(race)
+    if verbose:
+      print "Processing {} r/w combinations".format(rw_combination_count)
+    if self.filter_rw:
+      self._clear_ancestor_roots()
+    # read <-> write
+    for dpid, reads in reads_by_dpid.iteritems():
+      writes = writes_by_dpid.get(dpid, [])
+      for i_event, i_op, i_key in reads:
+        for k_event, k_op, k_key in writes:
+          if verbose:
+            count += 1
+            percentage = int(((count / float(rw_combination_count)) * 100)) // 10 * 10
+            if percentage > percentage_done:
+              percentage_done = percentage
+              print "{}% ".format(percentage)
+          if (i_event != k_event and
+              (event is None or event == i_event or event == k_event) and
+              not self.is_ordered(i_event, k_event)):
+
+            if self.filter_rw and not self.has_common_ancestor(i_event, k_event):
+              self.total_filtered += 1
             else:
-              self.found_races_harmful.append(race)
-            self.racing_events.add(i_event)
-            self.racing_events.add(k_event)
+              race = Race('r/w',i_event, i_op, k_event, k_op)
+              commutes = (not self._buckets_overlap(i_key, k_key) or
+                          self.commutativity_checker.check_commutativity_rw(
+                            i_event, i_op, k_event, k_op))
+              self._add_race(race, commutes)
 
   def apply_time_filter(self, delta):
     self._time_edges_counter = 0
-    self.filtered_by_time = set()
-    for race in self.found_races_harmful:
+    for rid, race in enumerate(self.all_races):
+      if self._race_status[rid] not in (RACE_HARMFUL, RACE_TIME_FILTERED):
+        continue
       d = abs(race.i_op.t - race.k_op.t)
-      if d > delta:
-        self.filtered_by_time.add(race)
+      if d <= delta:
+        if self._race_status[rid] == RACE_TIME_FILTERED:
+          self._set_race_status(rid, RACE_HARMFUL)
+      else:
+        self._set_race_status(rid, RACE_TIME_FILTERED)
         first = race.i_event if race.i_op.t < race.k_op.t else race.k_event
         second = race.k_event if first == race.i_event else race.i_event
         assert first != second
@@ -251,8 +417,7 @@ class RaceDetector(object):
       print "Total write operations: {}".format(len(self.write_operations))
       print "Total read operations: {}".format(len(self.read_operations))
 
-    self.found_races_harmful = []
-    self.races_commute_count = []
+    self._clear_races()
     self.racing_events = set()
     self.racing_events_harmful = set()
     self.total_filtered = 0
@@ -264,10 +429,6 @@ class RaceDetector(object):
     if self.add_hb_time:
       self.apply_time_filter(self.rw_delta)
 
-    # Calculate true harmful
-    # TODO(jm): This line of code eats memory like crazy, and takes forever! Change this!
-    self._races_harmful = [race for race in self.found_races_harmful if race not in self.filtered_by_time]
-
     self.racing_events_harmful = set()
     for race in self.races_harmful:
       self.racing_events_harmful.add(race.i_event)
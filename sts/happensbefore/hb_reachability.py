@@ -0,0 +1,109 @@
+"""
+Incremental reachability index for the happens-before graph
+"""
+
+from collections import defaultdict
+
+
+class ReachabilityIndex(object):
+  """
+  Answers "is there a path from src to dst" queries while edges are appended.
+
+  Nodes are decomposed into chains, i.e. sequences of nodes where each node
+  reaches the next one. A node is appended to the chain of its first
+  predecessor if that predecessor is the current tail of its chain, otherwise
+  it starts a new chain. For every node we keep a sparse label
+  chain -> lowest position on that chain that is reachable from the node.
+
+  A query is a single dict lookup. Adding an edge src -> dst pushes the label
+  of dst up to the ancestors of src, and stops at ancestors that already
+  reach everything dst reaches. For the mostly tree-shaped HB graphs this
+  touches only a handful of nodes per edge, and memory grows with the number
+  of nodes times the (small) number of chains reachable from each node.
+  """
+
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self._pred = defaultdict(list) # node -> [predecessor nodes]
+    self._succ = defaultdict(set) # node -> set(successor nodes)
+    self._chain = dict() # node -> (chain id, position on chain)
+    self._chain_len = [] # chain id -> number of nodes on the chain
+    self._reach = dict() # node -> {chain id -> lowest reachable position}
+
+  def __contains__(self, node):
+    return node in self._chain
+
+  def __len__(self):
+    return len(self._chain)
+
+  def add_node(self, node):
+    if node in self._chain:
+      return
+    self._chain[node] = (len(self._chain_len), 0)
+    self._chain_len.append(1)
+    self._reach[node] = dict()
+
+  def _try_append_to_chain(self, src, dst):
+    """
+    Move dst to the end of the chain of src if dst is a fresh node.
+
+    Only nodes without predecessors may be moved, as no label can refer to
+    their old chain yet.
+    """
+    if self._pred[dst]:
+      return
+    chain, pos = self._chain[src]
+    dst_chain, dst_pos = self._chain[dst]
+    if pos != self._chain_len[chain] - 1 or self._chain_len[dst_chain] != 1:
+      return
+    self._chain_len[dst_chain] = 0
+    self._chain[dst] = (chain, pos + 1)
+    self._chain_len[chain] += 1
+
+  def add_edge(self, src, dst, extend_chains=True):
+    """
+    Returns the nodes whose labels changed, i.e. src and the ancestors of src
+    that did not reach all of dst before. If extend_chains is False, dst is
+    never appended to the chain of src, and the returned nodes are exactly the
+    nodes that reach more nodes than before (otherwise the ancestors of src
+    also reach dst through the chain, without a change of their labels).
+    """
+    self.add_node(src)
+    self.add_node(dst)
+    if dst in self._succ[src]:
+      return []
+    if extend_chains:
+      self._try_append_to_chain(src, dst)
+    self._succ[src].add(dst)
+    self._pred[dst].append(src)
+
+    # everything reachable from dst (including dst) is now reachable from src
+    new_labels = dict(self._reach[dst])
+    chain, pos = self._chain[dst]
+    if new_labels.get(chain, pos) >= pos:
+      new_labels[chain] = pos
+
+    changed_nodes = []
+    stack = [src]
+    while stack:
+      node = stack.pop()
+      labels = self._reach[node]
+      changed = False
+      for c, p in new_labels.iteritems():
+        if labels.get(c, p + 1) > p:
+          labels[c] = p
+          changed = True
+      # ancestors of an unchanged node already reach all of new_labels
+      if changed:
+        changed_nodes.append(node)
+        stack.extend(self._pred[node])
+    return changed_nodes
+
+  def has_path(self, src, dst):
+    if src == dst:
+      return True
+    chain, pos = self._chain[dst]
+    lowest = self._reach[src].get(chain)
+    return lowest is not None and lowest <= pos
@@ -3,10 +3,13 @@ Events instrumenting STS internals.
 """
 import time
 
+from hb_flow_table_delta import map_flow_table_rows
 from hb_json_event import JsonEvent
 from hb_json_event import AttributeCombiningMetaclass
+from hb_utils import base64_decode
 from hb_utils import base64_decode_openflow
 from hb_utils import base64_encode
+from hb_utils import base64_encode_raw
 from hb_utils import base64_encode_flow
 from hb_utils import base64_encode_flow_list
 from hb_utils import base64_encode_flow_table
@@ -14,9 +17,30 @@ from hb_utils import decode_flow_table
 from hb_utils import decode_flow_mod
 from hb_utils import decode_packet
 from hb_utils import get_port_no
+from hb_utils import intern_value
 from hb_utils import ofp_type_to_str
 from hb_utils import ofp_flow_removed_reason_to_str
+from hb_utils import packed_bytes
 from hb_utils import str_to_ofp_flow_removed_reason
+from hb_utils import unpack_flow_mod
+from hb_utils import unpack_openflow
+from hb_utils import unpack_packet
+
+
+def encode_flow_table(flow_table):
+  """
+  Delta encoded tables (dicts) and tables read from a trace (tuples of rows)
+  are written as they are, SwitchFlowTables as their base64 rows.
+  """
+  if flow_table is None or isinstance(flow_table, dict):
+    return flow_table
+  if isinstance(flow_table, tuple):
+    return list(flow_table)
+  return base64_encode_flow_table(flow_table)
+
+
+def decode_flow_table_rows(encoded):
+  return encoded if encoded is None or isinstance(encoded, dict) else tuple(encoded)
 
 
 class TraceSwitchEvent(JsonEvent):
@@ -32,7 +56,8 @@ class TraceSwitchEvent(JsonEvent):
                     ('out_port', get_port_no),
                     'buffer_id',
                     ('msg', base64_encode),
-                    ('flow_table', lambda x: x if x is None else base64_encode_flow_table(x)),
+                    # dicts are delta encoded tables, see hb_flow_table_delta
+                    ('flow_table', encode_flow_table),
                     ('flow_mod', base64_encode),
                     ('removed', base64_encode),
                     ('expired_flows', base64_encode_flow_list),
@@ -47,15 +72,18 @@ class TraceSwitchEvent(JsonEvent):
 
   _from_json_attrs = {
     'eid': lambda x: x,
-    'dpid': lambda x: x,
-    'controller_id': lambda x: x, # socket.getpeername(), NOT the STS cid
-    'hid': lambda x: x,
+    # Values that repeat across events are shared, see intern_value
+    'dpid': intern_value,
+    'controller_id': intern_value, # socket.getpeername(), NOT the STS cid
+    'hid': intern_value,
     'packet': decode_packet,
     'in_port': lambda x: x,
     'out_port': lambda x: x,
     'buffer_id': lambda x: x,
     'msg': base64_decode_openflow,
-    'flow_table': lambda x: None if x is None else decode_flow_table(x),
+    # delta encoded tables are rebuilt by hb_flow_table_delta.FlowTableDeltaDecoder,
+    # full tables are kept as their rows and decoded on access (see flow_table)
+    'flow_table': decode_flow_table_rows,
     'flow_mod': decode_flow_mod,
     'removed': decode_flow_mod,
     'expired_flows': lambda flows: [decode_flow_mod(x) for x in flows],
@@ -68,10 +96,53 @@ class TraceSwitchEvent(JsonEvent):
     'reason': str_to_ofp_flow_removed_reason,
   }
 
+  # Packed messages, flow mods and flow table rows are kept as bytes in
+  # binary traces, see hb_trace_format. Rows are base64 again once read, as
+  # tables are kept as base64 rows.
+  _binary_attrs = {
+    'flow_table': (lambda x: map_flow_table_rows(encode_flow_table(x), base64_decode),
+                   lambda x: decode_flow_table_rows(map_flow_table_rows(x, base64_encode_raw))),
+    'packet': (packed_bytes, unpack_packet),
+    'msg': (packed_bytes, unpack_openflow),
+    'flow_mod': (packed_bytes, unpack_flow_mod),
+    'removed': (packed_bytes, unpack_flow_mod),
+    'matched_flow': (packed_bytes, unpack_flow_mod),
+    'touched_flow': (packed_bytes, unpack_flow_mod),
+    't': (lambda fp: fp, float),
+  }
+
   def __init__(self, t, eid=None):
     super(TraceSwitchEvent, self).__init__(eid=eid)
     self.t = t or time.time()
 
+  @property
+  def raw_flow_table(self):
+    """
+    The flow table as stored: a SwitchFlowTable, a tuple of base64 rows, a
+    delta encoded dict or None. Raises AttributeError if there is none.
+    """
+    return self._flow_table
+
+  @property
+  def flow_table(self):
+    """
+    Flow tables read from a trace are kept as a tuple of base64 rows and
+    decoded on every access, so that a loaded trace does not hold a decoded
+    SwitchFlowTable per operation. Changes to a decoded table are not kept.
+    """
+    flow_table = self.raw_flow_table
+    if isinstance(flow_table, tuple):
+      return decode_flow_table(flow_table)
+    return flow_table
+
+  @flow_table.setter
+  def flow_table(self, flow_table):
+    self._flow_table = flow_table
+
+  @flow_table.deleter
+  def flow_table(self):
+    del self._flow_table
+
 
 class TraceAsyncSwitchFlowExpiryBegin(TraceSwitchEvent):
   def __init__(self, dpid, t=None, eid=None):
@@ -265,13 +336,18 @@ class TraceHostEvent(JsonEvent):
 
   _from_json_attrs = {
     'eid': lambda x: x,
-    'hid': lambda x: x,
+    'hid': intern_value,
     'packet': decode_packet,
     'in_port': lambda x: x,
     'out_port': lambda x: x,
     't': lambda x: float(x),
   }
 
+  _binary_attrs = {
+    'packet': (packed_bytes, unpack_packet),
+    't': (lambda fp: fp, float),
+  }
+
   def __init__(self, t=None, eid=None):
     super(TraceHostEvent, self).__init__(eid=eid)
     self.t = t
@@ -0,0 +1,74 @@
+"""
+Binary encoding of happens-before traces.
+
+A JSON trace has one event per line, and the operations of an event are
+JSON strings nested in it, with packed OpenFlow messages, flow mods and
+packets as base64. A binary trace starts with BINARY_TRACE_MAGIC, followed
+by one length prefixed record per event:
+
+  <length of the record, 4 bytes little endian><record>
+
+A record is the marshalled JsonEvent.to_dict(binary=True): operations are
+nested dicts, packed messages, packets and flow table rows are bytes and
+times are floats (see the _binary_attrs of the event classes).
+
+marshal is the fastest serializer for plain values in the standard library.
+Its format depends on the Python version, so binary traces should be read
+with the same Python version they were written with.
+"""
+
+import marshal
+import struct
+
+from hb_json_event import JsonEvent
+
+
+TRACE_FORMATS = ('json', 'binary')
+
+BINARY_TRACE_MAGIC = 'HBTRACE-BIN-1\n'
+_RECORD_LENGTH = struct.Struct('<I')
+
+
+def encode_binary_event(event):
+  """The record of event, without its length prefix."""
+  return marshal.dumps(event.to_dict(binary=True))
+
+
+def decode_binary_record(record):
+  return JsonEvent.from_dict(marshal.loads(record), binary=True)
+
+
+def write_binary_header(f):
+  f.write(BINARY_TRACE_MAGIC)
+
+
+def write_binary_record(f, record):
+  f.write(_RECORD_LENGTH.pack(len(record)) + record)
+
+
+def is_binary_trace(f):
+  """
+  Returns True and skips the header if f is a binary trace, otherwise
+  returns False and rewinds f.
+  """
+  if f.read(len(BINARY_TRACE_MAGIC)) == BINARY_TRACE_MAGIC:
+    return True
+  f.seek(0)
+  return False
+
+
+def read_binary_records(f):
+  """
+  Yields the records of binary trace f, after its header. A truncated last
+  record, e.g. of a trace that is still written, is skipped.
+  """
+  while True:
+    prefix = f.read(_RECORD_LENGTH.size)
+    if len(prefix) < _RECORD_LENGTH.size:
+      break
+    length, = _RECORD_LENGTH.unpack(prefix)
+    record = f.read(length)
+    if len(record) < length:
+      print "Warning: skipping truncated record at the end of the trace"
+      break
+    yield record
@@ -0,0 +1,119 @@
+"""
+Asynchronous writing of happens-before traces.
+
+HappensBeforeLogger normally encodes every event and flushes the trace file
+while it holds its lock, i.e. while the switch or host that raised the event
+waits. With an AsyncTraceWriter, the logger only puts finished events into a
+queue. A writer thread encodes and writes them in batches and flushes the
+file every flush_interval seconds.
+
+Events are encoded after they were queued, so they (and the packets and
+messages they refer to) must not be changed after they were written to the
+trace. close() writes all queued events before it returns.
+"""
+
+import Queue
+import threading
+import time
+import traceback
+
+
+_CLOSE = object()
+
+
+class _Sync(object):
+  def __init__(self):
+    self.done = threading.Event()
+
+
+class AsyncTraceWriter(object):
+  def __init__(self, write_item, flush, flush_interval=1.0, max_queued=100000,
+               batch_size=1000):
+    '''
+    write_item(item) writes one queued item and flush() flushes the written
+    items, both are called in the writer thread only. If more than max_queued
+    items wait to be written, write() blocks until the writer catches up.
+    '''
+    assert flush_interval > 0, "flush_interval must be positive"
+    self.write_item = write_item
+    self.flush = flush
+    self.flush_interval = flush_interval
+    self.batch_size = batch_size
+    self.queue = Queue.Queue(max_queued)
+    self.error = None
+    self.closed = False
+    self.thread = threading.Thread(target=self._run, name="AsyncTraceWriter")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def write(self, item):
+    if self.closed:
+      raise Exception("Trace writer already closed")
+    if self.error is not None:
+      raise Exception("Trace writer failed: %s" % self.error)
+    self.queue.put(item)
+
+  def sync(self):
+    '''
+    Blocks until all items written so far are written and flushed.
+    '''
+    sync = _Sync()
+    self.queue.put(sync)
+    while not sync.done.wait(1.0):
+      if not self.thread.is_alive():
+        break
+
+  def close(self):
+    '''
+    Writes and flushes all queued items and stops the writer thread.
+    '''
+    if self.closed:
+      return
+    self.closed = True
+    self.queue.put(_CLOSE)
+    # join with a timeout, so that KeyboardInterrupt is not blocked
+    while self.thread.is_alive():
+      self.thread.join(1.0)
+
+  def _next_batch(self):
+    try:
+      batch = [self.queue.get(timeout=self.flush_interval)]
+    except Queue.Empty:
+      return []
+    try:
+      while len(batch) < self.batch_size:
+        batch.append(self.queue.get_nowait())
+    except Queue.Empty:
+      pass
+    return batch
+
+  def _run(self):
+    last_flush = time.time()
+    running = True
+    while running:
+      synced = []
+      for item in self._next_batch():
+        if item is _CLOSE:
+          running = False
+        elif isinstance(item, _Sync):
+          synced.append(item)
+        elif self.error is None:
+          # after an error, items are dropped so that write() does not block
+          try:
+            self.write_item(item)
+          except Exception as e:
+            self.error = e
+            traceback.print_exc()
+      if synced or not running or time.time() - last_flush >= self.flush_interval:
+        self._flush()
+        last_flush = time.time()
+      for sync in synced:
+        sync.done.set()
+
+  def _flush(self):
+    try:
+      self.flush()
+    except Exception as e:
+      if self.error is None:
+        self.error = e
+      traceback.print_exc()
@@ -3,6 +3,10 @@ Various utils functions, some are copied from STS.
 """
 import base64
 from functools import partial
+import hashlib
+import resource
+import struct
+import sys
 
 
 from pox.lib.addresses import EthAddr
@@ -69,12 +73,17 @@ def base64_encode_raw(packet):
   return base64.b64encode(packet).replace("\n", "")
 
 
+def packed_bytes(packet):
+  """The packed bytes of packet, packet itself if it is not packable."""
+  if hasattr(packet, "pack"):
+    return packet.pack()
+  return packet
+
+
 def base64_encode(packet):
   """Encode packet to base64 string"""
-  if hasattr(packet, "pack"):
-    packet = packet.pack()
   # base 64 occasionally adds extraneous newlines: bit.ly/aRTmNu
-  return base64_encode_raw(packet)
+  return base64_encode_raw(packed_bytes(packet))
 
 
 def base64_decode(data):
@@ -82,30 +91,61 @@ def base64_decode(data):
   return base64.b64decode(data)
 
 
+def unpack_openflow(bits):
+  """Decode openflow message from packed bytes to msg object"""
+  (msg, packet_length) = OFConnection.parse_of_packet(bits)
+  return msg
+
+
 def base64_decode_openflow(data):
   """Decode openflow message from base64 string to msg object"""
-  (msg, packet_length) = OFConnection.parse_of_packet(base64_decode(data))
-  return msg
+  return unpack_openflow(base64_decode(data))
 
 
-def decode_flow_mod(data):
-  """Decode flow mod from base64 string to ofp_flow_mod object."""
-  if data is None:
+def unpack_flow_mod(bits):
+  """Decode flow mod from packed bytes to ofp_flow_mod object."""
+  if bits is None:
     return None
-  bits = base64_decode(data)
   fm = ofp_flow_mod()
   fm.unpack(bits) # NOTE: unpack IS in-situ for ofp_flow_mod() type
   return fm
 
 
-def decode_packet(data):
-  """Decode a packet in base64 string to pox.lib.packet.ethernet object."""
-  bits = base64_decode(data)
+def decode_flow_mod(data):
+  """Decode flow mod from base64 string to ofp_flow_mod object."""
+  if data is None:
+    return None
+  return unpack_flow_mod(base64_decode(data))
+
+
+def unpack_packet(bits):
+  """Decode a packet from packed bytes to pox.lib.packet.ethernet object."""
+  if bits is None:
+    return None
   p = ethernet()
   p = p.unpack(bits) # NOTE: unpack IS NOT in-situ for ethernet() type
   return p
 
 
+def decode_packet(data):
+  """Decode a packet in base64 string to pox.lib.packet.ethernet object."""
+  return unpack_packet(base64_decode(data))
+
+
+_interned_values = dict() # (type, value) -> the shared instance of the value
+
+
+def intern_value(value):
+  """
+  The shared instance of a value that repeats across the events of a trace,
+  e.g. a dpid or a host id. Lists (e.g. controller ids) are interned as
+  tuples.
+  """
+  if isinstance(value, list):
+    value = tuple(intern_value(v) for v in value)
+  return _interned_values.setdefault((type(value), value), value)
+
+
 def decode_flow_table(data):
   """Decode a list of flow from base64 to SwitchFlowTable object."""
   table = SwitchFlowTable()
@@ -160,6 +200,20 @@ def compare_flow_table(table, other):
   return True
 
 
+def packed_flow_mod_digest(packed):
+  """
+  64 bit digest of a packed flow mod, ignoring its XID. The digest of a flow
+  table is the sum of the digests of its entries, which does not depend on
+  the order of the entries.
+  """
+  return struct.unpack('<Q', hashlib.md5(packed[:4] + '\0\0\0\0' + packed[8:]).digest()[:8])[0]
+
+
+def flow_entry_digest(entry):
+  """Digest of a flow table entry, see packed_flow_mod_digest."""
+  return packed_flow_mod_digest(entry.to_flow_mod().pack())
+
+
 def read_flow_table(table, packet, in_port):
   return table.entry_for_packet(packet, in_port)
 
@@ -182,6 +236,24 @@ def find_entries_in_flow_table(table, other_flow_mod):
   return found
 
 
+def peak_rss_mb():
+  """Peak resident set size of this process in MB."""
+  maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin':
+    return maxrss / (1024.0 * 1024.0) # bytes on OS X
+  return maxrss / 1024.0 # KB on Linux
+
+
+def rss_mb():
+  """Current resident set size of this process in MB, or the peak if unknown."""
+  try:
+    with open('/proc/self/statm') as f:
+      pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / (1024.0 * 1024.0)
+  except (IOError, IndexError, ValueError):
+    return peak_rss_mb()
+
+
 def nCr(n,r):
   """
   Implements multiplicative formula:
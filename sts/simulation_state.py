@@ -88,6 +88,7 @@ class SimulationConfig(object):
                ignore_interposition=False,
                hb_logger_class=None,
                hb_logger_params=None,
+               hb_logger_kwargs=None,
                apps=None):
     '''
     Constructor parameters:
@@ -109,6 +110,12 @@ class SimulationConfig(object):
                               Replayer and MCSFinder read this configuration
                               parameter, and remove all internal events from their
                               event dags if set to True.
+      hb_logger_class   => a happens-before logger class, e.g.
+                           sts.happensbefore.hb_logger.HappensBeforeLogger
+      hb_logger_params  => the results directory of the happens-before trace
+                           (defaults to the one of the simulation)
+      hb_logger_kwargs  => a dict of keyword arguments for the constructor of
+                           hb_logger_class, e.g. {'online_race_detection': {}}
     '''
     if controller_configs is None:
       controller_configs = []
@@ -138,6 +145,9 @@ class SimulationConfig(object):
       self.interpose_on_controllers = False
     self._hb_logger_class = hb_logger_class
     self._hb_logger_params = hb_logger_params
+    self._hb_logger_kwargs = hb_logger_kwargs
+    if self._hb_logger_kwargs is None:
+      self._hb_logger_kwargs = {}
     self.apps = apps
     if self.apps is None:
       self.apps = []
@@ -227,7 +237,7 @@ class SimulationConfig(object):
     openflow_buffer = OpenFlowBuffer()
     if self._hb_logger_class is not None:
       # connect it to switches, hosts, and (later) connections
-      hb_logger = self._hb_logger_class(patch_panel)
+      hb_logger = self._hb_logger_class(patch_panel, **self._hb_logger_kwargs)
       if self._hb_logger_params is not None:
         hb_logger.open(self._hb_logger_params)
       else:
@@ -350,7 +360,9 @@ class Simulation(object):
       self._io_master.close_all()
     for app in self.apps:
       app.simulation_clean_up()
-    self.hb_logger.close()
+    # Last, so that the events of the clean up are still written to the trace
+    if self.hb_logger is not None:
+      self.hb_logger.close()
     
 
   @property
@@ -14,7 +14,10 @@
 # limitations under the License.
 
 from collections import defaultdict
+import hashlib
 import itertools
+import json
+import os
 
 class PrecomputePowerSetCache(object):
   sequence_id = itertools.count(1)
@@ -38,4 +41,53 @@ class PrecomputeCache(object):
   def update(self, input_sequence):
     self.done_sequences.add(input_sequence)
 
+class ReplayResultCache(object):
+  ''' Results of replays, persisted across runs in an append-only file with
+  one JSON object per line. Results are keyed by the labels of the replayed
+  input events, and only used by runs with the same run_key, e.g. a digest of
+  the trace and the configuration (see digest()). '''
+  def __init__(self, path, run_key):
+    self.path = path
+    self.run_key = run_key
+    # { input labels -> (violation found, 0-indexed iteration at which it
+    #                    was found, labels of timed out internal events) }
+    self.results = {}
+    ends_with_newline = True
+    if os.path.exists(path):
+      with open(path) as f:
+        for line in f:
+          ends_with_newline = line.endswith("\n")
+          try:
+            entry = json.loads(line)
+          except ValueError:
+            # the last line of a run that crashed while writing it
+            continue
+          if entry["run"] == run_key:
+            self.results[tuple(entry["inputs"])] = (entry["violation"],
+                                                    entry["iteration"],
+                                                    entry["timed_out"])
+    self._file = open(path, "a")
+    if not ends_with_newline:
+      self._file.write("\n")
 
+  @staticmethod
+  def digest(*parts):
+    return hashlib.sha1("\0".join(map(str, parts))).hexdigest()
+
+  def get(self, input_labels):
+    ''' Returns (violation found, iteration, timed out labels), or None if
+    input_labels were not replayed yet '''
+    return self.results.get(tuple(input_labels))
+
+  def update(self, input_labels, violation_found, iteration, timed_out):
+    input_labels = tuple(input_labels)
+    self.results[input_labels] = (violation_found, iteration, list(timed_out))
+    self._file.write(json.dumps({"run": self.run_key,
+                                 "inputs": list(input_labels),
+                                 "violation": violation_found,
+                                 "iteration": iteration,
+                                 "timed_out": list(timed_out)}) + "\n")
+    self._file.flush()
+
+  def close(self):
+    self._file.close()
@@ -5,7 +5,9 @@ from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 import xmlrpclib
 import sys
 import marshal
+import select
 import signal
+import errno
 from sts.util.convenience import find_port
 from pox.lib.util import connect_with_backoff
 import logging
@@ -123,6 +125,19 @@ class Forker(object):
     self.server.server_bind()
     self.server.server_activate()
 
+class ForkedChild(object):
+  ''' A child started by LocalForker.start(), which sends its result through a pipe '''
+  def __init__(self, task_name, pid, fd):
+    self.task_name = task_name
+    self.pid = pid
+    self.fd = fd
+    self.chunks = []
+    # Set once the pipe is closed and the process is waited for
+    self.reaped = False
+
+  def fileno(self):
+    return self.fd
+
 class LocalForker(Forker):
   # set of process ids that are currently running. These are all killed upon
   # signal reception.
@@ -159,6 +174,102 @@ class LocalForker(Forker):
       os.waitpid(pid, 0)
       return child_return
 
+  # Non-blocking interface, for running several tasks at once. The child runs
+  # the task right away and writes the xmlrpclib serialized result to a pipe.
+
+  def start(self, task_name, *args):
+    ''' Fork off a child process that runs task_name(*args). Returns a
+    ForkedChild to pass to wait_any() or cancel().
+
+    Raises a ValueError if task_name is not registered.'''
+    # N.B. get_task raises an exception if task_name is not registered
+    task = self._task_registry.get_task(task_name)
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0: # Child
+      # Send parents interrupts to the child
+      os.setsid()
+      # The pids of the siblings started before this child are not ours to
+      # kill: a signal handler that calls kill_all() in this child (e.g. the
+      # one of simulator.py) must only kill the processes this child started
+      LocalForker._active_pids.clear()
+      os.close(read_fd)
+      exit_code = 0
+      try:
+        try:
+          response = xmlrpclib.dumps((task(*args),), methodresponse=True,
+                                     allow_none=True)
+        except BaseException:
+          import traceback
+          response = xmlrpclib.dumps(xmlrpclib.Fault(1, "\n" + traceback.format_exc()),
+                                     methodresponse=True)
+        with os.fdopen(write_fd, "w") as output:
+          output.write(response)
+      except BaseException:
+        exit_code = 1
+      finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Do not unwind into the parent's stack
+        os._exit(exit_code)
+    else: # Parent
+      os.close(write_fd)
+      LocalForker._active_pids.add(pid)
+      return ForkedChild(task_name, pid, read_fd)
+
+  def wait_any(self, children):
+    ''' Block until one of children has finished. Returns a tuple (child,
+    return value of its task).
+
+    Raises a ReplayException if the task raised an exception or the child
+    died without a result. That child is reaped before raising.'''
+    while True:
+      try:
+        (readable, _, _) = select.select(children, [], [])
+      except select.error as e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+      for child in readable:
+        data = os.read(child.fd, 65536)
+        if data != "":
+          child.chunks.append(data)
+          continue
+        self._reap(child)
+        try:
+          ((child_return,), _) = xmlrpclib.loads("".join(child.chunks))
+        except xmlrpclib.Fault as e:
+          raise ReplayException("An Exception (code %d) occured in the child replay process: %s" %
+                                (e.faultCode, e.faultString))
+        except Exception as e:
+          raise ReplayException("Child process of task %s died without a result: %r" %
+                                (child.task_name, e))
+        return (child, child_return)
+
+  def cancel(self, child):
+    ''' Kill child and the processes it started. Does nothing if child was
+    already reaped, e.g. by a wait_any() that raised. '''
+    if child.reaped:
+      # N.B. its pid may belong to another process by now
+      return
+    try:
+      os.killpg(child.pid, signal.SIGTERM)
+    except OSError:
+      # the child did not call setsid() yet
+      try:
+        os.kill(child.pid, signal.SIGTERM)
+      except OSError:
+        pass
+    self._reap(child)
+
+  def _reap(self, child):
+    if child.reaped:
+      return
+    child.reaped = True
+    LocalForker._active_pids.discard(child.pid)
+    os.close(child.fd)
+    os.waitpid(child.pid, 0)
+
 class RemoteForker(Forker):
   def __init__(self, server_info_list):
     ''' cycles through server_info_list for each invocation of fork() '''
@@ -0,0 +1,107 @@
+import unittest
+import random
+import sys
+import os.path
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import networkx as nx
+
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+from sts.happensbefore.hb_race_detector import Race
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableRead
+from tests.unit.sts.happensbefore.hb_test_utils import add_random_edges
+from tests.unit.sts.happensbefore.hb_test_utils import race_eids
+
+
+def reference_find_covered_races(graph):
+  """The original find_covered_races, one DFS per RaW dependency."""
+  covered_races = dict()
+  data_dep_races = set()
+  remaining_harmful_races = set()
+  for r in graph.race_detector.races_harmful_with_covered:
+    if not graph.has_path(r.i_event.eid, r.k_event.eid, bidirectional=True):
+      remaining_harmful_races.add(r)
+
+  for eid in graph.events_with_reads_writes:
+    event = graph.events_by_id[eid]
+    shadow_table = graph.shadow_tables[event.dpid]
+    has_reads = False
+    for op in event.operations:
+      if type(op) in [TraceSwitchFlowTableRead]:
+        has_reads = True
+    if has_reads:
+      for write_eid in shadow_table.data_deps[event.eid]:
+        write_event = graph.events_by_id[write_eid]
+        if not graph.g.has_edge(write_event.eid, event.eid):
+          graph._add_edge(write_event, event, sanity_check=False, rel='dep_raw')
+        write_succs = set(nx.dfs_preorder_nodes(graph.g, write_eid))
+        for r in remaining_harmful_races:
+          if r.i_event.eid in write_succs or r.k_event.eid in write_succs:
+            if (r.i_event == event and r.k_event == write_event) or (r.i_event == write_event and r.k_event == event):
+              data_dep_races.add(r)
+            else:
+              if r not in covered_races and r not in data_dep_races:
+                if graph.has_path(r.i_event.eid, r.k_event.eid, bidirectional=True, use_path_cache=False):
+                  graph.race_detector.mark_covered(r)
+                  covered_races[r] = (eid, write_eid)
+  graph.covered_races = covered_races
+  return covered_races
+
+
+class Event(object):
+  def __init__(self, eid, dpid, has_read):
+    self.eid = eid
+    self.dpid = dpid
+    self.operations = []
+    if has_read:
+      self.operations.append(TraceSwitchFlowTableRead(dpid, None, None, None, make_copy=False))
+
+
+class ShadowTable(object):
+  def __init__(self):
+    self.data_deps = defaultdict(list)
+
+
+def random_graph(seed, n=60):
+  rng = random.Random(seed)
+  graph = HappensBeforeGraph()
+  events = [Event(eid, rng.choice([1, 2]), rng.random() < 0.5) for eid in range(n)]
+  for event in events:
+    graph.g.add_node(event.eid, event=event)
+    graph.events_by_id[event.eid] = event
+    graph.events_with_reads_writes.append(event.eid)
+  add_random_edges(rng, graph.g, range(n), 2.0 / n, rel='pid')
+  graph.shadow_tables = {1: ShadowTable(), 2: ShadowTable()}
+  for event in events:
+    if event.operations:
+      writes = [e.eid for e in events[:event.eid] if e.dpid == event.dpid and
+                not graph.g.has_edge(e.eid, event.eid)]
+      deps = rng.sample(writes, min(len(writes), rng.randint(0, 2)))
+      graph.shadow_tables[event.dpid].data_deps[event.eid].extend(deps)
+  races = set()
+  for _ in range(n * 2):
+    i, k = sorted(rng.sample(events, 2), key=lambda e: e.eid)
+    races.add(Race('r/w', i, None, k, None))
+  for race in sorted(races):
+    graph.race_detector._add_race(race, commutes=False)
+  return graph
+
+
+class FindCoveredRacesTest(unittest.TestCase):
+
+  def test_same_as_reference(self):
+    for seed in range(50):
+      # both graphs are built from the same seed, but have their own events
+      expected_graph = random_graph(seed)
+      expected = reference_find_covered_races(expected_graph)
+      graph = random_graph(seed)
+      covered = graph.find_covered_races()
+      self.assertEqual(dict(((r.i_event.eid, r.k_event.eid), v) for r, v in covered.iteritems()),
+                       dict(((r.i_event.eid, r.k_event.eid), v) for r, v in expected.iteritems()))
+      self.assertEqual(race_eids(graph.race_detector.races_harmful),
+                       race_eids(expected_graph.race_detector.races_harmful))
+      self.assertEqual(race_eids(graph.race_detector.covered_races),
+                       race_eids(expected_graph.race_detector.covered_races))
+      self.assertEqual(sorted(graph.g.edges()), sorted(expected_graph.g.edges()))
@@ -0,0 +1,96 @@
+import unittest
+import random
+import glob
+import os.path
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+from sts.happensbefore.hb_graph import Main
+from tests.unit.sts.happensbefore.hb_test_utils import random_switch_event
+
+
+DELTAS = [None, 0, 1, 3]
+
+
+def write_trace(filename, seed, n=40):
+  """A trace of reads and writes on two switches, spread over 10 seconds."""
+  rng = random.Random(seed)
+  with open(filename, 'w') as f:
+    for eid in range(1, n + 1):
+      event = random_switch_event(rng, eid, lambda: 1000.0 + rng.randint(0, 20) / 2.0)
+      f.write(event.to_json() + '\n')
+
+
+def graph_state(graph):
+  """Edges, races and time edge counters of an analyzed graph."""
+  detector = graph.race_detector
+  edges = sorted((src, dst, data['rel']) for src, dst, data in graph.g.edges_iter(data=True))
+  races = [sorted((r.rtype, r.i_event.eid, r.k_event.eid) for r in races)
+           for races in [detector.races_harmful, detector.races_commute,
+                         detector.filtered_by_time]]
+  return (edges, races, graph._time_hb_rw_edges_counter, graph._time_hb_ww_edges_counter,
+          detector.time_edges_counter)
+
+
+def read_dat_files(results_dir, prefix):
+  """{file name: rows}, without the timing values."""
+  files = {}
+  for filename in glob.glob(os.path.join(results_dir, prefix + '*.dat')):
+    with open(filename) as f:
+      rows = [line.strip() for line in f]
+    if prefix == 'timings_':
+      rows = [row.split(',')[0] for row in rows]
+    files[os.path.basename(filename)] = rows
+  return files
+
+
+class DeltaSweepTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.trace = os.path.join(self.tmp_dir, 'hb.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def analyzed(self, graph):
+    graph.race_detector.detect_races()
+    graph.update_path_cache()
+    return graph_state(graph)
+
+  def test_copies_same_as_fresh_graphs(self):
+    for seed in range(5):
+      write_trace(self.trace, seed)
+      base_graph = HappensBeforeGraph(add_hb_time=True, rw_delta=0, ww_delta=0,
+                                      disable_path_cache=False, defer_time_edges=True)
+      base_graph.load_trace(self.trace)
+      for delta in DELTAS:
+        add_hb_time = delta is not None
+        rw_delta = ww_delta = delta if add_hb_time else 5
+        graph = HappensBeforeGraph(add_hb_time=add_hb_time, rw_delta=rw_delta,
+                                   ww_delta=ww_delta, disable_path_cache=False)
+        graph.load_trace(self.trace)
+        copy = base_graph.copy_with_deltas(add_hb_time, rw_delta, ww_delta)
+        self.assertEqual(self.analyzed(copy), self.analyzed(graph))
+      # the loaded graph is not changed by the copies
+      self.assertFalse([e for e in base_graph.g.edges_iter(data=True) if e[2]['rel'] == 'time'])
+
+  def test_same_results_as_separate_runs(self):
+    write_trace(self.trace, 0)
+    for delta in DELTAS:
+      add_hb_time = delta is not None
+      rw_delta = ww_delta = delta if add_hb_time else 5
+      Main(self.trace, False, add_hb_time=add_hb_time, rw_delta=rw_delta, ww_delta=ww_delta,
+           verbose=False, no_dot_files=True).run()
+    results = read_dat_files(self.tmp_dir, 'results_')
+    timings = read_dat_files(self.tmp_dir, 'timings_')
+    self.assertEqual(len(results), len(DELTAS))
+    for filename in glob.glob(os.path.join(self.tmp_dir, '*.dat')):
+      os.remove(filename)
+    Main(self.trace, False, verbose=False, no_dot_files=True, delta_sweep=DELTAS).run()
+    self.assertEqual(read_dat_files(self.tmp_dir, 'results_'), results)
+    self.assertEqual(read_dat_files(self.tmp_dir, 'timings_'), timings)
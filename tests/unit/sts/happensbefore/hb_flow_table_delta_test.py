@@ -0,0 +1,38 @@
+import unittest
+import random
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from sts.happensbefore.hb_flow_table_delta import flow_table_diff
+from sts.happensbefore.hb_flow_table_delta import apply_flow_table_diff
+
+
+class FlowTableDiffTest(unittest.TestCase):
+
+  def test_add_remove(self):
+    old = ['a', 'b', 'c']
+    new = ['x', 'a', 'c', 'y']
+    diff = flow_table_diff(old, new)
+    self.assertEqual(diff['removed'], [1])
+    self.assertEqual(diff['added'], [[0, 'x'], [3, 'y']])
+    self.assertEqual(apply_flow_table_diff(old, diff), new)
+
+  def test_reordered(self):
+    self.assertEqual(flow_table_diff(['a', 'b'], ['b', 'a']), None)
+    self.assertEqual(flow_table_diff(['a', 'a'], ['a']), None)
+
+  def test_random_tables(self):
+    rng = random.Random(0)
+    rows = [str(i) for i in range(30)]
+    old = []
+    for _ in range(200):
+      new = [r for r in old if rng.random() > 0.2]
+      for r in rng.sample(rows, 3):
+        if r not in old and r not in new:
+          new.insert(rng.randint(0, len(new)), r)
+      diff = flow_table_diff(old, new)
+      self.assertNotEqual(diff, None)
+      self.assertEqual(apply_flow_table_diff(old, diff), new)
+      old = new
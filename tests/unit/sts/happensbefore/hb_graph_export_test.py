@@ -0,0 +1,62 @@
+import unittest
+import os.path
+import shutil
+import sys
+import tempfile
+from xml.etree import ElementTree
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import networkx as nx
+
+from sts.happensbefore.hb_graph_export import read_edge_list
+from sts.happensbefore.hb_graph_export import write_graph
+
+
+def drawn_graph():
+  g = nx.DiGraph()
+  g.add_node(1, event=object(), label="ID 1 \\n HbHostSend", shape='oval')
+  g.add_node(2, event=object(), label="ID 2 \\n Match: <a & b>\ttab\nline",
+             shape='box', style='bold')
+  g.add_node(3, event=object(), label="ID 3", shape='oval')
+  g.add_edge(1, 2, rel='pid', label='pid')
+  g.add_edge(2, 3, rel='race', harmful=True, color='red', style='bold')
+  return g
+
+
+class GraphExportTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_edge_list_round_trip(self):
+    g = drawn_graph()
+    filename = write_graph(g, os.path.join(self.tmp_dir, 'hb.dot'), 'edgelist')
+    self.assertEqual(filename, os.path.join(self.tmp_dir, 'hb.tsv'))
+    read = read_edge_list(filename)
+    self.assertEqual(sorted(read.nodes()), [1, 2, 3])
+    self.assertEqual(sorted(read.edges()), [(1, 2), (2, 3)])
+    for eid in g.nodes():
+      self.assertEqual(read.node[eid]['label'], g.node[eid]['label'])
+      self.assertEqual(read.node[eid]['shape'], g.node[eid]['shape'])
+    self.assertEqual(read.node[2]['style'], 'bold')
+    self.assertFalse('style' in read.node[1])
+    self.assertEqual(read.edge[2][3], {'rel': 'race', 'harmful': 'True',
+                                       'color': 'red', 'style': 'bold'})
+
+  def test_graphml(self):
+    g = drawn_graph()
+    filename = write_graph(g, os.path.join(self.tmp_dir, 'trace_10.0.0.1_10.0.0.2_0001.dot'), 'graphml')
+    self.assertEqual(filename, os.path.join(self.tmp_dir, 'trace_10.0.0.1_10.0.0.2_0001.graphml'))
+    ns = '{http://graphml.graphdrawing.org/xmlns}'
+    root = ElementTree.parse(filename).getroot()
+    nodes = root.findall('%sgraph/%snode' % (ns, ns))
+    edges = root.findall('%sgraph/%sedge' % (ns, ns))
+    self.assertEqual([n.get('id') for n in nodes], ['1', '2', '3'])
+    self.assertEqual(sorted((e.get('source'), e.get('target')) for e in edges),
+                     [('1', '2'), ('2', '3')])
+    labels = dict((n.get('id'), n.find("%sdata[@key='n_label']" % ns).text) for n in nodes)
+    self.assertEqual(labels['2'], g.node[2]['label'])
@@ -0,0 +1,31 @@
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.openflow.libopenflow_01 import ofp_action_output
+from pox.openflow.libopenflow_01 import ofp_flow_mod
+from pox.openflow.libopenflow_01 import ofp_match
+
+from sts.happensbefore.hb_logger import HappensBeforeLogger
+
+
+class MockPatchPanel(object):
+  hosts = []
+  switches = []
+
+
+class RxDigestTest(unittest.TestCase):
+
+  def test_evicted_digest(self):
+    logger = HappensBeforeLogger(MockPatchPanel(), controller_match_cache_size=1)
+    evicted = ofp_flow_mod(match=ofp_match(in_port=1), actions=[ofp_action_output(port=2)])
+    kept = ofp_flow_mod(match=ofp_match(in_port=2), actions=[ofp_action_output(port=1)])
+    logger.msg_to_rx_digest[evicted] = 'evicted digest'
+    logger.msg_to_rx_digest[kept] = 'digest on the wire'
+    self.assertEqual(logger.msg_to_rx_digest.evicted, 1)
+    self.assertEqual(logger._get_rx_digest(evicted), logger._msg_digest(evicted))
+    self.assertEqual(logger._get_rx_digest(kept), 'digest on the wire')
+    # forgotten once it is used
+    self.assertEqual(logger._get_rx_digest(kept), logger._msg_digest(kept))
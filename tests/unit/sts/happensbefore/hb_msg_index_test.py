@@ -0,0 +1,62 @@
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from sts.happensbefore.hb_msg_index import BoundedDict
+from sts.happensbefore.hb_msg_index import MessageIndex
+
+
+class MessageIndexTest(unittest.TestCase):
+
+  def test_pop_oldest_first(self):
+    index = MessageIndex()
+    index.add((1, 'a'), 'first')
+    index.add((2, 'a'), 'other switch')
+    index.add((1, 'a'), 'second')
+    self.assertEqual(len(index), 3)
+    self.assertEqual(index.pop((1, 'a')), 'first')
+    self.assertEqual(index.pop((1, 'a')), 'second')
+    self.assertEqual(index.pop((1, 'a')), None)
+    self.assertFalse((1, 'a') in index)
+    self.assertEqual(index.pop_all((2, 'a')), ['other switch'])
+    self.assertEqual(index.pop_all((2, 'a')), [])
+    self.assertEqual(len(index), 0)
+
+  def test_expire(self):
+    index = MessageIndex(max_age=10)
+    index.add('a', 1, timestamp=0)
+    index.add('b', 2, timestamp=5)
+    index.add('a', 3, timestamp=8)
+    index.add('a', 4, timestamp=20)
+    self.assertEqual(index.pop('a'), 1)
+    self.assertEqual(index.expire(now=12), [])
+    self.assertEqual(sorted(index.expire(now=19)), [('a', 3), ('b', 2)])
+    self.assertEqual(len(index), 1)
+    self.assertFalse('b' in index)
+    self.assertEqual(index.pop('a'), 4)
+    self.assertEqual(index.expire(now=100), [])
+    self.assertEqual(len(index), 0)
+
+  def test_no_max_age(self):
+    index = MessageIndex()
+    index.add('a', 1, timestamp=0)
+    self.assertEqual(index.expire(now=1e9), [])
+    self.assertEqual(index.pop('a'), 1)
+
+
+class BoundedDictTest(unittest.TestCase):
+
+  def test_evicts_oldest(self):
+    d = BoundedDict(2)
+    d['a'] = 1
+    d['b'] = 2
+    d['a'] = 3
+    self.assertEqual(d.evicted, 0)
+    d['c'] = 4
+    self.assertEqual(d.items(), [('b', 2), ('c', 4)])
+    self.assertEqual(d.evicted, 1)
+    self.assertEqual(d.pop('b'), 2)
+    d['d'] = 5
+    self.assertEqual(d.items(), [('c', 4), ('d', 5)])
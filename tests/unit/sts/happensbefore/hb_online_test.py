@@ -0,0 +1,95 @@
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.packet.ethernet import ethernet
+from pox.openflow.flow_table import SwitchFlowTable
+from pox.openflow.libopenflow_01 import ofp_action_output
+from pox.openflow.libopenflow_01 import ofp_flow_mod
+from pox.openflow.libopenflow_01 import ofp_match
+from pox.openflow.libopenflow_01 import ofp_packet_in
+from pox.openflow.libopenflow_01 import OFPT_FLOW_MOD
+from pox.openflow.libopenflow_01 import OFPT_PACKET_IN
+
+from sts.happensbefore.hb_events import HbControllerHandle
+from sts.happensbefore.hb_events import HbControllerSend
+from sts.happensbefore.hb_events import HbHostSend
+from sts.happensbefore.hb_events import HbMessageHandle
+from sts.happensbefore.hb_events import HbMessageSend
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+from sts.happensbefore.hb_online import OnlineRaceDetector
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableWrite
+from tests.unit.sts.happensbefore.hb_test_utils import race_eids
+
+
+def flow_mod(out_port):
+  return ofp_flow_mod(match=ofp_match(in_port=1),
+                      actions=[ofp_action_output(port=out_port)])
+
+
+def flow_mod_handle(eid, mid_in, mid_out=None, out_port=None, t=None):
+  """A HbMessageHandle on switch 1, with a write if out_port is given."""
+  operations = []
+  if out_port is not None:
+    operations.append(TraceSwitchFlowTableWrite(1, flow_mod(out_port), flow_table=SwitchFlowTable(),
+                                                t=t, eid=100 + eid, make_copy=False))
+  return HbMessageHandle(mid_in, OFPT_FLOW_MOD, operations=operations, mid_out=mid_out,
+                         dpid=1, msg=flow_mod(out_port or 1), eid=eid)
+
+
+def host_send(eid):
+  return HbHostSend(None, [eid], hid=1, packet=ethernet(), out_port=1, eid=eid)
+
+
+def make_trace():
+  """
+  The trace lines in the order they are written. The controller events 4 and
+  5 are written late, and order the write of event 2 before the one of 6
+  through event 1. Event 1 has the smallest eid, but is written after 2.
+  """
+  events = [
+    flow_mod_handle(2, mid_in=0, mid_out=[1], out_port=2, t=1000.0),
+    HbMessageSend(1, [2], OFPT_PACKET_IN, dpid=1, msg=ofp_packet_in(), eid=3),
+    flow_mod_handle(1, mid_in=4, mid_out=[5]),
+    host_send(20),
+    host_send(21),
+    HbControllerHandle(2, [3], eid=4),
+    HbControllerSend(3, [4], eid=5),
+    flow_mod_handle(6, mid_in=5, out_port=3, t=1001.0),
+    flow_mod_handle(7, mid_in=7, out_port=4, t=1002.0),
+  ]
+  return [event.to_json() for event in events]
+
+
+class OnlineRaceDetectorTest(unittest.TestCase):
+
+  def offline_harmful_races(self, lines, delta):
+    graph = HappensBeforeGraph()
+    for line in lines:
+      graph.add_line(line)
+    graph.race_detector.detect_races()
+    graph.race_detector.apply_time_filter(delta)
+    return graph.race_detector.races_harmful
+
+  def test_same_as_offline(self):
+    lines = make_trace()
+    for delta, expected in [(5, [('w/w', 2, 7), ('w/w', 6, 7)]),
+                            (1.5, [('w/w', 6, 7)])]:
+      self.assertEqual(race_eids(self.offline_harmful_races(lines, delta), ordered=False),
+                       expected)
+      for window in [1, 2, 3, 100]:
+        detector = OnlineRaceDetector(window=window, delta=delta)
+        for line in lines:
+          detector.add_line(line)
+        detector.flush()
+        self.assertEqual(race_eids(detector.harmful_races, ordered=False), expected)
+
+  def test_prunes_events(self):
+    detector = OnlineRaceDetector(window=2, delta=1.5)
+    for line in make_trace():
+      detector.add_line(line)
+    detector.flush()
+    # 2 still waits for the controller event with its mid_in
+    self.assertEqual(sorted(detector.graph.events_by_id), [2, 6, 7])
@@ -0,0 +1,81 @@
+import unittest
+import random
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import networkx as nx
+
+from sts.happensbefore.hb_events import HbHostSend
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+from sts.happensbefore.hb_graph import PacketTrace
+from sts.happensbefore.hb_race_detector import Race
+from tests.unit.sts.happensbefore.hb_test_utils import Event
+from tests.unit.sts.happensbefore.hb_test_utils import add_random_edges
+from tests.unit.sts.happensbefore.hb_test_utils import race_eids
+
+
+def random_graph(seed, trace_views, n=80):
+  rng = random.Random(seed)
+  graph = HappensBeforeGraph(trace_views=trace_views)
+  for eid in range(1, n + 1):
+    if rng.random() < 0.15:
+      event = HbHostSend(None, [], eid=eid)
+      graph.host_sends[eid] = event
+    else:
+      event = Event(eid)
+    graph.g.add_node(eid, event=event)
+  add_random_edges(rng, graph.g, range(1, n + 1), 3.0 / n, rel=['pid', 'mid', 'time', 'race'])
+  events = [graph.g.node[eid]['event'] for eid in range(1, n + 1)]
+  races = set()
+  for _ in range(60):
+    i, k = rng.sample(events, 2)
+    races.add(Race(rng.choice(['r/w', 'w/w']), i, None, k, None))
+  races = sorted(races, key=lambda r: (r.rtype, r.i_event.eid, r.k_event.eid))
+  for race in races:
+    graph.race_detector._add_race(race, commutes=False)
+  for race in races[:40]:
+    graph.race_detector.racing_events_harmful.add(race.i_event)
+    graph.race_detector.racing_events_harmful.add(race.k_event)
+  return graph
+
+
+def expected_trace(graph, host_send):
+  """Events reachable from host_send without time/race edges and other host sends."""
+  eids = set([host_send])
+  stack = [host_send]
+  while stack:
+    for succ, data in graph.g.succ[stack.pop()].iteritems():
+      if (data['rel'] not in ['time', 'race'] and succ not in eids and
+          not isinstance(graph.g.node[succ]['event'], HbHostSend)):
+        eids.add(succ)
+        stack.append(succ)
+  return eids
+
+
+class PacketTraceViewsTest(unittest.TestCase):
+
+  def test_same_as_subgraphs(self):
+    for seed in range(30):
+      graph = random_graph(seed, False)
+      view_graph = random_graph(seed, True)
+      traces = graph.extract_traces(graph.g)
+      views = view_graph.extract_traces(view_graph.g)
+      self.assertEqual(len(traces), len(views))
+      for trace, view in zip(traces, views):
+        self.assertTrue(isinstance(view, PacketTrace))
+        host_send = view.graph['host_send'].eid
+        self.assertEqual(trace.graph['host_send'].eid, host_send)
+        self.assertEqual(set(view.nodes()), expected_trace(view_graph, host_send))
+        self.assertEqual(view.dfs_preorder_nodes()[0], host_send)
+        self.assertEqual(set(view.dfs_preorder_nodes()), set(view.nodes()))
+        if set(trace.nodes()) != set(view.nodes()):
+          # extract_traces can keep a host send that directly follows another
+          # one in DFS preorder
+          continue
+        self.assertEqual(sorted(view.to_graph().edges()), sorted(trace.edges()))
+        for ignore_other_traces in [True, False]:
+          self.assertEqual(
+            race_eids(view_graph.get_racing_events(view, ignore_other_traces)),
+            race_eids(graph.get_racing_events(trace, ignore_other_traces)))
@@ -0,0 +1,148 @@
+import unittest
+import random
+import sys
+import os.path
+import itertools
+from collections import Counter
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import networkx as nx
+
+from pox.lib.packet.ethernet import ethernet
+
+from sts.happensbefore.hb_race_detector import RaceDetector
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableRead
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableWrite
+from tests.unit.sts.happensbefore.hb_test_utils import DL_TYPES
+from tests.unit.sts.happensbefore.hb_test_utils import Event
+from tests.unit.sts.happensbefore.hb_test_utils import MACS
+from tests.unit.sts.happensbefore.hb_test_utils import add_random_edges
+from tests.unit.sts.happensbefore.hb_test_utils import random_flow_mod
+from tests.unit.sts.happensbefore.hb_test_utils import random_flow_table
+
+
+class Graph(object):
+  def __init__(self, g):
+    self.g = g
+
+  def has_path(self, src_eid, dst_eid, bidirectional=True):
+    return nx.has_path(self.g, src_eid, dst_eid) or (bidirectional and nx.has_path(self.g, dst_eid, src_eid))
+
+
+def random_dag(seed, n=60):
+  rng = random.Random(seed)
+  g = nx.DiGraph()
+  g.add_nodes_from(range(n))
+  add_random_edges(rng, g, range(n), 1.5 / n)
+  return g
+
+
+def reference_has_common_ancestor(g, i, k):
+  """The original has_common_ancestor, with full ancestor sets."""
+  i_ancs = nx.ancestors(g, i)
+  k_ancs = nx.ancestors(g, k)
+  i_ancs.add(i)
+  k_ancs.add(k)
+  return not i_ancs.isdisjoint(k_ancs)
+
+
+class HasCommonAncestorTest(unittest.TestCase):
+
+  def test_same_as_reference(self):
+    for seed in range(20):
+      g = random_dag(seed)
+      detector = RaceDetector(Graph(g))
+      events = [Event(eid) for eid in g.nodes()]
+      for i in events:
+        for k in events:
+          self.assertEqual(detector.has_common_ancestor(i, k),
+                           reference_has_common_ancestor(g, i.eid, k.eid))
+
+  def test_clear_after_new_edges(self):
+    g = nx.DiGraph()
+    g.add_edge(1, 2)
+    g.add_edge(3, 4)
+    detector = RaceDetector(Graph(g))
+    self.assertFalse(detector.has_common_ancestor(Event(2), Event(4)))
+    g.add_edge(1, 3)
+    detector._clear_ancestor_roots()
+    self.assertTrue(detector.has_common_ancestor(Event(2), Event(4)))
+
+
+class SwitchEvent(object):
+  def __init__(self, eid, dpid, packet=None, in_port=None):
+    self.eid = eid
+    self.dpid = dpid
+    self.packet = packet
+    self.in_port = in_port
+    self.operations = []
+
+
+# Tables of up to 3 entries, with clashing priorities
+FLOW_MODS = {'max_entries': 3, 'priorities': [1, 2]}
+
+
+def random_operations(seed, n=40):
+  """Graph and (event, op) reads and writes on several switches."""
+  rng = random.Random(seed)
+  g = nx.DiGraph()
+  reads = []
+  writes = []
+  for eid in range(n):
+    g.add_node(eid)
+    dpid = rng.choice([1, 2, 3])
+    t = float(eid)
+    if rng.random() < 0.4:
+      packet = ethernet(src=rng.choice(MACS), dst=rng.choice(MACS), type=rng.choice(DL_TYPES))
+      event = SwitchEvent(eid, dpid, packet, rng.choice([1, 2]))
+      op = TraceSwitchFlowTableRead(dpid, packet, event.in_port, None,
+                                    flow_table=random_flow_table(rng, **FLOW_MODS), t=t,
+                                    make_copy=False)
+      reads.append((event, op))
+    else:
+      event = SwitchEvent(eid, dpid)
+      op = TraceSwitchFlowTableWrite(dpid, random_flow_mod(rng, priorities=[1, 2]),
+                                     flow_table=random_flow_table(rng, **FLOW_MODS),
+                                     t=t, make_copy=False)
+      writes.append((event, op))
+    event.operations.append(op)
+  add_random_edges(rng, g, range(n), 1.0 / n)
+  return (g, reads, writes)
+
+
+def reference_races(detector):
+  """The original cross product over all operations, checking every pair."""
+  races = Counter()
+  checker = detector.commutativity_checker
+  for (i_event, i_op), (k_event, k_op) in itertools.combinations(detector.write_operations, 2):
+    if (i_event != k_event and i_event.dpid == k_event.dpid and
+        not detector.is_ordered(i_event, k_event)):
+      races[('w/w', i_event.eid, k_event.eid,
+             checker.check_commutativity_ww(i_event, i_op, k_event, k_op))] += 1
+  for i_event, i_op in detector.read_operations:
+    for k_event, k_op in detector.write_operations:
+      if (i_event != k_event and i_event.dpid == k_event.dpid and
+          not detector.is_ordered(i_event, k_event)):
+        races[('r/w', i_event.eid, k_event.eid,
+               checker.check_commutativity_rw(i_event, i_op, k_event, k_op))] += 1
+  return races
+
+
+class RaceCandidatesTest(unittest.TestCase):
+
+  def test_same_as_cross_product(self):
+    for seed in range(10):
+      (g, reads, writes) = random_operations(seed)
+      detector = RaceDetector(Graph(g))
+      detector.read_operations = reads
+      detector.write_operations = writes
+      expected = reference_races(detector)
+      detector.detect_ww_races()
+      detector.detect_rw_races()
+      commute = set(detector.races_commute)
+      races = Counter((r.rtype, r.i_event.eid, r.k_event.eid, r in commute)
+                      for r in detector.all_races)
+      self.assertEqual(races, expected)
+      # both harmful and commuting races are generated
+      self.assertTrue(len(commute) < len(detector.all_races))
@@ -0,0 +1,54 @@
+import unittest
+import random
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import networkx as nx
+
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+from tests.unit.sts.happensbefore.hb_test_utils import add_random_edges
+
+
+def random_graph(seed, n=30, **kwargs):
+  rng = random.Random(seed)
+  graph = HappensBeforeGraph(**kwargs)
+  graph.g.add_nodes_from(range(n))
+  add_random_edges(rng, graph.g, range(n), 6.0 / n, rel='pid')
+  return graph
+
+
+def all_paths(g, i, k):
+  return sorted(list(nx.all_simple_paths(g, i, k)) + list(nx.all_simple_paths(g, k, i)))
+
+
+class RacePathsTest(unittest.TestCase):
+
+  def test_unlimited_same_as_all_simple_paths(self):
+    for seed in range(10):
+      graph = random_graph(seed, race_path_limit=None, race_path_timeout=None)
+      for i, k in [(0, 29), (29, 0), (3, 17), (10, 11)]:
+        self.assertEqual(sorted(graph.race_paths(i, k)), all_paths(graph.g, i, k))
+
+  def test_limit(self):
+    for seed in range(10):
+      graph = random_graph(seed, race_path_limit=3, race_path_timeout=None)
+      for i, k in [(0, 29), (29, 0), (3, 17)]:
+        expected = all_paths(graph.g, i, k)
+        paths = list(graph.race_paths(i, k))
+        self.assertEqual(len(paths), min(3, len(expected)))
+        for path in paths:
+          self.assertTrue(path in expected)
+        if paths:
+          # the first path is a shortest one
+          self.assertEqual(len(paths[0]), min(len(path) for path in expected))
+
+  def test_timeout(self):
+    # a complete DAG has 2^(n-2) paths from its first to its last node
+    graph = HappensBeforeGraph(race_path_limit=None, race_path_timeout=0.01)
+    for j in range(40):
+      for i in range(j):
+        graph.g.add_edge(i, j, rel='pid')
+    paths = list(graph.race_paths(0, 39))
+    self.assertTrue(0 < len(paths) < 2 ** 38)
@@ -0,0 +1,65 @@
+import unittest
+import random
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import networkx as nx
+
+from sts.happensbefore.hb_reachability import ReachabilityIndex
+
+
+class ReachabilityIndexTest(unittest.TestCase):
+
+  def _assert_same_as_networkx(self, g, index):
+    for src in g.nodes():
+      descendants = nx.descendants(g, src)
+      for dst in g.nodes():
+        expected = src == dst or dst in descendants
+        self.assertEqual(index.has_path(src, dst), expected,
+                         "%s -> %s" % (src, dst))
+
+  def test_chain(self):
+    index = ReachabilityIndex()
+    for i in range(5):
+      index.add_node(i)
+    for i in range(4):
+      index.add_edge(i, i + 1)
+    self.assertTrue(index.has_path(0, 4))
+    self.assertTrue(index.has_path(2, 3))
+    self.assertFalse(index.has_path(4, 0))
+    self.assertFalse(index.has_path(3, 1))
+
+  def test_edge_to_older_node(self):
+    # controller events are logged out of order, so edges to older nodes exist
+    index = ReachabilityIndex()
+    for i in range(4):
+      index.add_node(i)
+    index.add_edge(0, 1)
+    index.add_edge(2, 3)
+    self.assertFalse(index.has_path(0, 3))
+    index.add_edge(1, 2)
+    self.assertTrue(index.has_path(0, 3))
+    index.add_edge(3, 0)
+    self.assertTrue(index.has_path(2, 1))
+
+  def test_random_dags(self):
+    rnd = random.Random(42)
+    for _ in range(20):
+      g = nx.DiGraph()
+      index = ReachabilityIndex()
+      order = range(40)
+      rnd.shuffle(order)
+      for n in range(40):
+        g.add_node(n)
+        index.add_node(n)
+        for _ in range(rnd.randint(0, 2)):
+          other = rnd.randint(0, 39)
+          if other == n:
+            continue
+          # edges follow a hidden topological order, but arrive in any order
+          src, dst = (n, other) if order[n] < order[other] else (other, n)
+          g.add_edge(src, dst)
+          index.add_edge(src, dst)
+      self._assert_same_as_networkx(g, index)
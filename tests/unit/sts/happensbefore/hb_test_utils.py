@@ -0,0 +1,105 @@
+"""
+Random graphs, events and flow tables shared by the happens-before tests.
+"""
+from pox.lib.addresses import EthAddr
+from pox.lib.packet.ethernet import ethernet
+from pox.openflow.flow_table import SwitchFlowTable
+from pox.openflow.libopenflow_01 import ofp_action_output
+from pox.openflow.libopenflow_01 import ofp_flow_mod
+from pox.openflow.libopenflow_01 import ofp_match
+from pox.openflow.libopenflow_01 import OFPFC_ADD
+from pox.openflow.libopenflow_01 import OFPFC_DELETE
+from pox.openflow.libopenflow_01 import OFPT_FLOW_MOD
+
+from sts.happensbefore.hb_events import HbMessageHandle
+from sts.happensbefore.hb_events import HbPacketHandle
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableRead
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableWrite
+from sts.happensbefore.hb_utils import base64_encode_flow_table
+
+
+# Few distinct values, so that both clashing and equal exact values are common
+MACS = [EthAddr('00:00:00:00:00:01'), EthAddr('00:00:00:00:00:02')]
+DL_TYPES = [0x0800, 0x0806]
+MATCH_VALUES = {'in_port': [1, 2], 'dl_type': DL_TYPES, 'dl_src': MACS, 'dl_dst': MACS}
+
+
+class Event(object):
+  def __init__(self, eid):
+    self.eid = eid
+
+
+def random_match(rng, fields=('in_port', 'dl_type', 'dl_src', 'dl_dst')):
+  """A match on fields, each of them exact or wildcarded."""
+  return ofp_match(**dict((field, rng.choice([None] + MATCH_VALUES[field]))
+                          for field in fields))
+
+
+def random_flow_mod(rng, fields=('in_port', 'dl_type', 'dl_src', 'dl_dst'), priorities=None):
+  """An add or delete with a random_match on fields, with one of priorities if given."""
+  match = random_match(rng, fields)
+  command = rng.choice([OFPFC_ADD, OFPFC_ADD, OFPFC_DELETE])
+  kwargs = {}
+  if priorities is not None:
+    kwargs['priority'] = rng.choice(priorities)
+  return ofp_flow_mod(match=match, command=command,
+                      actions=[ofp_action_output(port=rng.choice([1, 2]))], **kwargs)
+
+
+def random_flow_table(rng, max_entries=2, **flow_mod_kwargs):
+  """A flow table as read from a trace, decoded on every access."""
+  table = SwitchFlowTable()
+  for _ in range(rng.randint(0, max_entries)):
+    table.process_flow_mod(random_flow_mod(rng, **flow_mod_kwargs))
+  return tuple(base64_encode_flow_table(table, set_zero_XID=True))
+
+
+def random_switch_event(rng, eid, t, max_writes=1):
+  """
+  A HbPacketHandle with a flow table read or a HbMessageHandle with up to
+  max_writes flow table writes, on switch 1 or 2. t() is the time of each
+  operation.
+  """
+  fields = ('in_port', 'dl_src')
+  dpid = rng.choice([1, 2])
+  if rng.random() < 0.3:
+    packet = ethernet(src=rng.choice(MACS), dst=MACS[0], type=0x0800)
+    in_port = rng.choice([1, 2])
+    op = TraceSwitchFlowTableRead(dpid, packet, in_port, None,
+                                  flow_table=random_flow_table(rng, fields=fields),
+                                  t=t(), eid=1000 + eid, make_copy=False)
+    return HbPacketHandle(eid, operations=[op], dpid=dpid, packet=packet, in_port=in_port, eid=eid)
+  ops = []
+  for i in range(rng.randint(1, max_writes)):
+    ops.append(TraceSwitchFlowTableWrite(dpid, random_flow_mod(rng, fields=fields),
+                                         flow_table=random_flow_table(rng, fields=fields),
+                                         t=t(), eid=1000 * (i + 1) + eid, make_copy=False))
+  return HbMessageHandle(eid, OFPT_FLOW_MOD, operations=ops, dpid=dpid, msg=ops[0].flow_mod,
+                         eid=eid)
+
+
+def add_random_edges(rng, g, nodes, p, rel=None):
+  """
+  Adds an edge from each node to each later one with probability p. rel is
+  the 'rel' attribute of the edges, or a list to choose it from at random.
+  """
+  for j, dst in enumerate(nodes):
+    for src in nodes[:j]:
+      if rng.random() < p:
+        if rel is None:
+          g.add_edge(src, dst)
+        elif isinstance(rel, list):
+          g.add_edge(src, dst, rel=rng.choice(rel))
+        else:
+          g.add_edge(src, dst, rel=rel)
+
+
+def race_eids(races, ordered=True):
+  """Sorted (rtype, i eid, k eid) of races. Unless ordered, i and k are sorted."""
+  eids = []
+  for r in races:
+    i, k = r.i_event.eid, r.k_event.eid
+    if not ordered:
+      i, k = sorted([i, k])
+    eids.append((r.rtype, i, k))
+  return sorted(eids)
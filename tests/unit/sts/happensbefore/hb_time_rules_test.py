@@ -0,0 +1,94 @@
+import unittest
+import random
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.openflow.libopenflow_01 import ofp_match
+
+from sts.happensbefore.hb_events import HbMessageHandle
+from sts.happensbefore.hb_events import HbPacketHandle
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableRead
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableWrite
+from tests.unit.sts.happensbefore.hb_test_utils import random_switch_event
+
+
+class FullScanGraph(HappensBeforeGraph):
+  """The original time rules, which scan every event in the graph."""
+
+  def _rule_06_time_rw(self, event):
+    if type(event) not in [HbPacketHandle]:
+      return
+    packet_match = ofp_match.from_packet(event.packet, event.in_port)
+    operations = []
+    for op in event.operations:
+      if type(op) == TraceSwitchFlowTableRead:
+        operations.append(op)
+    for e in self.events:
+      if type(e) != HbMessageHandle:
+        continue
+      for op in e.operations:
+        if type(op) != TraceSwitchFlowTableWrite:
+          continue
+        if not op.flow_mod.match.matches_with_wildcards(packet_match, consider_other_wildcards=False):
+          continue
+        delta = abs(op.t - operations[0].t)
+        if (delta > self.rw_delta):
+          self._time_hb_rw_edges_counter += 1
+          self._add_edge(e, event, sanity_check=False, rel='time')
+        break
+
+  def _rule_07_time_ww(self, event):
+    if type(event) not in [HbMessageHandle]:
+      return
+    i_ops = [op for op in event.operations if type(op) == TraceSwitchFlowTableWrite]
+    if not i_ops:
+      return
+    for e in self.events:
+      if e == event:
+        continue
+      if type(e) != HbMessageHandle:
+        continue
+      k_ops = [op for op in e.operations if type(op) == TraceSwitchFlowTableWrite]
+      if not k_ops:
+        continue
+      for i_op in i_ops:
+        for k_op in k_ops:
+          if self.race_detector.commutativity_checker.check_commutativity_ww(
+                  event, i_op, e, k_op):
+            continue
+          delta = abs(i_op.t - k_op.t)
+          if delta > self.ww_delta:
+            self._time_hb_ww_edges_counter += 1
+            self._add_edge(e, event, sanity_check=False, rel='time')
+          break
+
+
+def random_events(seed, n=40):
+  """Switch events with writes and reads, at times that are often exactly delta apart."""
+  rng = random.Random(seed)
+  return [random_switch_event(rng, eid, lambda: rng.randint(0, 40) / 2.0, max_writes=2)
+          for eid in range(1, n + 1)]
+
+
+def time_edges(graph):
+  return sorted((src, dst) for src, dst, data in graph.g.edges_iter(data=True)
+                if data['rel'] == 'time')
+
+
+class TimeRulesTest(unittest.TestCase):
+
+  def test_same_as_full_scan(self):
+    for seed in range(20):
+      expected = FullScanGraph(add_hb_time=True, rw_delta=5, ww_delta=1)
+      graph = HappensBeforeGraph(add_hb_time=True, rw_delta=5, ww_delta=1)
+      for event in random_events(seed):
+        expected.add_event(event)
+      for event in random_events(seed):
+        graph.add_event(event)
+      self.assertEqual(time_edges(graph), time_edges(expected))
+      self.assertEqual(graph._time_hb_rw_edges_counter, expected._time_hb_rw_edges_counter)
+      self.assertEqual(graph._time_hb_ww_edges_counter, expected._time_hb_ww_edges_counter)
+    self.assertTrue(time_edges(graph))
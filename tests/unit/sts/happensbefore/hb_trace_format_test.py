@@ -0,0 +1,103 @@
+import unittest
+import os.path
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.packet.ethernet import ethernet
+from pox.openflow.flow_table import SwitchFlowTable
+from pox.openflow.flow_table import TableEntry
+from pox.openflow.libopenflow_01 import ofp_flow_mod
+from pox.openflow.libopenflow_01 import ofp_match
+from pox.openflow.libopenflow_01 import OFPT_FLOW_MOD
+
+from sts.happensbefore.hb_events import HbHostSend
+from sts.happensbefore.hb_events import HbMessageHandle
+from sts.happensbefore.hb_flow_table_delta import FlowTableDeltaEncoder
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableWrite
+from sts.happensbefore.hb_trace_format import encode_binary_event
+from sts.happensbefore.hb_trace_format import write_binary_header
+from sts.happensbefore.hb_trace_format import write_binary_record
+
+
+def flow_mod(in_port):
+  return ofp_flow_mod(match=ofp_match(in_port=in_port))
+
+
+def make_events(n=20):
+  events = []
+  table = SwitchFlowTable()
+  for i in range(n):
+    if i % 2:
+      events.append(HbHostSend(None, [i], hid=1, packet=ethernet(), out_port=1, eid=i + 1))
+    else:
+      table.add_entry(TableEntry.from_flow_mod(flow_mod(i)))
+      op = TraceSwitchFlowTableWrite(1, flow_mod(i), flow_table=table, t=1000.0 + i / 3.0,
+                                     eid=n + i + 1, make_copy=False)
+      events.append(HbMessageHandle(i, OFPT_FLOW_MOD, operations=[op], dpid=1,
+                                    msg=flow_mod(i), eid=i + 1))
+  return events
+
+
+def canonical(event):
+  """The JSON of event, with its operations decoded."""
+  json_dict = event.to_dict()
+  if 'operations' in json_dict:
+    json_dict['operations'] = [op.to_dict() for op in event.operations]
+  return json_dict
+
+
+class BinaryTraceTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def read_trace(self, filename):
+    graph = HappensBeforeGraph()
+    with open(filename, 'rb') as f:
+      return [canonical(event) for event in graph._unpack_trace(f)]
+
+  def test_same_events_as_json(self):
+    for keyframe_interval in [None, 3]:
+      json_file = os.path.join(self.tmp_dir, 'hb.json')
+      binary_file = os.path.join(self.tmp_dir, 'hb.bin')
+      events = make_events()
+      encoders = [FlowTableDeltaEncoder(keyframe_interval) if keyframe_interval else None
+                  for _ in range(2)]
+      with open(json_file, 'w') as fj:
+        with open(binary_file, 'wb') as fb:
+          write_binary_header(fb)
+          for event in events:
+            for encoder, write in zip(encoders, [
+                lambda: fj.write(event.to_json() + '\n'),
+                lambda: write_binary_record(fb, encode_binary_event(event))]):
+              if encoder:
+                with encoder.encoded(event):
+                  write()
+              else:
+                write()
+      from_json = self.read_trace(json_file)
+      from_binary = self.read_trace(binary_file)
+      self.assertEqual(len(from_binary), len(events))
+      self.assertEqual(from_binary, from_json)
+      self.assertEqual(from_binary, [canonical(event) for event in events])
+      self.assertTrue(os.path.getsize(binary_file) < os.path.getsize(json_file))
+
+  def test_truncated_trace(self):
+    binary_file = os.path.join(self.tmp_dir, 'hb.bin')
+    events = make_events()
+    with open(binary_file, 'wb') as f:
+      write_binary_header(f)
+      for event in events:
+        write_binary_record(f, encode_binary_event(event))
+    with open(binary_file, 'rb') as f:
+      data = f.read()
+    with open(binary_file, 'wb') as f:
+      f.write(data[:-3])
+    self.assertEqual(len(self.read_trace(binary_file)), len(events) - 1)
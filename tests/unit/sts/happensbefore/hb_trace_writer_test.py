@@ -0,0 +1,69 @@
+import unittest
+import threading
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from sts.happensbefore.hb_trace_writer import AsyncTraceWriter
+
+
+class Output(object):
+  def __init__(self):
+    self.written = []
+    self.flushed = []
+    self.flush_event = threading.Event()
+
+  def write(self, item):
+    self.written.append(item)
+
+  def flush(self):
+    self.flushed = list(self.written)
+    self.flush_event.set()
+
+
+class AsyncTraceWriterTest(unittest.TestCase):
+
+  def test_close_writes_all_items(self):
+    output = Output()
+    writer = AsyncTraceWriter(output.write, output.flush, flush_interval=60,
+                              max_queued=10, batch_size=7)
+    for i in range(1000):
+      writer.write(i)
+    writer.close()
+    self.assertEqual(output.written, range(1000))
+    self.assertEqual(output.flushed, range(1000))
+    self.assertFalse(writer.thread.is_alive())
+    self.assertRaises(Exception, writer.write, 1000)
+
+  def test_sync(self):
+    output = Output()
+    writer = AsyncTraceWriter(output.write, output.flush, flush_interval=60)
+    writer.write('a')
+    writer.write('b')
+    writer.sync()
+    self.assertEqual(output.flushed, ['a', 'b'])
+    writer.close()
+
+  def test_flush_interval(self):
+    output = Output()
+    writer = AsyncTraceWriter(output.write, output.flush, flush_interval=0.01)
+    writer.write('a')
+    self.assertTrue(output.flush_event.wait(5))
+    writer.close()
+    self.assertEqual(output.flushed, ['a'])
+
+  def test_write_error(self):
+    output = Output()
+    def write_item(item):
+      if item == 3:
+        raise ValueError("cannot write %s" % item)
+      output.write(item)
+    writer = AsyncTraceWriter(write_item, output.flush, flush_interval=60)
+    for i in range(5):
+      writer.write(i)
+    writer.sync()
+    self.assertTrue(isinstance(writer.error, ValueError))
+    self.assertRaises(Exception, writer.write, 5)
+    writer.close()
+    self.assertEqual(output.flushed, [0, 1, 2])
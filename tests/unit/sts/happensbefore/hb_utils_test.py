@@ -0,0 +1,118 @@
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.openflow.flow_table import SwitchFlowTable
+from pox.openflow.libopenflow_01 import ofp_action_output
+from pox.openflow.libopenflow_01 import ofp_flow_mod
+from pox.openflow.libopenflow_01 import ofp_match
+from pox.openflow.libopenflow_01 import OFPFC_ADD
+from pox.openflow.libopenflow_01 import OFPFC_DELETE_STRICT
+from pox.openflow.libopenflow_01 import OFPFC_MODIFY
+from pox.openflow.libopenflow_01 import OFPFC_MODIFY_STRICT
+
+from sts.happensbefore.hb_shadow_table import ShadowFlowTable
+from sts.happensbefore.hb_sts_events import TraceSwitchFlowTableWrite
+from sts.happensbefore.hb_utils import base64_encode_flow
+from sts.happensbefore.hb_utils import base64_encode_flow_table
+from sts.happensbefore.hb_utils import flow_entry_digest
+from sts.happensbefore.hb_utils import intern_value
+from sts.happensbefore.hb_utils import packed_flow_mod_digest
+
+
+class FlowTableDigestTest(unittest.TestCase):
+
+  def test_ignores_xid(self):
+    self.assertEqual(packed_flow_mod_digest('\x01\x0e\x00\x48\x00\x00\x00\x07match'),
+                     packed_flow_mod_digest('\x01\x0e\x00\x48\x00\x00\x00\x00match'))
+    self.assertNotEqual(packed_flow_mod_digest('\x01\x0e\x00\x48\x00\x00\x00\x07match'),
+                        packed_flow_mod_digest('\x01\x0e\x00\x48\x00\x00\x00\x07other'))
+
+  def test_order_independent(self):
+    rows = ['\x01\x0e\x00\x48\x00\x00\x00\x00%d' % i for i in range(10)]
+    digest = sum(packed_flow_mod_digest(row) for row in rows)
+    self.assertEqual(digest, sum(packed_flow_mod_digest(row) for row in reversed(rows)))
+    self.assertNotEqual(digest, sum(packed_flow_mod_digest(row) for row in rows[1:]))
+
+
+class InternValueTest(unittest.TestCase):
+
+  def test_shared_instance(self):
+    dpid = 2 ** 40
+    self.assertTrue(intern_value(dpid) is intern_value(int(str(dpid))))
+    controller_id = intern_value([u'127.0.0.1', 6633])
+    self.assertEqual(controller_id, (u'127.0.0.1', 6633))
+    self.assertTrue(controller_id is intern_value([u'127.0.0.1', 6633]))
+    self.assertTrue(controller_id[0] is intern_value(u'127.0.0.1'))
+
+  def test_keeps_type(self):
+    self.assertEqual(type(intern_value(1)), int)
+    self.assertEqual(type(intern_value(1.0)), float)
+    self.assertEqual(type(intern_value(True)), bool)
+
+
+def flow_mod(in_port, out_port, command=OFPFC_ADD):
+  return ofp_flow_mod(match=ofp_match(in_port=in_port), command=command,
+                      actions=[ofp_action_output(port=out_port)])
+
+
+def trace_op(rows):
+  """A write whose flow table was read from a trace."""
+  return TraceSwitchFlowTableWrite(1, flow_mod(1, 1), flow_table=tuple(rows), make_copy=False)
+
+
+def trace_rows(table):
+  return base64_encode_flow_table(table, set_zero_XID=True)
+
+
+class ShadowFlowTableDigestTest(unittest.TestCase):
+
+  def test_digest_follows_writes(self):
+    shadow = ShadowFlowTable(1, digest_verification=True)
+    table = SwitchFlowTable()
+    self.assertTrue(shadow.agrees_with_trace(trace_op(trace_rows(table))))
+    for fm in [flow_mod(1, 2),
+               flow_mod(2, 1),
+               flow_mod(1, 3, OFPFC_MODIFY_STRICT),
+               flow_mod(3, 1, OFPFC_MODIFY), # acts as an add
+               flow_mod(2, 1, OFPFC_DELETE_STRICT),
+               flow_mod(1, 4)]: # same match as the first entry
+      shadow.table.process_flow_mod(fm)
+      table.process_flow_mod(fm)
+      self.assertEqual(shadow.digest, sum(flow_entry_digest(e) for e in shadow.table.table))
+      self.assertTrue(shadow.agrees_with_trace(trace_op(trace_rows(table))))
+    self.assertEqual(shadow.full_checks, 0)
+    self.assertEqual(shadow.digest_mismatches, 0)
+
+  def test_full_comparison_on_mismatch(self):
+    shadow = ShadowFlowTable(1, digest_verification=True)
+    shadow.table.process_flow_mod(flow_mod(1, 2))
+    # a different action
+    table = SwitchFlowTable()
+    table.process_flow_mod(flow_mod(1, 3))
+    self.assertFalse(shadow.agrees_with_trace(trace_op(trace_rows(table))))
+    self.assertEqual((shadow.digest_mismatches, shadow.full_checks), (1, 1))
+    # the same entry, encoded with a command that is not part of the entry
+    row = base64_encode_flow(flow_mod(1, 2, OFPFC_MODIFY), set_zero_XID=True)
+    self.assertTrue(shadow.agrees_with_trace(trace_op([row])))
+    self.assertEqual((shadow.digest_mismatches, shadow.full_checks), (2, 2))
+
+  def test_full_check_interval(self):
+    shadow = ShadowFlowTable(1, digest_verification=True, full_check_interval=3)
+    shadow.table.process_flow_mod(flow_mod(1, 2))
+    rows = trace_rows(shadow.table)
+    for _ in range(7):
+      self.assertTrue(shadow.agrees_with_trace(trace_op(rows)))
+    self.assertEqual((shadow.digest_mismatches, shadow.full_checks), (0, 2))
+    # tables that are not rows from a trace are always compared in full
+    op = TraceSwitchFlowTableWrite(1, flow_mod(1, 1), flow_table=shadow.table)
+    self.assertTrue(shadow.agrees_with_trace(op))
+    self.assertEqual(shadow.full_checks, 3)
+
+  def test_without_digest_verification(self):
+    shadow = ShadowFlowTable(1)
+    shadow.table.process_flow_mod(flow_mod(1, 2))
+    self.assertTrue(shadow.agrees_with_trace(trace_op(trace_rows(shadow.table))))
+    self.assertEqual((shadow.digest, shadow.full_checks), (0, 1))
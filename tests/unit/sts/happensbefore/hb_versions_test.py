@@ -0,0 +1,67 @@
+import unittest
+import random
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+
+
+class Op(object):
+  def __init__(self, t):
+    self.t = t
+
+
+class Cmd(object):
+  def __init__(self, t):
+    self.operations = [Op(t)]
+
+
+def single_linkage(times, threshold):
+  """Clusters of single linkage clustering, as sets of indices."""
+  clusters = [set([i]) for i in range(len(times))]
+  merged = True
+  while merged:
+    merged = False
+    for a in range(len(clusters)):
+      for b in range(a + 1, len(clusters)):
+        if any(abs(times[i] - times[j]) <= threshold for i in clusters[a] for j in clusters[b]):
+          clusters[a] |= clusters.pop(b)
+          merged = True
+          break
+      if merged:
+        break
+  return sorted(sorted(c) for c in clusters)
+
+
+class ClusterCmdsTest(unittest.TestCase):
+
+  def test_same_as_single_linkage(self):
+    rng = random.Random(0)
+    for _ in range(50):
+      times = [round(rng.uniform(0, 20), 1) for _ in range(rng.randint(0, 30))]
+      cmds = [Cmd(t) for t in times]
+      clustered = HappensBeforeGraph().cluster_cmds(cmds)
+      self.assertEqual(sorted(sorted(cmds.index(c) for c in cluster)
+                              for cluster in clustered.itervalues()),
+                       single_linkage(times, 0.8))
+      # versions are numbered in time order
+      starts = [min(c.operations[0].t for c in clustered[v]) for v in sorted(clustered)]
+      self.assertEqual(starts, sorted(starts))
+
+  def test_same_as_scipy(self):
+    try:
+      from scipy.cluster.hierarchy import fclusterdata
+    except ImportError:
+      return
+    rng = random.Random(1)
+    times = sorted(rng.uniform(0, 100) for _ in range(200))
+    result = fclusterdata([[t] for t in times], 0.8, criterion="distance")
+    expected = {}
+    for i, label in enumerate(result):
+      expected.setdefault(label, []).append(i)
+    cmds = [Cmd(t) for t in times]
+    clustered = HappensBeforeGraph().cluster_cmds(cmds)
+    self.assertEqual(sorted([cmds.index(c) for c in cluster] for cluster in clustered.itervalues()),
+                     sorted(expected.values()))
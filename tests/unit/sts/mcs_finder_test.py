@@ -17,23 +17,30 @@ import unittest
 import sys
 import os
 import shutil
+import time
 
 from sts.control_flow.mcs_finder import MCSFinder, EfficientMCSFinder
 from sts.replay_event import InputEvent, InvariantViolation
 from sts.event_dag import EventDag
+from sts.util.rpc_forker import LocalForker, ReplayException
+from config.experiment_config_lib import ControllerConfig
+from sts.entities.controllers import ControllerConfig as EntityControllerConfig
 import logging
 
 sys.path.append(os.path.dirname(__file__) + "/../../..")
 
 class MockSimulationConfig(object):
-  def __init__(self, ignore_interposition=False):
+  def __init__(self, ignore_interposition=False, controller_configs=None):
     self.ignore_interposition = ignore_interposition
+    self.controller_configs = controller_configs or []
 
 class MockMCSFinderBase(MCSFinder):
   ''' Overrides self.invariant_check and run_simulation_forward() '''
-  def __init__(self, event_dag, mcs):
-    super(MockMCSFinderBase, self).__init__(MockSimulationConfig(), event_dag,
-                                            invariant_check_name="InvariantChecker.check_liveness")
+  def __init__(self, event_dag, mcs, **kwargs):
+    simulation_cfg = kwargs.pop("simulation_cfg", MockSimulationConfig())
+    super(MockMCSFinderBase, self).__init__(simulation_cfg, event_dag,
+                                            invariant_check_name="InvariantChecker.check_liveness",
+                                            **kwargs)
     # Hack! Give a fake name in config.invariant_checks.name_to_invariant_checks, but
     # but remove it from our dict directly after. This is to prevent
     # sanity check exceptions from being thrown.
@@ -42,6 +49,7 @@ class MockMCSFinderBase(MCSFinder):
     self.mcs = mcs
     self.simulation = None
     self.transform_dag = None
+    self.replay_count = 0
 
   def log(self, message):
     self._log.info(message)
@@ -53,15 +61,38 @@ class MockMCSFinderBase(MCSFinder):
     return ["violation"]
 
   def replay(self, new_dag, hook=None, ignore_runtime_stats=False):
+    self.replay_count += 1
     self.new_dag = new_dag
     return self.invariant_check(new_dag)
 
+  def _play_forward_task(self, new_dag):
+    # Run in a forked child by parallel replays
+    def play_forward(results_dir, subsequence_id, controller_ports=None):
+      self.new_dag = new_dag
+      return (self.invariant_check(new_dag) != [], {}, [])
+    return play_forward
+
 # Horrible horrible hack. This way lies insanity
 class MockMCSFinder(MockMCSFinderBase, MCSFinder):
-  def __init__(self, event_dag, mcs):
-    MockMCSFinderBase.__init__(self, event_dag, mcs)
+  def __init__(self, event_dag, mcs, **kwargs):
+    MockMCSFinderBase.__init__(self, event_dag, mcs, **kwargs)
     self._log = logging.getLogger("mock_mcs_finder")
 
+class MockParallelMCSFinder(MockMCSFinder):
+  def __init__(self, event_dag, mcs):
+    MockMCSFinder.__init__(self, event_dag, mcs)
+    self.parallel_replays = 4
+
+class MockFailingParallelMCSFinder(MockParallelMCSFinder):
+  ''' Replays that contain the first mcs event raise, the others hang '''
+  def _play_forward_task(self, new_dag):
+    def play_forward(results_dir, subsequence_id, controller_ports=None):
+      if self.mcs[0] in new_dag._events_set:
+        raise RuntimeError("replay failed")
+      time.sleep(60)
+      return (False, {}, [])
+    return play_forward
+
 class MockEfficientMCSFinder(MockMCSFinderBase, EfficientMCSFinder):
   def __init__(self, event_dag, mcs):
     MockMCSFinderBase.__init__(self, event_dag, mcs)
@@ -89,6 +120,9 @@ class MCSFinderTest(unittest.TestCase):
   def test_basic_efficient(self):
     self.basic(MockEfficientMCSFinder)
 
+  def test_basic_parallel(self):
+    self.basic(MockParallelMCSFinder)
+
   def basic(self, mcs_finder_type):
     trace = [ MockInputEvent(fingerprint=("class",f)) for f in range(1,7) ]
     trace.append(InvariantViolation(["violation"], persistent=True))
@@ -109,6 +143,9 @@ class MCSFinderTest(unittest.TestCase):
   def test_straddle_efficient(self):
     self.straddle(MockEfficientMCSFinder)
 
+  def test_straddle_parallel(self):
+    self.straddle(MockParallelMCSFinder)
+
   def straddle(self, mcs_finder_type):
     trace = [ MockInputEvent(fingerprint=("class",f)) for f in range(1,7) ]
     trace.append(InvariantViolation(["violation"], persistent=True))
@@ -129,6 +166,9 @@ class MCSFinderTest(unittest.TestCase):
   def test_all_efficient(self):
     self.all(MockEfficientMCSFinder)
 
+  def test_all_parallel(self):
+    self.all(MockParallelMCSFinder)
+
   def all(self, mcs_finder_type):
     trace = [ MockInputEvent(fingerprint=("class",f)) for f in range(1,7) ]
     trace.append(InvariantViolation(["violation"], persistent=True))
@@ -143,5 +183,78 @@ class MCSFinderTest(unittest.TestCase):
       shutil.rmtree(mcs_results_path)
     self.assertEqual(mcs, mcs_finder.dag.input_events)
 
+  def test_parallel_replay_exception(self):
+    trace = [ MockInputEvent(fingerprint=("class",f)) for f in range(1,7) ]
+    trace.append(InvariantViolation(["violation"], persistent=True))
+    dag = EventDag(trace)
+    mcs_finder = MockFailingParallelMCSFinder(dag, [trace[0]])
+    try:
+      os.makedirs(mcs_results_path)
+      mcs_finder.init_results(mcs_results_path)
+      self.assertRaises(ReplayException, mcs_finder.simulate)
+    finally:
+      shutil.rmtree(mcs_results_path)
+    # The hanging replay was killed, and every child was reaped
+    self.assertEqual(set(), LocalForker._active_pids)
+
+  def test_parallel_replays_need_port_isolation(self):
+    trace = [ MockInputEvent(fingerprint=("class",f)) for f in range(1,7) ]
+    trace.append(InvariantViolation(["violation"], persistent=True))
+    dag = EventDag(trace)
+    isolated = [ ControllerConfig("./pox.py openflow.of_01 --port=__port__", cwd="pox")
+                 for _ in range(2) ]
+    fixed_port = ControllerConfig("./pox.py openflow.of_01 --port=6633", cwd="pox")
+    self.assertRaises(ValueError, MockMCSFinder, dag, [trace[0]], parallel_replays=2,
+                      simulation_cfg=MockSimulationConfig(controller_configs=[fixed_port]))
+    mcs_finder = MockMCSFinder(dag, [trace[0]], parallel_replays=2,
+                               simulation_cfg=MockSimulationConfig(controller_configs=isolated))
+    taken = [mcs_finder._free_controller_ports([])]
+    taken.append(mcs_finder._free_controller_ports(taken))
+    ports = [ port for ports in taken for port in ports ]
+    self.assertEqual(len(set(ports)), 4)
+    isolated[0].set_port(ports[0])
+    self.assertTrue("--port=%d" % ports[0] in isolated[0].expanded_start_cmd)
+    self.assertEqual(isolated[0].server_info, ("127.0.0.1", ports[0]))
+
+  def test_replay_cache_run_key(self):
+    trace = [ MockInputEvent(fingerprint=("class",f)) for f in range(1,7) ]
+    trace.append(InvariantViolation(["violation"], persistent=True))
+    dag = EventDag(trace)
+    def run_key(port):
+      # N.B. new config objects every time, as in a new process
+      controller_config = EntityControllerConfig("./pox.py --port=__port__", "", port=port, cid=1)
+      simulation_cfg = MockSimulationConfig(controller_configs=[controller_config])
+      mcs_finder = MockMCSFinder(dag, [trace[0]], simulation_cfg=simulation_cfg,
+                                 input_logger=object())
+      return mcs_finder._replay_cache_run_key()
+    self.assertEqual(run_key(6633), run_key(6633))
+    self.assertNotEqual(run_key(6633), run_key(6634))
+
+  def test_replay_cache(self):
+    trace = [ MockInputEvent(fingerprint=("class",f)) for f in range(1,7) ]
+    trace.append(InvariantViolation(["violation"], persistent=True))
+    dag = EventDag(trace)
+    mcs = [trace[1],trace[4]]
+    replay_cache_path = mcs_results_path + "_replay_cache.json"
+    replay_counts = []
+    try:
+      for _ in range(2):
+        mcs_finder = MockMCSFinder(dag, mcs)
+        mcs_finder.replay_cache_path = replay_cache_path
+        try:
+          os.makedirs(mcs_results_path)
+          mcs_finder.init_results(mcs_results_path)
+          mcs_finder.simulate()
+        finally:
+          shutil.rmtree(mcs_results_path)
+        self.assertEqual(mcs, mcs_finder.dag.input_events)
+        replay_counts.append(mcs_finder.replay_count)
+    finally:
+      if os.path.exists(replay_cache_path):
+        os.remove(replay_cache_path)
+    # The second run only replays the whole trace and the final MCS
+    self.assertTrue(replay_counts[0] > 2)
+    self.assertEqual(replay_counts[1], 2)
+
 if __name__ == '__main__':
   unittest.main()
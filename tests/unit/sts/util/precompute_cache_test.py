@@ -16,6 +16,8 @@
 import unittest
 import sys
 import os.path
+import shutil
+import tempfile
 
 sys.path.append(os.path.dirname(__file__) + "/../../..")
 
@@ -56,3 +58,31 @@ class precompute_cache_test(unittest.TestCase):
     self.assertTrue(p.already_done( (4,)))
     self.assertFalse(p.already_done( (1,2,3,4)))
 
+  def test_replay_results(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmp_dir, "replay_cache.json")
+      run_key = ReplayResultCache.digest("trace", "config")
+      c = ReplayResultCache(path, run_key)
+      self.assertEqual(c.get(("e1", "e2")), None)
+      c.update(("e1", "e2"), True, 1, ["e5"])
+      c.update(("e1",), False, 0, [])
+      self.assertEqual(c.get(("e1", "e2")), (True, 1, ["e5"]))
+      c.close()
+      # a crash while writing the last result
+      with open(path, "a") as f:
+        f.write('{"run": "%s", "inputs": ["e2"' % run_key)
+
+      c = ReplayResultCache(path, run_key)
+      self.assertEqual(c.get(("e1", "e2")), (True, 1, ["e5"]))
+      self.assertEqual(c.get(("e1",)), (False, 0, []))
+      self.assertEqual(c.get(("e2",)), None)
+      c.update(("e2",), False, 0, [])
+      c.close()
+      self.assertEqual(ReplayResultCache(path, run_key).get(("e2",)), (False, 0, []))
+
+      other_run_key = ReplayResultCache.digest("trace", "other config")
+      self.assertNotEqual(run_key, other_run_key)
+      self.assertEqual(ReplayResultCache(path, other_run_key).get(("e1",)), None)
+    finally:
+      shutil.rmtree(tmp_dir)
@@ -0,0 +1,68 @@
+# Copyright 2011-2013 Colin Scott
+# Copyright 2011-2013 Andreas Wundsam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import signal
+import time
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from sts.util.rpc_forker import LocalForker
+
+def handle_int(signum, frame):
+  # Like the handler of simulator.py
+  LocalForker.kill_all()
+  sys.exit(13)
+
+def finish():
+  time.sleep(2)
+  return "done"
+
+def hang():
+  time.sleep(60)
+  return "hung"
+
+class LocalForkerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.forker = LocalForker()
+    self.forker.register_task("finish", finish)
+    self.forker.register_task("hang", hang)
+
+  def test_wait_any(self):
+    children = [self.forker.start("finish"), self.forker.start("hang")]
+    (child, child_return) = self.forker.wait_any(children)
+    self.assertEqual((child, child_return), (children[0], "done"))
+    self.forker.cancel(children[1])
+    self.assertEqual(set(), LocalForker._active_pids)
+
+  def test_cancel_keeps_siblings(self):
+    old_handler = signal.signal(signal.SIGTERM, handle_int)
+    try:
+      first = self.forker.start("finish")
+      second = self.forker.start("hang")
+      # let the second child start its task
+      time.sleep(0.5)
+      # the handler of the second child must not kill the first one
+      self.forker.cancel(second)
+      self.assertEqual(self.forker.wait_any([first]), (first, "done"))
+    finally:
+      signal.signal(signal.SIGTERM, old_handler)
+    self.assertEqual(set(), LocalForker._active_pids)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for loading happens-before traces (hb.json), and for the
+JSON and binary trace encodings (see hb_trace_format).
+
+Sample usage:
+./tools/benchmark_hb_trace.py traces/trace_floodlight_forwarding/hb.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from sts.happensbefore.hb_json_event import JsonEvent
+from sts.happensbefore.hb_graph import HappensBeforeGraph
+from sts.happensbefore.hb_trace_format import decode_binary_record
+from sts.happensbefore.hb_trace_format import encode_binary_event
+import sts.happensbefore.hb_events
+import sts.happensbefore.hb_sts_events
+
+
+def read_lines(filename):
+  with open(filename) as f:
+    return [line for line in f if line.strip() and not line.startswith('#')]
+
+
+def timed(fun, lines, repeat):
+  best = None
+  for _ in range(repeat):
+    t0 = time.time()
+    fun(lines)
+    elapsed = time.time() - t0
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def parse_only(lines):
+  for line in lines:
+    json.loads(line)
+
+
+def parse_and_decode(lines):
+  for line in lines:
+    JsonEvent.from_json(json.loads(line))
+
+
+def decode_events(lines):
+  graph = HappensBeforeGraph()
+  return [event for event in (graph.unpack_line(line) for line in lines) if event]
+
+
+def encode_json(events):
+  return [event.to_json() for event in events]
+
+
+def encode_binary(events):
+  return [encode_binary_event(event) for event in events]
+
+
+def decode_binary(records):
+  for record in records:
+    decode_binary_record(record)
+
+
+def timed_insertion(events, repeat):
+  """Best time to add the decoded events to a new graph."""
+  best = None
+  for _ in range(repeat):
+    graph = HappensBeforeGraph()
+    t0 = time.time()
+    for event in events:
+      graph.add_event(event)
+    elapsed = time.time() - t0
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def report(name, elapsed, num_events, baseline=None):
+  rate = num_events / elapsed if elapsed else float('inf')
+  extra = ""
+  if baseline:
+    extra = " (%.2fx of json.loads)" % (elapsed / baseline)
+  print "%-20s %8.3f s %12.0f events/s%s" % (name, elapsed, rate, extra)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('trace_file', help='Trace file, usually "hb.json"')
+  parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                      help="Repeat each measurement and report the best run")
+  args = parser.parse_args()
+
+  lines = read_lines(args.trace_file)
+  print "Loaded %d events from %s" % (len(lines), args.trace_file)
+  t_parse = timed(parse_only, lines, args.repeat)
+  report("json.loads", t_parse, len(lines))
+  report("JsonEvent.from_json", timed(parse_and_decode, lines, args.repeat),
+         len(lines), t_parse)
+  events = decode_events(lines)
+  report("add_event", timed_insertion(events, args.repeat), len(events))
+
+  # Both encodings of the loaded events, with full flow tables
+  json_lines = encode_json(events)
+  records = encode_binary(events)
+  print "Encoded size: json %.1f MB, binary %.1f MB" % (
+    sum(len(x) + 1 for x in json_lines) / 1e6, sum(len(x) + 4 for x in records) / 1e6)
+  report("encode json", timed(encode_json, events, args.repeat), len(events))
+  report("encode binary", timed(encode_binary, events, args.repeat), len(events))
+  report("decode json", timed(parse_and_decode, json_lines, args.repeat), len(events))
+  report("decode binary", timed(decode_binary, records, args.repeat), len(events))